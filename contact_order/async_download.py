@@ -0,0 +1,162 @@
+import asyncio
+import os
+import time
+from urllib.parse import quote
+from download_retry import TRANSIENT, backoff_delay, classify_failure, failure_message
+
+TOKEN_PATH = "..."
+
+# Default GCS endpoint; STORAGE_EMULATOR_HOST (e.g. download_tests/fake_gcs_server.py) overrides it.
+GCS_ENDPOINT = "https://storage.googleapis.com"
+READ_ONLY_SCOPE = "https://www.googleapis.com/auth/devstorage.read_only"
+
+
+def media_url(gs_url, endpoint=None, api="json"):
+    """
+    Media download URL of a gs:// object on the JSON API
+    (/download/storage/v1/b/<bucket>/o/<object>?alt=media) or the XML API
+    (/<bucket>/<object>). http(s):// URLs are returned unchanged.
+    """
+    gs_url = gs_url.strip()
+    if not gs_url.startswith("gs://"):
+        return gs_url
+    endpoint = (endpoint or os.getenv("STORAGE_EMULATOR_HOST") or GCS_ENDPOINT).rstrip("/")
+    bucket_name, blob_name = gs_url.replace('gs://', '').split('/', 1)
+    if api == "xml":
+        return f"{endpoint}/{bucket_name}/{quote(blob_name)}"
+    return f"{endpoint}/download/storage/v1/b/{bucket_name}/o/{quote(blob_name, safe='')}?alt=media"
+
+
+class _AccessToken:
+    """
+    OAuth token from a service account file, refreshed shortly before it expires.
+    No token is used with STORAGE_EMULATOR_HOST or without a token file.
+    """
+
+    def __init__(self, token_path=None):
+        self.credentials = None
+        if token_path and os.path.exists(token_path) and not os.getenv("STORAGE_EMULATOR_HOST"):
+            from google.oauth2 import service_account
+            self.credentials = service_account.Credentials.from_service_account_file(
+                token_path, scopes=[READ_ONLY_SCOPE]
+            )
+        self._lock = asyncio.Lock()
+
+    async def headers(self):
+        if self.credentials is None:
+            return {}
+        async with self._lock:
+            if not self.credentials.valid:
+                from google.auth.transport.requests import Request
+                # The refresh is a blocking HTTP call; keep it off the event loop.
+                await asyncio.to_thread(self.credentials.refresh, Request())
+        return {"Authorization": f"Bearer {self.credentials.token}"}
+
+
+async def _fetch(session, url, token):
+    import aiohttp
+
+    try:
+        async with session.get(url, headers=await token.headers()) as response:
+            # A ClientResponseError carries the status, see download_retry.http_status.
+            response.raise_for_status()
+            return await response.read()
+    except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError) as e:
+        # Dropped connections and truncated bodies are transient; not all of
+        # aiohttp's connection errors are OSErrors.
+        raise ConnectionError(str(e) or type(e).__name__) from e
+
+
+async def fetch_all(urls, download_folder=None, on_data=None, on_done=None, max_in_flight=256, max_connections=32,
+                    api="json", token_path=None, retries=3, backoff=0.5, max_backoff=30.0, timeout=120):
+    """
+    Download many objects concurrently from one event loop. Up to `max_in_flight`
+    requests are in progress at once, multiplexed over at most `max_connections`
+    keep-alive connections, instead of one blocking thread per request.
+
+    Parameters:
+        urls (list): gs:// (or http(s)://) URLs.
+        download_folder (str): Write every file there (named after the object).
+        on_data (callable): Called as on_data(url, data) in the event loop thread
+            when a file has arrived, e.g. to submit it to a compute executor;
+            it must not block.
+        on_done (callable): Called as on_done(url, error) when a file is finished,
+            error being None on success (e.g. for progress reporting).
+        max_in_flight (int): Concurrent requests.
+        max_connections (int): Size of the connection pool.
+        api (str): "json" or "xml" media endpoint, see media_url.
+        token_path (str): Service account file for authenticated downloads.
+        retries (int): Retries of transient failures (408/429/5xx responses, dropped
+            connections, timeouts; see download_retry.classify_failure).
+        backoff (float): Base delay in seconds of the exponential backoff.
+        max_backoff (float): Upper bound of a single delay in seconds.
+        timeout (float): Total timeout per request in seconds.
+
+    Returns:
+        list: (url, local_path or None, error or None) per URL, in input order.
+    """
+    import aiohttp
+
+    token = _AccessToken(token_path)
+    connector = aiohttp.TCPConnector(limit=max_connections)
+    results = [None] * len(urls)
+    # A fixed set of worker coroutines share one iterator, so there are never
+    # more than max_in_flight tasks, however long the URL list is.
+    pending = iter(enumerate(urls))
+
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+
+        async def download(url):
+            url = url.strip()
+            attempt = 0
+            while True:
+                try:
+                    data = await _fetch(session, media_url(url, api=api), token)
+                    break
+                except Exception as e:
+                    if classify_failure(e) != TRANSIENT or attempt == retries:
+                        return url, None, failure_message(e, attempt + 1)
+                await asyncio.sleep(backoff_delay(attempt, backoff, max_backoff))
+                attempt += 1
+
+            local_path = None
+            if download_folder is not None:
+                local_path = os.path.join(download_folder, url.split('/')[-1])
+                # Small files: a blocking write is cheaper than a hop to a thread.
+                with open(local_path, 'wb') as f:
+                    f.write(data)
+            if on_data is not None:
+                on_data(url, data)
+            return url, local_path, None
+
+        async def worker():
+            for index, url in pending:
+                results[index] = await download(url)
+                if on_done is not None:
+                    on_done(results[index][0], results[index][2])
+
+        await asyncio.gather(*(worker() for _ in range(min(max_in_flight, len(urls)))))
+
+    return results
+
+
+def download_all(urls, download_folder=None, on_data=None, on_done=None, **kwargs):
+    """
+    Blocking wrapper around fetch_all for code that is not async itself.
+    """
+    return asyncio.run(fetch_all(urls, download_folder, on_data, on_done, **kwargs))
+
+
+if __name__ == "__main__":
+    # python async_download.py <manifest> <download folder>
+    import sys
+
+    with open(sys.argv[1], 'r') as f:
+        urls = [line.strip() for line in f if line.strip()]
+    os.makedirs(sys.argv[2], exist_ok=True)
+
+    start_time = time.time()
+    results = download_all(urls, sys.argv[2], token_path=TOKEN_PATH)
+    elapsed_time = time.time() - start_time
+    errors = [result for result in results if result[2] is not None]
+    print(f"Downloaded {len(urls) - len(errors)}/{len(urls)} files in {elapsed_time:.2f} seconds")
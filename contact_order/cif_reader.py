@@ -0,0 +1,299 @@
+import gzip
+import io
+import re
+import numpy as np
+from Bio.PDB.MMCIFParser import MMCIFParser
+
+ATOM_SITE_PREFIX = b"_atom_site."
+GLOBAL_METRIC_PREFIX = b"_ma_qa_metric_global."
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Quoted tokens only appear in rows like nucleic-acid atom names ("C1'"); this
+# is the slow path and is used only when a plain split gives the wrong width.
+_CIF_TOKEN = re.compile(rb"""'(?:[^']|'(?=\S))*'|"(?:[^"]|"(?=\S))*"|\S+""")
+
+
+class MissingPlddtError(ValueError):
+    """
+    A pLDDT threshold was given for a file without per-residue pLDDT
+    (_atom_site.B_iso_or_equiv). read_coordinates does not fall back to Biopython
+    for it: without the column every residue would count as pLDDT 0 and be masked.
+    """
+
+    def __init__(self):
+        super().__init__("Missing _atom_site column: B_iso_or_equiv, needed for the per-residue pLDDT filter")
+
+
+def _open_source(source):
+    """
+    Return a binary file handle for a path, raw bytes or an open handle (or an
+    iterator of lines, e.g. a download streamed by range_fetch.iter_atom_site).
+    Gzip-compressed paths (.gz) and bytes are decompressed on the fly.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        if bytes(source[:2]) == GZIP_MAGIC:
+            return gzip.GzipFile(fileobj=io.BytesIO(source)), True
+        return io.BytesIO(source), True
+    if hasattr(source, "read") or hasattr(source, "__next__"):
+        return source, False
+    if str(source).endswith(".gz"):
+        return gzip.open(source, "rb"), True
+    return open(source, "rb"), True
+
+
+def _split_row(line, num_columns):
+    tokens = line.split()
+    if len(tokens) == num_columns:
+        return tokens
+
+    tokens = [t[1:-1] if t[:1] in (b"'", b'"') else t for t in _CIF_TOKEN.findall(line)]
+    if len(tokens) != num_columns:
+        raise ValueError("Unsupported _atom_site row layout for the fast reader")
+    return tokens
+
+
+def _scan_atom_site(lines):
+    """
+    Scan for the _atom_site loop; yield its column names, then the tokens of every CA row.
+    """
+    columns = []
+    in_header = False
+
+    for line in lines:
+        if in_header:
+            stripped = line.strip()
+            if stripped.startswith(b"_"):
+                if stripped.startswith(ATOM_SITE_PREFIX):
+                    columns.append(stripped[len(ATOM_SITE_PREFIX):].decode())
+                continue
+            in_header = False
+            if not columns:
+                continue
+            yield columns
+        elif not columns:
+            if line.strip() == b"loop_":
+                in_header = True
+            continue
+
+        stripped = line.strip()
+        if not stripped:
+            continue
+        if stripped[:1] in (b"#", b"_") or stripped.startswith((b"loop_", b"data_")):
+            return
+        # Cheap substring test first, so non-CA atoms are never tokenised.
+        if b"CA" not in stripped:
+            continue
+        yield _split_row(stripped, len(columns))
+
+    if in_header and columns:
+        yield columns
+
+
+def read_global_plddt(source):
+    """
+    Read the global pLDDT (_ma_qa_metric_global.metric_value of an AlphaFold
+    model) from the metadata, without tokenising any _atom_site rows. The file
+    is searched block by block and reading stops at the metric, which AlphaFold
+    files have before the coordinates; files with it after the coordinates, or
+    without one, are read to the end.
+
+    Parameters:
+        source (str | bytes | file): Path to the CIF (or .cif.gz) file, its raw or gzipped
+            content, or a binary handle.
+
+    Returns:
+        float | None: The global pLDDT, or None if the file has none.
+    """
+    handle, should_close = _open_source(source)
+    try:
+        head = b""
+        while True:
+            block = handle.read(1 << 16)
+            head += block
+            start = head.find(b"\n" + GLOBAL_METRIC_PREFIX)
+            if start >= 0:
+                # Keep only the metric, and read on until its block ends.
+                head, start = head[start:], 0
+                if head.find(b"\n#", 1) >= 0 or not block:
+                    break
+            elif not block:
+                return None
+            else:
+                # Keep just enough for a prefix split across blocks.
+                head = head[-len(GLOBAL_METRIC_PREFIX):]
+    finally:
+        if should_close:
+            handle.close()
+
+    columns = []
+    in_loop = False
+    for line in head[start + 1:].splitlines():
+        stripped = line.strip()
+        if stripped.startswith(GLOBAL_METRIC_PREFIX):
+            tokens = stripped.split()
+            if in_loop or len(tokens) == 1:
+                # Loop form: column names first, values on the rows that follow.
+                in_loop = True
+                columns.append(tokens[0][len(GLOBAL_METRIC_PREFIX):])
+            elif tokens[0] == GLOBAL_METRIC_PREFIX + b"metric_value":
+                return float(tokens[1])
+            continue
+        if not in_loop or not stripped or stripped[:1] in (b"#", b"_") or stripped == b"loop_":
+            return None
+        row = dict(zip(columns, _split_row(stripped, len(columns))))
+        if row.get(b"metric_type", b"pLDDT") == b"pLDDT" and b"metric_value" in row:
+            return float(row[b"metric_value"])
+    return None
+
+
+def read_ca_coordinates(source, min_plddt=None):
+    """
+    Read alpha-carbon coordinates straight from the _atom_site loop of an mmCIF file.
+    Only CA rows are tokenised; no Structure/Atom objects are built.
+
+    Residues are identified the same way as Bio.PDB.MMCIFParser (model, auth chain,
+    auth residue number, insertion code, residue name), and for alternate locations
+    the CA with the highest occupancy is kept.
+
+    Parameters:
+        source (str | bytes | file): Path to the CIF (or .cif.gz) file, its raw or gzipped
+            content, a binary handle or an iterator of lines.
+        min_plddt (float): If given, residues whose CA pLDDT (B_iso_or_equiv in
+            AlphaFold models) is below it get NaN coordinates. They keep their
+            place, so sequence separations are unchanged, and the contact kernels
+            leave them out. Files without the column raise MissingPlddtError.
+
+    Returns:
+        np.ndarray: C-contiguous float32 array of shape (num_residues, 3).
+    """
+    handle, should_close = _open_source(source)
+    try:
+        rows = _scan_atom_site(handle)
+        columns = next(rows, None)
+        if columns is None:
+            return np.empty((0, 3), dtype=np.float32)
+
+        index = {name: i for i, name in enumerate(columns)}
+        try:
+            atom_col = index["label_atom_id"]
+            xyz_cols = (index["Cartn_x"], index["Cartn_y"], index["Cartn_z"])
+        except KeyError as e:
+            raise ValueError(f"Missing _atom_site column: {e.args[0]}") from None
+        seq_col = index.get("auth_seq_id", index.get("label_seq_id"))
+        key_cols = [
+            index[name]
+            for name in ("pdbx_PDB_model_num", "auth_asym_id", "label_comp_id", "group_PDB", "pdbx_PDB_ins_code")
+            if name in index
+        ]
+        occupancy_col = index.get("occupancy")
+        plddt_col = index.get("B_iso_or_equiv")
+        if min_plddt is not None and plddt_col is None:
+            raise MissingPlddtError()
+
+        coordinates = []
+        occupancies = []
+        plddts = []
+        last_key = None
+
+        for tokens in rows:
+            if tokens[atom_col] != b"CA":
+                continue
+            if seq_col is not None and tokens[seq_col] == b".":
+                continue
+
+            key = (tokens[seq_col] if seq_col is not None else None, *(tokens[i] for i in key_cols))
+            occupancy = tokens[occupancy_col] if occupancy_col is not None else b"1"
+            if key == last_key:
+                # Alternate location of the residue we just stored.
+                if float(occupancy) > float(occupancies[-1]):
+                    coordinates[-3:] = [tokens[i] for i in xyz_cols]
+                    occupancies[-1] = occupancy
+                    if min_plddt is not None:
+                        plddts[-1] = tokens[plddt_col]
+                continue
+
+            last_key = key
+            coordinates.extend(tokens[i] for i in xyz_cols)
+            occupancies.append(occupancy)
+            if min_plddt is not None:
+                plddts.append(tokens[plddt_col])
+    finally:
+        if should_close:
+            handle.close()
+
+    # Parse via float64 and round once, exactly like Biopython's np.array(..., "f").
+    coordinates = np.ascontiguousarray(np.array(coordinates, dtype=np.float64).astype(np.float32).reshape(-1, 3))
+    if min_plddt is not None:
+        coordinates[np.array(plddts, dtype=np.float64) < min_plddt] = np.nan
+    return coordinates
+
+
+def read_ca_coordinates_biopython(source, min_plddt=None):
+    """
+    Reference reader: build a full Biopython Structure and collect CA coordinates.
+
+    Parameters:
+        source (str | bytes | file): Path to the CIF file, its raw content, or a handle.
+        min_plddt (float): NaN coordinates for residues below it, see read_ca_coordinates.
+
+    Returns:
+        np.ndarray: Float32 array of shape (num_residues, 3).
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)) or str(source).endswith(".gz"):
+        handle, _ = _open_source(source)
+        with handle:
+            source = io.StringIO(handle.read().decode())
+    elif hasattr(source, "read") and isinstance(source.read(0), bytes):
+        source = io.TextIOWrapper(source)
+
+    parser = MMCIFParser(QUIET=True)
+    try:
+        structure = parser.get_structure("protein", source)
+    except KeyError:
+        if min_plddt is not None and "_atom_site.B_iso_or_equiv" not in getattr(parser, "_mmcif_dict", {}):
+            raise MissingPlddtError() from None
+        raise
+    if min_plddt is not None and "_atom_site.B_iso_or_equiv" not in parser._mmcif_dict:
+        # Biopython versions that default the B-factor to 0 parse such files.
+        raise MissingPlddtError()
+
+    coordinates = []
+    for model in structure:
+        for chain in model:
+            for residue in chain:
+                if 'CA' in residue:
+                    ca = residue['CA']
+                    if min_plddt is not None and ca.get_bfactor() < min_plddt:
+                        coordinates.append(np.full(3, np.nan, dtype=np.float32))
+                    else:
+                        coordinates.append(ca.get_coord())
+
+    return np.array(coordinates, dtype=np.float32).reshape(-1, 3)
+
+
+def read_coordinates(source, parser="fast", min_plddt=None):
+    """
+    Read CA coordinates with the selected parser.
+
+    Parameters:
+        source (str | bytes | file): Path to the CIF file, its raw content, or a handle.
+        parser (str): "fast" for the streaming _atom_site reader (falls back to Biopython
+            on layouts it does not support) or "biopython" for the reference parser.
+        min_plddt (float): NaN coordinates for residues below it, see read_ca_coordinates.
+
+    Returns:
+        np.ndarray: Float32 array of shape (num_residues, 3).
+    """
+    if parser == "biopython":
+        return read_ca_coordinates_biopython(source, min_plddt)
+    if parser != "fast":
+        raise ValueError(f"Unknown parser: {parser}")
+
+    try:
+        return read_ca_coordinates(source, min_plddt)
+    except MissingPlddtError:
+        raise
+    except ValueError:
+        if hasattr(source, "seek"):
+            source.seek(0)
+        return read_ca_coordinates_biopython(source, min_plddt)
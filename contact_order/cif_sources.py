@@ -0,0 +1,60 @@
+import gzip
+import os
+import tarfile
+
+CIF_SUFFIXES = (".cif", ".cif.gz")
+SHARD_SUFFIXES = (".tar", ".tar.gz", ".tgz")
+
+
+def is_shard(path):
+    return path.endswith(SHARD_SUFFIXES)
+
+
+def list_inputs(directory, with_sizes=False):
+    """
+    Split a directory listing into loose CIF files (.cif, .cif.gz) and tar shards.
+
+    Parameters:
+        directory (str): Input directory.
+        with_sizes (bool): Also return the size in bytes of every input, read in
+            the same os.scandir pass.
+
+    Returns:
+        tuple: (cif_files, shards), both lists of paths, and with with_sizes a
+            dict path -> size as the third element.
+    """
+    cif_files = []
+    shards = []
+    sizes = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.endswith(CIF_SUFFIXES):
+                cif_files.append(entry.path)
+            elif is_shard(entry.name):
+                shards.append(entry.path)
+            else:
+                continue
+            if with_sizes:
+                sizes[entry.path] = entry.stat().st_size
+    return (cif_files, shards, sizes) if with_sizes else (cif_files, shards)
+
+
+def iter_shard(shard_path):
+    """
+    Stream CIF members out of a tar shard (e.g. an AlphaFold bulk-download
+    archive of .cif.gz files) in archive order, without unpacking to the
+    filesystem. .cif.gz members are decompressed in memory.
+
+    Yields:
+        tuple: (name, data) with name "<shard_path>/<member name>" and the
+            decompressed file content as bytes.
+    """
+    # "r|*" reads the archive strictly sequentially (no seeking), compressed or not.
+    with tarfile.open(shard_path, "r|*") as tar:
+        for member in tar:
+            if not member.isfile() or not member.name.endswith(CIF_SUFFIXES):
+                continue
+            data = tar.extractfile(member).read()
+            if member.name.endswith(".gz"):
+                data = gzip.decompress(data)
+            yield f"{shard_path}/{member.name}", data
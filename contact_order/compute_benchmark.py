@@ -0,0 +1,303 @@
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from cif_reader import _scan_atom_site, read_coordinates
+from contact_kernel import CONTACT_METHODS, aggregate_contacts, contact_metrics_batch, contact_metrics_from_coordinates
+
+# Compute-side benchmark: times every stage of calculate_contact_order on
+# synthetic AlphaFold-like CIF files of increasing size, and records the peak
+# memory of a whole task. Results are JSON in a fixed layout (FORMAT_VERSION),
+# so a run can be compared against a stored baseline:
+#
+#   python compute_benchmark.py --output baseline.json
+#   ... change the parser or kernel ...
+#   python compute_benchmark.py --baseline baseline.json   # exit status 1 on regressions
+#
+# --batch adds structures/s of the batched small-structure kernel versus one-by-one calls.
+
+FORMAT_VERSION = 1
+STAGES = ("read", "parse", "extract", "contacts", "aggregate")
+DEFAULT_SIZES = (50, 100, 200, 400, 800, 1600, 2700)
+BATCH_SIZES = (30, 60, 100, 200, 300, 400)
+
+_RESIDUES = ["ALA", "GLY", "SER", "LEU", "LYS", "GLU", "ASP", "VAL", "MET", "PHE"]
+_ATOM_SITE_COLUMNS = (
+    "group_PDB id type_symbol label_atom_id label_alt_id label_comp_id label_asym_id label_entity_id "
+    "label_seq_id pdbx_PDB_ins_code Cartn_x Cartn_y Cartn_z occupancy B_iso_or_equiv pdbx_formal_charge "
+    "auth_seq_id auth_comp_id auth_asym_id auth_atom_id pdbx_PDB_model_num"
+).split()
+
+
+def synthetic_cif(num_residues, seed=0):
+    """
+    A single-chain mmCIF file laid out like an AlphaFold model: global and
+    per-residue pLDDT blocks followed by an _atom_site loop with 4-6 atoms per
+    residue. The CA trace is a compacted random walk with 3.8 Å steps, so the
+    contact density is in the range of real proteins.
+
+    Returns:
+        str: File content.
+    """
+    rng = np.random.default_rng(seed)
+    steps = rng.normal(size=(num_residues, 3))
+    steps *= 3.8 / np.linalg.norm(steps, axis=1)[:, None]
+    ca = np.cumsum(steps, axis=0) * 0.6
+    sequence = [_RESIDUES[k] for k in rng.integers(0, len(_RESIDUES), num_residues)]
+    plddt = rng.uniform(30, 98, num_residues)
+
+    lines = [f"data_AF-SYN{num_residues}-F1\n#\n_entry.id AF-SYN{num_residues}-F1\n#\n"]
+    lines.append(f"_ma_qa_metric_global.metric_id 1\n_ma_qa_metric_global.metric_value {plddt.mean():.2f}\n#\n")
+    lines.append("loop_\n" + "".join(f"_ma_qa_metric_local.{name}\n" for name in (
+        "label_asym_id", "label_comp_id", "label_seq_id", "metric_id", "metric_value", "model_id", "ordinal_id")))
+    for k in range(num_residues):
+        lines.append(f"A {sequence[k]} {k + 1} 2 {plddt[k]:.2f} 1 {k + 1}\n")
+    lines.append("#\nloop_\n" + "".join(f"_atom_site.{name}\n" for name in _ATOM_SITE_COLUMNS))
+
+    atom_id = 1
+    for k in range(num_residues):
+        atoms = ["N", "CA", "C", "O"] if sequence[k] == "GLY" else ["N", "CA", "C", "O", "CB", "CG"]
+        for atom in atoms:
+            x, y, z = ca[k] if atom == "CA" else ca[k] + rng.normal(size=3) * 1.5
+            lines.append(
+                f"ATOM {atom_id:<5} {atom[0]} {atom:<3} . {sequence[k]} A 1 {k + 1:<4} ? {x:.3f} {y:.3f} {z:.3f} "
+                f"1.00 {plddt[k]:.2f} ? {k + 1:<4} {sequence[k]} A {atom:<3} 1\n"
+            )
+            atom_id += 1
+    lines.append("#\n")
+    return "".join(lines)
+
+
+def _parse(data, parser):
+    # Tokenising the file without building coordinates; "extract" is the remainder of read_coordinates.
+    if parser == "biopython":
+        from Bio.PDB.MMCIFParser import MMCIFParser
+        MMCIFParser(QUIET=True).get_structure("protein", io.StringIO(data.decode()))
+    else:
+        for _ in _scan_atom_site(io.BytesIO(data)):
+            pass
+
+
+def run_task(cif_file, parser="fast", method="cell_list", distance_cutoffs=(8.0,), metrics=("relative",)):
+    """
+    Run one contact order task stage by stage.
+
+    Stages:
+        read: load the file from disk.
+        parse: tokenise it (fast: scan the _atom_site loop; biopython: build the Structure).
+        extract: the rest of read_coordinates (CA selection, altlocs, array conversion).
+        contacts: neighbour search (contact_kernel.CONTACT_METHODS).
+        aggregate: reduction to the metric columns (contact_kernel.aggregate_contacts).
+
+    Returns:
+        dict: Stage -> seconds.
+    """
+    timings = {}
+    start = time.perf_counter()
+    with open(cif_file, 'rb') as f:
+        data = f.read()
+    timings["read"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    _parse(data, parser)
+    timings["parse"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    coordinates = read_coordinates(data, parser=parser)
+    timings["extract"] = max(0.0, time.perf_counter() - start - timings["parse"])
+
+    start = time.perf_counter()
+    i, j, distances = CONTACT_METHODS[method](coordinates, max(distance_cutoffs))
+    timings["contacts"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    aggregate_contacts(i, j, distances, len(coordinates), distance_cutoffs, metrics)
+    timings["aggregate"] = time.perf_counter() - start
+
+    return timings
+
+
+def peak_memory(cif_file, parser="fast", method="cell_list", distance_cutoffs=(8.0,), metrics=("relative",)):
+    """
+    Peak bytes allocated by a whole task (tracemalloc also tracks NumPy buffers).
+    Measured in a separate run, since tracing slows down the timed stages.
+    """
+    tracemalloc.start()
+    try:
+        coordinates = read_coordinates(cif_file, parser=parser)
+        i, j, distances = CONTACT_METHODS[method](coordinates, max(distance_cutoffs))
+        aggregate_contacts(i, j, distances, len(coordinates), distance_cutoffs, metrics)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_benchmark(sizes=DEFAULT_SIZES, parsers=("fast",), methods=("cell_list",), repeats=7,
+                  distance_cutoffs=(8.0,), metrics=("relative",)):
+    """
+    Time every parser/method combination on synthetic files of the given sizes.
+    Stage times are the minimum over `repeats` runs, which is far less sensitive
+    to noise from other processes than the mean or median.
+
+    Returns:
+        list: One result dict per (parser, method, residues).
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        files = {}
+        for num_residues in sizes:
+            files[num_residues] = os.path.join(directory, f"AF-SYN{num_residues}-F1-model_v4.cif")
+            with open(files[num_residues], 'w') as f:
+                f.write(synthetic_cif(num_residues, seed=num_residues))
+
+        for parser in parsers:
+            for method in methods:
+                for num_residues, cif_file in files.items():
+                    runs = [run_task(cif_file, parser, method, distance_cutoffs, metrics) for _ in range(repeats)]
+                    row = {"parser": parser, "method": method, "residues": num_residues}
+                    for stage in STAGES:
+                        row[f"{stage}_s"] = min(run[stage] for run in runs)
+                    row["total_s"] = min(sum(run.values()) for run in runs)
+                    row["peak_memory_bytes"] = peak_memory(cif_file, parser, method, distance_cutoffs, metrics)
+                    results.append(row)
+                    print(f"{parser:>9} {method:>9} {num_residues:>5} residues: "
+                          + " ".join(f"{stage} {row[f'{stage}_s'] * 1e3:.2f}" for stage in STAGES)
+                          + f" ms, peak {row['peak_memory_bytes'] / 2**20:.1f} MiB")
+    return results
+
+
+def run_batch_benchmark(sizes=BATCH_SIZES, num_structures=256, repeats=3, distance_cutoffs=(8.0,),
+                        metrics=("relative",)):
+    """
+    Structures per second of the contact computation (coordinates already
+    extracted) one structure at a time versus contact_metrics_batch, on
+    `num_structures` synthetic structures of about each size.
+
+    Returns:
+        list: One result dict per size (per_structure_per_s, batch_per_s, speedup).
+    """
+    results = []
+    for num_residues in sizes:
+        coordinate_list = [
+            read_coordinates(synthetic_cif(num_residues + k % 11, seed=k).encode()) for k in range(num_structures)
+        ]
+        per_structure = min(_elapsed(lambda: [
+            contact_metrics_from_coordinates(coordinates, distance_cutoffs, metrics) for coordinates in coordinate_list
+        ]) for _ in range(repeats))
+        batch = min(_elapsed(lambda: contact_metrics_batch(coordinate_list, distance_cutoffs, metrics))
+                    for _ in range(repeats))
+        row = {
+            "residues": num_residues,
+            "structures": num_structures,
+            "per_structure_per_s": num_structures / per_structure,
+            "batch_per_s": num_structures / batch,
+            "speedup": per_structure / batch,
+        }
+        results.append(row)
+        print(f"{num_residues:>5} residues: {row['per_structure_per_s']:.0f} structures/s one by one, "
+              f"{row['batch_per_s']:.0f} batched ({row['speedup']:.2f}x)")
+    return results
+
+
+def _elapsed(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def compare(results, baseline_results, threshold=0.25, min_seconds=1e-3):
+    """
+    Compare results with a baseline run.
+
+    Parameters:
+        results (list): Results of this run.
+        baseline_results (list): Results of the baseline run.
+        threshold (float): Relative slowdown (or memory growth) that counts as a regression.
+        min_seconds (float): Stage times below this in both runs are ignored as noise.
+
+    Returns:
+        list: Regression dicts (parser, method, residues, metric, baseline, current, ratio).
+    """
+    baseline = {(row["parser"], row["method"], row["residues"]): row for row in baseline_results}
+    regressions = []
+    for row in results:
+        reference = baseline.get((row["parser"], row["method"], row["residues"]))
+        if reference is None:
+            continue
+        for metric in [f"{stage}_s" for stage in STAGES] + ["total_s", "peak_memory_bytes"]:
+            if metric not in reference:
+                continue
+            current, previous = row[metric], reference[metric]
+            if metric.endswith("_s") and max(current, previous) < min_seconds:
+                continue
+            ratio = current / previous if previous > 0 else float("inf")
+            if ratio > 1 + threshold:
+                regressions.append({
+                    "parser": row["parser"],
+                    "method": row["method"],
+                    "residues": row["residues"],
+                    "metric": metric,
+                    "baseline": previous,
+                    "current": current,
+                    "ratio": ratio,
+                })
+    return regressions
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+    }
+
+
+if __name__ == "__main__":
+    argument_parser = argparse.ArgumentParser(description="Benchmark the contact order computation stage by stage.")
+    argument_parser.add_argument("--sizes", nargs="+", type=int, default=list(DEFAULT_SIZES))
+    argument_parser.add_argument("--parsers", nargs="+", default=["fast"], choices=["fast", "biopython"])
+    argument_parser.add_argument("--methods", nargs="+", default=["cell_list"], choices=sorted(CONTACT_METHODS))
+    argument_parser.add_argument("--repeats", type=int, default=7)
+    argument_parser.add_argument("--output", default="compute_benchmark.json")
+    argument_parser.add_argument("--baseline", help="Earlier output to compare against")
+    argument_parser.add_argument("--threshold", type=float, default=0.25, help="Relative slowdown flagged as regression")
+    argument_parser.add_argument("--batch", action="store_true",
+                                 help="Also compare batched and one-by-one contact computation of small structures")
+    args = argument_parser.parse_args()
+
+    results = run_benchmark(args.sizes, args.parsers, args.methods, args.repeats)
+    output = {
+        "format": FORMAT_VERSION,
+        "environment": environment(),
+        "config": {"repeats": args.repeats, "distance_cutoffs": [8.0], "metrics": ["relative"]},
+        "results": results,
+    }
+    if args.batch:
+        output["batch"] = run_batch_benchmark()
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=1)
+    print(f"Results saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        if baseline.get("format") != FORMAT_VERSION:
+            raise SystemExit(f"Baseline format {baseline.get('format')} differs from {FORMAT_VERSION}")
+        if baseline.get("environment") != environment():
+            print("Warning: the baseline was recorded in a different environment")
+
+        regressions = compare(results, baseline["results"], args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression['parser']}/{regression['method']} {regression['residues']} residues "
+                  f"{regression['metric']}: {regression['baseline']:.4g} -> {regression['current']:.4g} "
+                  f"({regression['ratio']:.2f}x)")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions above {args.threshold:.0%} against {args.baseline}")
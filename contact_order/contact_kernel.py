@@ -0,0 +1,286 @@
+import numpy as np
+
+# Offsets of a cell and its 26 neighbours in a 3D grid.
+NEIGHBOUR_OFFSETS = np.array(
+    [(dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)],
+    dtype=np.int64,
+)
+
+
+def find_contacts_dense(coordinates, distance_cutoff=8.0):
+    """
+    Find residue pairs closer than the cutoff from the full N×N distance matrix.
+    Kept as the reference implementation for verification; memory is O(N²).
+
+    Parameters:
+        coordinates (np.ndarray): CA coordinates of shape (num_residues, 3).
+        distance_cutoff (float): Distance threshold (in Å) to define a contact.
+
+    Returns:
+        tuple: Arrays i, j (with i < j) of residue indices in contact and their distances.
+    """
+    distances = np.linalg.norm(coordinates[:, None, :] - coordinates[None, :, :], axis=-1)
+
+    contacts = (distances < distance_cutoff) & (distances > 0)
+
+    i, j = np.nonzero(np.triu(contacts, k=1))
+    return i, j, distances[i, j]
+
+
+def find_contacts_cell_list(coordinates, distance_cutoff=8.0):
+    """
+    Find residue pairs closer than the cutoff with a cell list.
+    Residues are binned into cubic cells of edge `distance_cutoff`, so only pairs
+    in neighbouring cells are measured; memory is O(N + contacts).
+    Residues with NaN coordinates (e.g. below a pLDDT threshold) have no contacts.
+
+    Parameters:
+        coordinates (np.ndarray): CA coordinates of shape (num_residues, 3).
+        distance_cutoff (float): Distance threshold (in Å) to define a contact.
+
+    Returns:
+        tuple: Arrays i, j (with i < j) of residue indices in contact and their distances.
+    """
+    finite = np.isfinite(coordinates).all(axis=1)
+    if not finite.all():
+        # Search the remaining residues and map their indices back.
+        kept = np.flatnonzero(finite)
+        i, j, distances = find_contacts_cell_list(coordinates[kept], distance_cutoff)
+        return kept[i], kept[j], distances
+
+    num_residues = len(coordinates)
+    empty = np.empty(0, dtype=np.int64)
+    if num_residues < 2:
+        return empty, empty, np.empty(0, dtype=coordinates.dtype)
+
+    # Slightly larger cells so float32 rounding at the cutoff can never push a contact two cells away.
+    cell_size = distance_cutoff * (1 + 1e-6)
+    cells = np.floor((coordinates - coordinates.min(axis=0)) / cell_size).astype(np.int64) + 1
+    shape = cells.max(axis=0) + 2
+    keys = (cells[:, 0] * shape[1] + cells[:, 1]) * shape[2] + cells[:, 2]
+
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+
+    contacts_i = []
+    contacts_j = []
+    contacts_distances = []
+
+    for offset in NEIGHBOUR_OFFSETS:
+        neighbour_keys = keys + (offset[0] * shape[1] + offset[1]) * shape[2] + offset[2]
+        starts = np.searchsorted(sorted_keys, neighbour_keys, side="left")
+        counts = np.searchsorted(sorted_keys, neighbour_keys, side="right") - starts
+
+        i = np.repeat(np.arange(num_residues), counts)
+        if len(i) == 0:
+            continue
+        # Position of every candidate inside its neighbour cell's run of sorted residues.
+        run_offsets = np.arange(len(i)) - np.repeat(np.cumsum(counts) - counts, counts)
+        j = order[np.repeat(starts, counts) + run_offsets]
+
+        upper = i < j
+        i, j = i[upper], j[upper]
+
+        distances = np.linalg.norm(coordinates[i] - coordinates[j], axis=-1)
+        close = (distances < distance_cutoff) & (distances > 0)
+        contacts_i.append(i[close])
+        contacts_j.append(j[close])
+        contacts_distances.append(distances[close])
+
+    if not contacts_i:
+        return empty, empty, np.empty(0, dtype=coordinates.dtype)
+    return np.concatenate(contacts_i), np.concatenate(contacts_j), np.concatenate(contacts_distances)
+
+
+CONTACT_METHODS = {
+    "cell_list": find_contacts_cell_list,
+    "dense": find_contacts_dense,
+}
+
+
+# Metric name -> result column prefix; columns are named "<prefix>_<cutoff>".
+METRICS = {
+    "relative": "relative_co",
+    "absolute": "absolute_co",
+    "num_contacts": "num_contacts",
+}
+
+
+def metric_column(metric, distance_cutoff):
+    return f"{METRICS[metric]}_{distance_cutoff:g}"
+
+
+def contact_metrics_from_coordinates(coordinates, distance_cutoffs=(8.0,), metrics=("relative",), method="cell_list"):
+    """
+    Compute several contact metrics for several cutoffs in one pass.
+    Contacts are searched once at the largest cutoff; every smaller cutoff is
+    read off the same pairs sorted by distance.
+
+    Residues with NaN coordinates are left out, but keep their place in the
+    sequence; "number of residues" below counts only the others.
+
+    Metrics:
+        relative: mean |i - j| of contacts divided by the number of residues (0 without contacts).
+        absolute: mean |i - j| of contacts (0 without contacts).
+        num_contacts: number of contacting pairs.
+
+    Parameters:
+        coordinates (np.ndarray): CA coordinates of shape (num_residues, 3).
+        distance_cutoffs (list): Distance thresholds (in Å) to define a contact.
+        metrics (list): Metric names, see METRICS.
+        method (str): "cell_list" (default) or "dense" for the N×N reference path.
+
+    Returns:
+        dict: Column name -> value, see metric_column.
+    """
+    _check_arguments(method, metrics)
+    i, j, distances = CONTACT_METHODS[method](coordinates, max(distance_cutoffs))
+    return aggregate_contacts(i, j, distances, count_residues(coordinates), distance_cutoffs, metrics)
+
+
+def count_residues(coordinates):
+    """
+    Number of residues with coordinates (not NaN).
+    """
+    return int(np.isfinite(coordinates).all(axis=1).sum())
+
+
+def aggregate_contacts(i, j, distances, num_residues, distance_cutoffs=(8.0,), metrics=("relative",)):
+    """
+    Reduce contact pairs found at the largest cutoff to the metric columns of
+    every cutoff (see contact_metrics_from_coordinates).
+
+    Parameters:
+        i, j (np.ndarray): Residue indices of the contacting pairs.
+        distances (np.ndarray): Their distances.
+        num_residues (int): Number of residues of the structure.
+        distance_cutoffs (list): Distance thresholds (in Å) to define a contact.
+        metrics (list): Metric names, see METRICS.
+
+    Returns:
+        dict: Column name -> value, see metric_column.
+    """
+    order = np.argsort(distances, kind="stable")
+    sorted_distances = distances[order]
+    cumulative_separation = np.concatenate(([0], np.cumsum(np.abs(i - j)[order], dtype=np.int64)))
+
+    row = {}
+    for distance_cutoff in distance_cutoffs:
+        num_contacts = int(np.searchsorted(sorted_distances, distance_cutoff, side="left"))
+        total_contact_order = int(cumulative_separation[num_contacts])
+
+        values = {
+            "relative": total_contact_order / (num_residues * num_contacts) if num_contacts > 0 else 0,
+            "absolute": total_contact_order / num_contacts if num_contacts > 0 else 0,
+            "num_contacts": num_contacts,
+        }
+        for metric in metrics:
+            row[metric_column(metric, distance_cutoff)] = values[metric]
+
+    return row
+
+
+# Structures up to this many residues are computed in padded blocks by
+# contact_metrics_batch; above it the per-structure cell list is faster.
+BATCH_MAX_RESIDUES = 256
+
+
+def _check_arguments(method, metrics):
+    if method not in CONTACT_METHODS:
+        raise ValueError(f"Unknown contact method: {method}")
+    for metric in metrics:
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric: {metric}")
+
+
+def _block_metrics(coordinate_list, distance_cutoffs, metrics):
+    # Pad the block to (structures, residues, 3) with NaN, which is never in contact.
+    width = max(len(coordinates) for coordinates in coordinate_list)
+    dtype = np.result_type(*{coordinates.dtype for coordinates in coordinate_list})
+    packed = np.full((len(coordinate_list), width, 3), np.nan, dtype=dtype)
+    for b, coordinates in enumerate(coordinate_list):
+        packed[b, :len(coordinates)] = coordinates
+
+    # Same differences and norm as the per-structure kernels, so the distances are identical.
+    distances = np.linalg.norm(packed[:, :, None, :] - packed[:, None, :, :], axis=-1)
+    residue_counts = np.isfinite(packed).all(axis=2).sum(axis=1).tolist()
+    index = np.arange(width)
+    separation = np.triu(np.abs(index[:, None] - index[None, :]), k=1)
+    upper = separation > 0
+
+    rows = [{} for _ in coordinate_list]
+    for distance_cutoff in distance_cutoffs:
+        contacts = (distances < distance_cutoff) & (distances > 0) & upper
+        num_contacts = contacts.sum(axis=(1, 2))
+        total_contact_order = np.tensordot(contacts, separation, axes=([1, 2], [0, 1]))
+        for row, num_residues, count, total in zip(rows, residue_counts, num_contacts.tolist(),
+                                                   total_contact_order.tolist()):
+            values = {
+                "relative": total / (num_residues * count) if count > 0 else 0,
+                "absolute": total / count if count > 0 else 0,
+                "num_contacts": count,
+            }
+            for metric in metrics:
+                row[metric_column(metric, distance_cutoff)] = values[metric]
+    return rows
+
+
+def contact_metrics_batch(coordinate_list, distance_cutoffs=(8.0,), metrics=("relative",), method="cell_list",
+                          max_residues=BATCH_MAX_RESIDUES, max_block_pairs=2**21):
+    """
+    contact_metrics_from_coordinates for many structures at once. Small
+    structures are sorted by length and packed into padded blocks whose
+    distances and metrics are computed in a few array operations per block,
+    instead of paying the per-call overhead of the cell list for each of them.
+    Structures above `max_residues` go through the per-structure path.
+    The results are identical to calling contact_metrics_from_coordinates on each.
+
+    Parameters:
+        coordinate_list (list): CA coordinate arrays of shape (num_residues, 3), each with at least 2 residues.
+        distance_cutoffs (list): Distance thresholds (in Å) to define a contact.
+        metrics (list): Metric names, see METRICS.
+        method (str): Contact method of the per-structure fallback.
+        max_residues (int): Largest structure computed in a block.
+        max_block_pairs (int): Residue pairs per block (structures × width²), bounding its memory.
+
+    Returns:
+        list: One dict column name -> value per structure, in input order.
+    """
+    _check_arguments(method, metrics)
+    rows = [None] * len(coordinate_list)
+    small = []
+    for k, coordinates in enumerate(coordinate_list):
+        if len(coordinates) <= max_residues:
+            small.append(k)
+        else:
+            rows[k] = contact_metrics_from_coordinates(coordinates, distance_cutoffs, metrics, method=method)
+
+    # Sorted by length, every block is padded to about the size of its members.
+    small.sort(key=lambda k: len(coordinate_list[k]))
+    start = 0
+    while start < len(small):
+        end = start + 1
+        while end < len(small) and (end + 1 - start) * len(coordinate_list[small[end]])**2 <= max_block_pairs:
+            end += 1
+        block = small[start:end]
+        for k, row in zip(block, _block_metrics([coordinate_list[k] for k in block], distance_cutoffs, metrics)):
+            rows[k] = row
+        start = end
+    return rows
+
+
+def contact_order_from_coordinates(coordinates, distance_cutoff=8.0, method="cell_list"):
+    """
+    Relative contact order: mean sequence separation |i - j| of contacting
+    residues, normalised by the number of residues.
+
+    Parameters:
+        coordinates (np.ndarray): CA coordinates of shape (num_residues, 3).
+        distance_cutoff (float): Distance threshold (in Å) to define a contact.
+        method (str): "cell_list" (default) or "dense" for the N×N reference path.
+
+    Returns:
+        float: Contact order, or 0 if there are no contacts.
+    """
+    row = contact_metrics_from_coordinates(coordinates, [distance_cutoff], ["relative"], method=method)
+    return row[metric_column("relative", distance_cutoff)]
@@ -1,136 +1,203 @@
+import itertools
 import os
-import numpy as np
-import dask
-from dask import delayed
-from dask.distributed import Client, LocalCluster
-from Bio.PDB.MMCIFParser import MMCIFParser
-import pandas as pd
+from contextlib import ExitStack
+from dask.distributed import Client, LocalCluster, as_completed, get_client, performance_report
+from distributed.scheduler import KilledWorker
 import time
+from contact_order_common import CheckpointRun, calculate_contact_order_chunk, result_columns
+from tracing import new_trace
+from scheduling import AdaptiveCheckpoints, input_sizes, straggler_tail
+from sharding import shard_directory, shard_from_env
 
-def calculate_contact_order(cif_file, distance_cutoff=8.0):
-    """
-    Calculate contact order for a protein structure in a CIF file.
-    Checks if the file is empty or contains valid data.
-
-    Parameters:
-        cif_file (str): Path to the CIF file.
-        distance_cutoff (float): Distance threshold (in Å) to define a contact.
 
-    Returns:
-        dict: Filename and contact order result.
+def failed_results(files, error, distance_cutoff=8.0, metrics=None):
     """
-    parser = MMCIFParser(QUIET=True)
-
-    if os.path.getsize(cif_file) == 0:
-        return {"file": cif_file, "contact_order": None, "error": "File is empty"}
-
-    try:
-        structure = parser.get_structure("protein", cif_file)
-
-        residues = []
-        coordinates = []
-        
-        for model in structure:
-            for chain in model:
-                for residue in chain:
-                    if 'CA' in residue:
-                        residues.append(residue)
-                        coordinates.append(residue['CA'].get_coord())
-
-        if len(residues) == 0:
-            return {"file": cif_file, "contact_order": None, "error": "No residues found in the file"}
-
-        coordinates = np.array(coordinates)
-        num_residues = len(residues)
-
-        if num_residues < 2:
-            return {"file": cif_file, "contact_order": None, "error": "Too few residues to calculate contact order"}
-
-        distances = np.linalg.norm(coordinates[:, None, :] - coordinates[None, :, :], axis=-1)
-
-        contacts = (distances < distance_cutoff) & (distances > 0)
-
-        total_contact_order = 0
-        num_contacts = 0
-
-        for i in range(num_residues):
-            for j in range(i + 1, num_residues):
-                if contacts[i, j]:
-                    sequence_distance = abs(i - j)
-                    total_contact_order += sequence_distance
-                    num_contacts += 1
-
-        contact_order = total_contact_order / (num_residues * num_contacts) if num_contacts > 0 else 0
-
-        return {"file": cif_file, "contact_order": contact_order, "error": None}
+    Error rows for the files of a task that raised instead of returning results.
+    Files of a worker that died get a "Worker failed" error, which is not cached,
+    so they run again later (as in contact_order_concurrent).
+    """
+    if isinstance(error, KilledWorker):
+        error = f"Worker failed: {type(error).__name__}: {error}"
+    return [{"file": file, **dict.fromkeys(result_columns(distance_cutoff, metrics)), "error": str(error)}
+            for file in files]
+
+
+def process_cif_files(file_list, distance_cutoff=8.0, parser="fast", method="cell_list", metrics=None, store=None,
+                      cache=None, completion_times=None, trace=False, plddt_filter=None):
+    # One task per CIF file or per tar shard (expanded into its members), submitted in
+    # file_list order so longest-first lists start their biggest files first.
+    client = get_client()
+    tasks = {
+        client.submit(calculate_contact_order_chunk, [file], distance_cutoff, parser, method, metrics, store, cache,
+                      new_trace() if trace else None, plddt_filter, pure=False): file
+        for file in file_list
+    }
+    results = []
+    for future in as_completed(tasks):
+        if completion_times is not None:
+            completion_times.append(time.time())
+        try:
+            results.extend(future.result())
+        except Exception as e:
+            results.extend(failed_results([tasks[future]], e, distance_cutoff, metrics))
+    return results
 
-    except Exception as e:
-        return {"file": cif_file, "contact_order": None, "error": str(e)}
 
+def stream_cif_files(file_list, batch_size=32, max_in_flight=None, distance_cutoff=8.0, parser="fast",
+                     method="cell_list", metrics=None, store=None, cache=None, trace=False, plddt_filter=None):
+    """
+    Barrier-free processing: files go to the workers in batches of `batch_size`
+    per task, at most `max_in_flight` tasks are submitted at a time, and a new
+    batch is submitted whenever one finishes. Results are yielded in completion
+    order, so there is no point at which idle workers wait for the slowest task.
 
-def process_cif_files(file_list, distance_cutoff=8.0):
-    tasks = [delayed(calculate_contact_order)(file, distance_cutoff) for file in file_list]
-    results = dask.compute(*tasks)
-    return results
+    Parameters:
+        file_list (list): CIF files and tar shards, in submission order.
+        batch_size (int): Files per task.
+        max_in_flight (int): Tasks submitted at once; by default two per worker,
+            so a worker always has its next batch queued.
+
+    Yields:
+        tuple: (batch, results), the files of a finished task and their result dicts;
+            a task that raised yields error rows for its files, see failed_results.
+    """
+    client = get_client()
+    if max_in_flight is None:
+        max_in_flight = 2 * max(1, len(client.scheduler_info()["workers"]))
+    batches = (file_list[i:i + batch_size] for i in range(0, len(file_list), batch_size))
+    tasks = {}
+
+    def submit(batch):
+        future = client.submit(calculate_contact_order_chunk, batch, distance_cutoff, parser, method, metrics, store,
+                               cache, new_trace() if trace else None, plddt_filter, pure=False)
+        tasks[future] = batch
+        return future
+
+    running = as_completed([submit(batch) for batch in itertools.islice(batches, max_in_flight)])
+    for future in running:
+        batch = tasks.pop(future)
+        next_batch = next(batches, None)
+        if next_batch is not None:
+            running.add(submit(next_batch))
+        try:
+            results = future.result()
+        except Exception as e:
+            results = failed_results(batch, e, distance_cutoff, metrics)
+        yield batch, results
 
 
 if __name__ == "__main__":
-    cluster = LocalCluster(
-        n_workers=16,
-        threads_per_worker=1,
-        memory_limit="4GB"
-    )
+    # DASK_CLUSTER=slurm runs the workers as DASK_JOBS SLURM jobs of 16 cores each
+    # (dask-jobqueue) instead of on this node only.
+    if os.getenv("DASK_CLUSTER", "local") == "slurm":
+        from dask_jobqueue import SLURMCluster
+        cluster = SLURMCluster(
+            account="plglscclass24-cpu",
+            queue="plgrid",
+            cores=16,
+            processes=16,
+            memory="64GB",
+            walltime="10:00:00",
+        )
+        cluster.scale(jobs=int(os.getenv("DASK_JOBS", "4")))
+    else:
+        cluster = LocalCluster(
+            n_workers=16,
+            threads_per_worker=1,
+            memory_limit="4GB"
+        )
 
     client = Client(cluster)
+    client.wait_for_workers(1)
     print("Dask cluster initialized.")
 
     scratch_directory = os.getenv("SCRATCH")
     cif_directory = f"{scratch_directory}/lsc_data/data"
-    output_file = f"{scratch_directory}/lsc_data/contact_order_results.csv"
-    output_log_file = f"{scratch_directory}/lsc_data/logs.csv"
+    # Optional list of the inputs with their sizes ("<path> <size>" lines), to schedule
+    # by without listing and stat-ing the directory.
+    manifest_file = None
+    # In a SLURM array job (process_array.sh) every task writes its share into its
+    # own directory; for the outputs and the settings below, see CheckpointRun.
+    shard_index, num_shards = shard_from_env()
+    run = CheckpointRun(
+        shard_directory(f"{scratch_directory}/lsc_data", shard_index, num_shards),
+        results_format="parquet",  # or "csv"
+        organisms_file=None,
+        min_global_plddt=None,  # e.g. 70
+        min_residue_plddt=None,  # e.g. 70
+        store_directory=None,
+        shard_index=shard_index,
+        num_shards=num_shards,
+    )
+    trace_events = True
+    # Set to e.g. f"{scratch_directory}/lsc_data/dask-report.html" to capture a Dask performance report.
+    performance_report_file = None
 
-    file_list = [os.path.join(cif_directory, f) for f in os.listdir(cif_directory) if f.endswith(".cif")]
+    # Streaming mode keeps a bounded number of batch tasks in flight and writes
+    # whatever has finished every few minutes, instead of running checkpoints
+    # that each end in a barrier.
+    streaming = True
 
-    if not file_list:
-        print("No CIF files found in the specified directory.")
-    else:
+    file_list, shard_list, sizes = input_sizes(cif_directory, manifest_file)
+    file_list = run.inputs(file_list, sizes, shard_list)
 
-        global_start_time = time.time()
+    reports = ExitStack()
+    if performance_report_file:
+        reports.enter_context(performance_report(filename=performance_report_file))
 
-        num_checkpoints = 100
-        chunk_size = len(file_list) // num_checkpoints
+    if not file_list:
+        print("No CIF files found in the specified directory.")
+    elif streaming:
+        # Flush every few minutes, or every checkpoint_bytes of input.
+        checkpoint_seconds = 300
+        checkpoint_bytes = 256 * 2**20
+
+        results = []
+        results_bytes = 0
+        completion_times = []
+        start_idx = end_idx = 0
+        start_time = time.time()
+
+        for batch, batch_results in stream_cif_files(file_list, batch_size=32, distance_cutoff=8.0, store=run.store,
+                                                     cache=run.cache, trace=trace_events,
+                                                     plddt_filter=run.plddt_filter):
+            completion_times.append(time.time())
+            results.extend(batch_results)
+            results_bytes += sum(sizes.get(file, 0) for file in batch)
+            end_idx += len(batch)
+            if (end_idx < len(file_list) and time.time() - start_time < checkpoint_seconds
+                    and results_bytes < checkpoint_bytes):
+                continue
 
-        for checkpoint_idx in range(num_checkpoints):
-            start_idx = checkpoint_idx * chunk_size
-            end_idx = (checkpoint_idx + 1) * chunk_size if checkpoint_idx < num_checkpoints - 1 else len(file_list)
+            end_time = time.time()
+            # Workers only run out of tasks once the last batches are in flight (which may
+            # have been submitted before the last flush, so completion_times spans the run).
+            num_workers = len(client.scheduler_info()["workers"])
+            tail = straggler_tail(completion_times, end_time, num_workers) if end_idx == len(file_list) else 0.0
+            run.write(results, start_idx, end_idx, start_time, end_time, checkpoint_bytes=results_bytes,
+                      straggler_tail=tail)
+
+            results = []
+            results_bytes = 0
+            start_idx = end_idx
+            start_time = end_time
+    else:
+        # Checkpoints of about 5 minutes each, sized from the throughput so far.
+        checkpoints = AdaptiveCheckpoints(file_list, sizes, target_seconds=300)
 
+        for start_idx, end_idx in checkpoints:
+            completion_times = []
             start_time = time.time()
-            results = process_cif_files(file_list[start_idx:end_idx], distance_cutoff=8.0)
+            results = process_cif_files(
+                file_list[start_idx:end_idx], distance_cutoff=8.0, store=run.store, cache=run.cache,
+                completion_times=completion_times, trace=trace_events, plddt_filter=run.plddt_filter,
+            )
             end_time = time.time()
-
-            df = pd.DataFrame(results)
-            df_logs = pd.DataFrame.from_dict(
-                {
-                    "start_idx": [start_idx],
-                    "end_idx": [end_idx],
-                    "start_time": [start_time],
-                    "end_time": [end_time],
-                    "checkpoint_duration": [end_time-start_time],
-                    "global_duration": [end_time-global_start_time],
-                    }
-                )
-            if checkpoint_idx==0:
-                df.to_csv(output_file, index=False)
-                df_logs.to_csv(output_log_file, index=False)
-            else:
-                df.to_csv(output_file, mode='a', index=False, header=False)
-                df_logs.to_csv(output_log_file, mode='a', index=False, header=False)
-            
-            print(f"Checkpoint {checkpoint_idx+1}/{num_checkpoints}")
-            print(f"Processing time: {end_time - start_time:.2f} seconds")
-            print(f"Results saved to {output_file}, logs to {output_log_file}")
-        global_end_time = time.time()
-        
-        print(f"Processing time: {global_end_time - global_end_time:.2f} seconds")
-        print(f"Results saved to {output_file}")
-        print("Processing completed successfully.")
\ No newline at end of file
+            checkpoints.record(end_time - start_time)
+            # Workers of a SLURMCluster come and go, so count them every checkpoint.
+            num_workers = len(client.scheduler_info()["workers"])
+            run.write(results, start_idx, end_idx, start_time, end_time,
+                      checkpoint_bytes=sum(sizes.get(file, 0) for file in file_list[start_idx:end_idx]),
+                      straggler_tail=straggler_tail(completion_times, end_time, num_workers))
+    reports.close()
+    run.close()
@@ -0,0 +1,484 @@
+import os
+import time
+import pandas as pd
+from cif_reader import read_coordinates, read_global_plddt
+from cif_sources import is_shard, iter_shard
+from contact_kernel import (BATCH_MAX_RESIDUES, contact_order_from_coordinates, contact_metrics_batch,
+                            contact_metrics_from_coordinates, count_residues, metric_column)
+from coordinate_store import CoordinateStore
+from result_cache import ResultCache
+from result_stats import ResultStats, read_organisms
+from results_sink import make_sink
+from scheduling import longest_first
+from sharding import select_shard, write_shard_marker
+from tracing import EventLog, pop_traces, start_task, start_trace
+
+
+class PlddtFilter:
+    """
+    Confidence filter for AlphaFold models, which carry a global pLDDT
+    (_ma_qa_metric_global) and the per-residue pLDDT in the B-factor column.
+    Files it rejects get a result whose error starts with "Skipped:" and the reason.
+
+    Parameters:
+        min_global (float): Skip files with a lower global pLDDT. It is read from
+            the metadata before the full parse; files without one are not skipped.
+        min_residue (float): Compute contacts only over residues with at least this
+            pLDDT, filtered while the coordinates are read.
+    """
+
+    def __init__(self, min_global=None, min_residue=None):
+        self.min_global = min_global
+        self.min_residue = min_residue
+
+    def params(self):
+        """
+        Filter settings, to key cached results by (see ResultCache).
+        """
+        return {"min_global_plddt": self.min_global, "min_residue_plddt": self.min_residue}
+
+    def skip_reason(self, source):
+        if self.min_global is None:
+            return None
+        plddt = read_global_plddt(source)
+        if plddt is not None and plddt < self.min_global:
+            return f"Skipped: global pLDDT {plddt:.2f} below {self.min_global:g}"
+        return None
+
+
+def result_columns(distance_cutoff=8.0, metrics=None):
+    """
+    Result columns (besides "file" and "error") for the given cutoffs and metrics.
+    A single cutoff without explicit metrics keeps the original "contact_order" column.
+    """
+    if metrics is None and not isinstance(distance_cutoff, (list, tuple)):
+        return ["contact_order"]
+
+    distance_cutoffs = distance_cutoff if isinstance(distance_cutoff, (list, tuple)) else [distance_cutoff]
+    metrics = metrics if metrics is not None else ["relative"]
+    return [metric_column(metric, cutoff) for cutoff in distance_cutoffs for metric in metrics]
+
+
+def _result(cif_file, columns, values=None, error=None):
+    result = {"file": cif_file}
+    result.update(values if values is not None else dict.fromkeys(columns))
+    result["error"] = error
+    return result
+
+
+def calculate_contact_order(cif_file, distance_cutoff=8.0, parser="fast", method="cell_list", metrics=None, data=None,
+                            store=None, trace=None, plddt_filter=None):
+    """
+    Calculate contact order for a protein structure in a CIF file.
+    Checks if the file is empty or contains valid data.
+
+    Several cutoffs and metrics can be computed in one pass; pair distances are
+    computed once and every cutoff/metric is derived from them.
+
+    Parameters:
+        cif_file (str): Path to the CIF file.
+        distance_cutoff (float | list): Distance threshold(s) (in Å) to define a contact.
+        parser (str): "fast" for the streaming CA reader, "biopython" for MMCIFParser.
+        method (str): "cell_list" for the neighbour-search kernel, "dense" for the N×N matrix.
+        metrics (list): Metric names from contact_kernel.METRICS ("relative", "absolute",
+            "num_contacts"). If given, or if several cutoffs are given, one column per
+            cutoff and metric is returned instead of "contact_order".
+        data (bytes): File content already held in memory; cif_file is then only
+            used as the name in the result and is never opened.
+        store (CoordinateStore): Read coordinates from a packed coordinate store
+            (see coordinate_store.py) by the accession of cif_file instead of parsing;
+            files the store does not cover are parsed.
+        trace (dict): Trace from tracing.new_trace. If given, the result carries it
+            under "trace" with this file's worker, queue wait, parse and compute
+            times, bytes and residues added.
+        plddt_filter (PlddtFilter): Skip low-confidence models before parsing, and/or
+            leave low-confidence residues out. Needs CIF input, not a store.
+
+    Returns:
+        dict: Filename and contact order result(s).
+    """
+    if trace is None:
+        return _contact_order_result(cif_file, distance_cutoff, parser, method, metrics, data, store,
+                                     plddt_filter=plddt_filter)
+
+    trace = start_trace(trace)
+    result = _contact_order_result(cif_file, distance_cutoff, parser, method, metrics, data, store, timings=trace,
+                                   plddt_filter=plddt_filter)
+    result["trace"] = trace
+    return result
+
+
+def _load_coordinates(cif_file, columns, parser, data, store, timings=None, plddt_filter=None):
+    """
+    Read the CA coordinates of a file for _contact_order_result.
+
+    Returns:
+        tuple: (coordinates, None), or (None, error result) if the file cannot be computed.
+    """
+    if plddt_filter is not None and store is not None:
+        raise ValueError("pLDDT filtering needs CIF input; the coordinate store has no pLDDT")
+    if store is not None and not store.covers(cif_file):
+        store = None
+
+    num_bytes = None if store is not None else len(data) if data is not None else os.path.getsize(cif_file)
+    if timings is not None:
+        timings["bytes"] = num_bytes
+    if num_bytes == 0:
+        return None, _result(cif_file, columns, error="File is empty")
+
+    try:
+        start = time.perf_counter()
+        source = cif_file if data is None else data
+        skip_reason = plddt_filter.skip_reason(source) if plddt_filter is not None else None
+        if skip_reason is not None:
+            coordinates = None
+        elif store is not None:
+            coordinates = store.get(cif_file)
+        else:
+            min_plddt = plddt_filter.min_residue if plddt_filter is not None else None
+            coordinates = read_coordinates(source, parser=parser, min_plddt=min_plddt)
+    except Exception as e:
+        return None, _result(cif_file, columns, error=str(e))
+    if timings is not None:
+        timings["parse"] = time.perf_counter() - start
+    if skip_reason is not None:
+        return None, _result(cif_file, columns, error=skip_reason)
+
+    num_residues = len(coordinates)
+    if timings is not None:
+        timings["residues"] = num_residues
+
+    if num_residues == 0:
+        return None, _result(cif_file, columns, error="No residues found in the file")
+
+    if num_residues < 2:
+        return None, _result(cif_file, columns, error="Too few residues to calculate contact order")
+
+    if plddt_filter is not None and plddt_filter.min_residue is not None and count_residues(coordinates) < 2:
+        error = f"Skipped: fewer than 2 residues with pLDDT of at least {plddt_filter.min_residue:g}"
+        return None, _result(cif_file, columns, error=error)
+
+    return coordinates, None
+
+
+def _metric_values(coordinates, distance_cutoff, method, metrics, columns):
+    if columns == ["contact_order"]:
+        return {"contact_order": contact_order_from_coordinates(coordinates, distance_cutoff, method=method)}
+    distance_cutoffs = distance_cutoff if isinstance(distance_cutoff, (list, tuple)) else [distance_cutoff]
+    return contact_metrics_from_coordinates(
+        coordinates, distance_cutoffs, metrics if metrics is not None else ["relative"], method=method
+    )
+
+
+def _contact_order_result(cif_file, distance_cutoff, parser, method, metrics, data, store, timings=None,
+                          plddt_filter=None):
+    columns = result_columns(distance_cutoff, metrics)
+
+    coordinates, error_result = _load_coordinates(cif_file, columns, parser, data, store, timings, plddt_filter)
+    if error_result is not None:
+        return error_result
+    return _computed_result(cif_file, coordinates, distance_cutoff, method, metrics, columns, timings)
+
+
+def _computed_result(cif_file, coordinates, distance_cutoff, method, metrics, columns, timings=None):
+    try:
+        start = time.perf_counter()
+        values = _metric_values(coordinates, distance_cutoff, method, metrics, columns)
+        if timings is not None:
+            timings["compute"] = time.perf_counter() - start
+            timings["compute_batch"] = 1
+
+        return _result(cif_file, columns, values)
+
+    except Exception as e:
+        return _result(cif_file, columns, error=str(e))
+
+
+def calculate_contact_order_batch(file_list, distance_cutoff=8.0, parser="fast", method="cell_list", metrics=None,
+                                  store=None, trace=None, max_residues=BATCH_MAX_RESIDUES, plddt_filter=None):
+    """
+    calculate_contact_order for many files at once: coordinates are read one by
+    one (by the parser, or from a coordinate store), and the contacts of all
+    structures up to `max_residues` are computed together in padded blocks (see
+    contact_kernel.contact_metrics_batch). Results are identical to those of
+    calculate_contact_order.
+
+    Parameters:
+        file_list (list): Paths to CIF files (or accessions in `store`).
+        store (CoordinateStore): Read coordinates from a packed coordinate store instead of parsing.
+        trace (dict): Trace from tracing.new_trace, as in calculate_contact_order.
+            Every file's trace starts when the file is read. The contacts of the
+            small structures are computed together, so their files carry the
+            compute time of all of them, with compute_batch set to their number.
+        max_residues (int): Larger structures are computed (and timed) one by one.
+        plddt_filter (PlddtFilter): See calculate_contact_order.
+
+    Returns:
+        list: One result dict per file, see calculate_contact_order.
+    """
+    columns = result_columns(distance_cutoff, metrics)
+    if trace is not None:
+        trace = start_task(trace)
+    traces = [None] * len(file_list)
+    results = [None] * len(file_list)
+    loaded = []
+    for k, cif_file in enumerate(file_list):
+        if trace is not None:
+            traces[k] = start_trace(trace)
+        coordinates, results[k] = _load_coordinates(cif_file, columns, parser, None, store, traces[k], plddt_filter)
+        if coordinates is None:
+            continue
+        if len(coordinates) > max_residues:
+            # Not packed into a block anyway (see contact_metrics_batch), so timed on its own.
+            results[k] = _computed_result(cif_file, coordinates, distance_cutoff, method, metrics, columns, traces[k])
+        else:
+            loaded.append((k, coordinates))
+
+    if loaded:
+        start = time.perf_counter()
+        distance_cutoffs = distance_cutoff if isinstance(distance_cutoff, (list, tuple)) else [distance_cutoff]
+        if columns == ["contact_order"]:
+            batch_metrics = ["relative"]
+        else:
+            batch_metrics = metrics if metrics is not None else ["relative"]
+        try:
+            rows = contact_metrics_batch([coordinates for _, coordinates in loaded], distance_cutoffs, batch_metrics,
+                                         method=method, max_residues=max_residues)
+        except Exception:
+            # Let the per-structure path report the error of each file.
+            rows = [None] * len(loaded)
+        compute_time = time.perf_counter() - start
+
+        for (k, coordinates), row in zip(loaded, rows):
+            if row is None:
+                results[k] = _computed_result(file_list[k], coordinates, distance_cutoff, method, metrics, columns,
+                                              traces[k])
+                continue
+            if columns == ["contact_order"]:
+                row = {"contact_order": row[metric_column("relative", distance_cutoff)]}
+            results[k] = _result(file_list[k], columns, row)
+            if traces[k] is not None:
+                traces[k]["compute"] = compute_time
+                traces[k]["compute_batch"] = len(loaded)
+
+    if trace is not None:
+        for result, file_trace in zip(results, traces):
+            result["trace"] = file_trace
+    return results
+
+
+def verify_parser(cif_file, distance_cutoff=8.0):
+    """
+    Validation mode: compute contact order with both parsers and compare them.
+
+    Parameters:
+        cif_file (str): Path to the CIF file.
+        distance_cutoff (float): Distance threshold (in Å) to define a contact.
+
+    Returns:
+        dict: Filename, both results and whether they are identical.
+    """
+    fast = calculate_contact_order(cif_file, distance_cutoff, parser="fast")
+    reference = calculate_contact_order(cif_file, distance_cutoff, parser="biopython")
+
+    return {
+        "file": cif_file,
+        "contact_order_fast": fast["contact_order"],
+        "contact_order_biopython": reference["contact_order"],
+        "match": fast["contact_order"] == reference["contact_order"] and fast["error"] == reference["error"],
+    }
+
+
+def calculate_contact_order_shard(shard_path, distance_cutoff=8.0, parser="fast", method="cell_list", metrics=None,
+                                  cache=None, trace=None, plddt_filter=None):
+    """
+    Calculate contact order for every CIF in a tar shard, reading the shard
+    sequentially and never unpacking it to the filesystem.
+
+    Parameters:
+        shard_path (str): Path to the .tar (or .tar.gz) shard.
+        cache (ResultCache): Optional; members that already have a cached result
+            are skipped (and not returned).
+        trace (dict): Trace from tracing.new_trace; reading a member out of the
+            shard is recorded as its download time.
+
+    Returns:
+        list: Result dicts, "file" being "<shard_path>/<member name>".
+    """
+    if trace is not None:
+        trace = start_task(trace)
+    results = []
+    start = time.perf_counter()
+    for name, data in iter_shard(shard_path):
+        read_time = time.perf_counter() - start
+        if cache is None or cache.get(name) is None:
+            member_trace = dict(trace, download=read_time) if trace is not None else None
+            results.append(calculate_contact_order(name, distance_cutoff, parser, method, metrics, data=data,
+                                                   trace=member_trace, plddt_filter=plddt_filter))
+        start = time.perf_counter()
+    return results
+
+
+def calculate_contact_order_chunk(file_list, distance_cutoff=8.0, parser="fast", method="cell_list", metrics=None,
+                                  store=None, cache=None, trace=None, plddt_filter=None):
+    """
+    Calculate contact order for several files in one task, so that a pool or
+    cluster pays the submission/pickling overhead once per chunk instead of per file.
+    Tar shards in file_list are expanded into their CIF members.
+    With a trace (tracing.new_trace at submission), every result carries its own;
+    the queue wait of all of them ends when the task starts, see tracing.start_task.
+
+    Returns:
+        list: One result dict per file, see calculate_contact_order.
+    """
+    if trace is not None:
+        trace = start_task(trace)
+    # Loose files are computed together, so small structures share their contact search.
+    loose_results = iter(calculate_contact_order_batch(
+        [file for file in file_list if not is_shard(file)], distance_cutoff, parser, method, metrics, store=store,
+        trace=trace, plddt_filter=plddt_filter,
+    ))
+    results = []
+    for file in file_list:
+        if is_shard(file):
+            results.extend(calculate_contact_order_shard(file, distance_cutoff, parser, method, metrics, cache=cache,
+                                                         trace=trace, plddt_filter=plddt_filter))
+        else:
+            results.append(next(loose_results))
+    return results
+
+
+class CheckpointRun:
+    """
+    The outputs of an entry point's run, written checkpoint by checkpoint to
+    output_directory:
+        contact_order_results.<results_format>  results, see results_sink.py
+        logs.csv          one row per checkpoint
+        events.jsonl      per-file worker, queue wait, download/parse/compute/write
+                          times, bytes and residues, see tracing.py
+        stats.json        running counts, mean/variance, quantiles, histograms and errors
+                          by reason of all results so far, overall and per organism
+        result_cache.sqlite  finished files, so a rerun (e.g. after the job was killed)
+                          skips them, see result_cache.py
+    In a SLURM array job every task processes its own share of the inputs
+    (sharding.select_shard) into its own directory (sharding.shard_directory);
+    merge them with sharding.py afterwards.
+
+    Parameters:
+        output_directory (str): Directory of the run (or of its shard).
+        results_format (str): "parquet" or "csv".
+        organisms_file (str): Organism of every accession, e.g. a UniProt export of
+            accession,organism_name (see result_stats.read_organisms); without it,
+            results are grouped by the AlphaFold proteome named in their path.
+        distance_cutoff (float): Cutoff of the results, to key the cache by.
+        min_global_plddt (float): Skip models with a lower global pLDDT before parsing them.
+        min_residue_plddt (float): Count only residues with at least this pLDDT.
+        store_directory (str): Coordinate store built from the same inputs (see
+            coordinate_store.py): the files it covers are read from its memory maps
+            instead of being parsed. It holds no pLDDT, so it cannot be combined with
+            the pLDDT filter.
+        shard_index, num_shards (int): Share of the inputs, see sharding.shard_from_env.
+
+    Attributes:
+        plddt_filter (PlddtFilter): None without pLDDT thresholds.
+        store (CoordinateStore): None without store_directory.
+        cache (ResultCache): To pass to the workers, which skip finished shard members.
+    """
+
+    def __init__(self, output_directory, results_format="parquet", organisms_file=None, distance_cutoff=8.0,
+                 min_global_plddt=None, min_residue_plddt=None, store_directory=None, shard_index=0, num_shards=1):
+        self.plddt_filter = None
+        if min_global_plddt is not None or min_residue_plddt is not None:
+            self.plddt_filter = PlddtFilter(min_global=min_global_plddt, min_residue=min_residue_plddt)
+        if store_directory and self.plddt_filter is not None:
+            raise ValueError("The coordinate store has no pLDDT; set store_directory = None to filter by pLDDT")
+        self.store = CoordinateStore(store_directory) if store_directory else None
+
+        os.makedirs(output_directory, exist_ok=True)
+        self.output_directory = output_directory
+        self.shard_index = shard_index
+        self.num_shards = num_shards
+        self.output_file = f"{output_directory}/contact_order_results.{results_format}"
+        self.output_log_file = f"{output_directory}/logs.csv"
+        self.results_sink = make_sink(self.output_file, results_format)
+        self.log_sink = make_sink(self.output_log_file, "csv")
+        self.event_log = EventLog(f"{output_directory}/events.jsonl")
+        self.stats_file = f"{output_directory}/stats.json"
+        self.stats = ResultStats.load(self.stats_file, read_organisms(organisms_file) if organisms_file else None)
+        self.cache = ResultCache(f"{output_directory}/result_cache.sqlite", distance_cutoff=distance_cutoff,
+                                 filters=self.plddt_filter.params() if self.plddt_filter else None)
+        self.num_inputs = 0
+        self.num_files = 0
+        self.checkpoint_idx = 0
+        self.start_time = time.time()
+
+    def inputs(self, file_list, sizes, shard_list=()):
+        """
+        This shard's share of the inputs that have no cached result yet, largest
+        first, so the biggest structures start early (and every checkpoint holds
+        proteins of similar size). Tar shards are always kept; their finished
+        members are skipped by the workers while reading them.
+        """
+        selected = select_shard(list(shard_list) + list(file_list), sizes, self.shard_index, self.num_shards)
+        self.num_inputs = len(selected)
+        selected = set(selected)
+        file_list = [file for file in file_list if file in selected]
+        shard_list = [shard for shard in shard_list if shard in selected]
+
+        num_listed = len(file_list)
+        file_list = self.cache.missing(file_list)
+        print(f"{num_listed - len(file_list)} files already in the result cache, {len(file_list)} left.")
+        file_list = longest_first(shard_list + file_list, sizes)
+        self.num_files = len(file_list)
+        self.start_time = time.time()
+        return file_list
+
+    def write(self, results, start_idx, end_idx, start_time, end_time, **log_columns):
+        """
+        Write out a checkpoint: its results, a logs.csv row with the given extra
+        columns (e.g. checkpoint_bytes, straggler_tail), its trace events and the
+        statistics snapshot, then cache the results.
+        """
+        events = pop_traces(results)
+        df = pd.DataFrame(results)
+        df_logs = pd.DataFrame.from_dict(
+            {
+                "start_idx": [start_idx],
+                "end_idx": [end_idx],
+                "start_time": [start_time],
+                "end_time": [end_time],
+                "checkpoint_duration": [end_time-start_time],
+                "global_duration": [end_time-self.start_time],
+                **{name: [value] for name, value in log_columns.items()},
+                }
+            )
+        # Results are cached only after they have been written out.
+        write_start_time = time.perf_counter()
+        self.results_sink.write(df)
+        self.log_sink.write(df_logs)
+        self.event_log.write(events, self.checkpoint_idx, time.perf_counter() - write_start_time)
+        self.stats.update(results)
+        self.stats.write(self.stats_file)
+        self.cache.put_many(results)
+
+        tail = log_columns.get("straggler_tail")
+        print(f"Checkpoint {self.checkpoint_idx+1}: files {end_idx}/{self.num_files}")
+        print(f"Processing time: {end_time - start_time:.2f} seconds"
+              + (f" (straggler tail {tail:.2f} seconds)" if tail is not None else ""))
+        print(f"Results saved to {self.output_file}, logs to {self.output_log_file}")
+        self.checkpoint_idx += 1
+
+    def close(self):
+        """
+        Mark the shard as finished (see sharding.merge_shards) and close the outputs.
+        """
+        if self.num_files:
+            print(f"Processing time: {time.time() - self.start_time:.2f} seconds")
+            print(f"Results saved to {self.output_file}")
+            print("Processing completed successfully.")
+        if self.num_shards > 1:
+            write_shard_marker(self.output_directory, self.shard_index, self.num_shards, self.num_inputs)
+        self.results_sink.close()
+        self.log_sink.close()
+        self.event_log.close()
+        self.cache.close()
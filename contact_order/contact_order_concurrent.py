@@ -1,91 +1,132 @@
 import os
-import numpy as np
-from Bio.PDB.MMCIFParser import MMCIFParser
-import pandas as pd
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from contact_order_common import CheckpointRun, calculate_contact_order_chunk, result_columns
+from cif_sources import is_shard
+from tracing import new_trace
+from scheduling import AdaptiveCheckpoints, input_sizes, longest_first, split_by_weight, straggler_tail
+from sharding import shard_directory, shard_from_env
+from concurrent.futures import BrokenExecutor, ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 
-def calculate_contact_order(cif_file, distance_cutoff=8.0):
+BACKENDS = ("threads", "processes", "dask")
+
+# Pools are kept alive between calls, so all checkpoints reuse the same workers.
+_executors = {}
+
+
+def get_executor(backend="threads", max_workers=4, client=None):
     """
-    Calculate contact order for a protein structure in a CIF file.
-    Checks if the file is empty or contains valid data.
+    Return a concurrent.futures-compatible executor for the backend, reusing a
+    previously created pool with the same settings.
 
     Parameters:
-        cif_file (str): Path to the CIF file.
-        distance_cutoff (float): Distance threshold (in Å) to define a contact.
+        backend (str): "threads", "processes" or "dask".
+        max_workers (int): Pool size for the thread and process backends.
+        client (dask.distributed.Client): Client for the dask backend; the current
+            client is used if not given.
 
     Returns:
-        dict: Filename and contact order result.
+        Executor: Thread/process pool or a Dask ClientExecutor.
     """
-    parser = MMCIFParser(QUIET=True)
-
-    # Check if the file is empty
-    if os.path.getsize(cif_file) == 0:
-        return {"file": cif_file, "contact_order": None, "error": "File is empty"}
-
-    try:
-        structure = parser.get_structure("protein", cif_file)
-
-        # Extract residue alpha-carbon coordinates and residue indices
-        residues = []
-        coordinates = []
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend: {backend}")
 
-        for model in structure:
-            for chain in model:
-                for residue in chain:
-                    if 'CA' in residue:  # Only consider residues with alpha-carbon
-                        residues.append(residue)
-                        coordinates.append(residue['CA'].get_coord())
+    if backend == "dask":
+        if client is None:
+            from dask.distributed import get_client
+            client = get_client()
+        return client.get_executor()
 
-        # Check if the file contains residues
-        if len(residues) == 0:
-            return {"file": cif_file, "contact_order": None, "error": "No residues found in the file"}
+    key = (backend, max_workers)
+    if key not in _executors:
+        pool_class = ThreadPoolExecutor if backend == "threads" else ProcessPoolExecutor
+        _executors[key] = pool_class(max_workers=max_workers)
+    return _executors[key]
 
-        # Convert coordinates to a NumPy array
-        coordinates = np.array(coordinates)
-        num_residues = len(residues)
 
-        if num_residues < 2:
-            return {"file": cif_file, "contact_order": None, "error": "Too few residues to calculate contact order"}
-
-        # Calculate pairwise distances between residues
-        distances = np.linalg.norm(coordinates[:, None, :] - coordinates[None, :, :], axis=-1)
-
-        # Identify contacts based on the distance cutoff
-        contacts = (distances < distance_cutoff) & (distances > 0)  # Exclude self-contacts
+def discard_executor(backend="threads", max_workers=4):
+    """
+    Drop a broken pool (a worker process died, e.g. OOM-killed), so the next
+    get_executor call builds a new one.
+    """
+    executor = _executors.pop((backend, max_workers), None)
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
 
-        # Calculate contact order
-        total_contact_order = 0
-        num_contacts = 0
 
-        for i in range(num_residues):
-            for j in range(i + 1, num_residues):
-                if contacts[i, j]:
-                    sequence_distance = abs(i - j)
-                    total_contact_order += sequence_distance
-                    num_contacts += 1
+def shutdown_executors():
+    for executor in _executors.values():
+        executor.shutdown()
+    _executors.clear()
 
-        # Normalize by the number of residues and contacts
-        contact_order = total_contact_order / (num_residues * num_contacts) if num_contacts > 0 else 0
 
-        return {"file": cif_file, "contact_order": contact_order, "error": None}
+def process_cif_files(file_list, distance_cutoff=8.0, max_workers=4, parser="fast", method="cell_list", metrics=None,
+                      backend="threads", chunksize=None, client=None, store=None, cache=None, sizes=None,
+                      completion_times=None, trace=False, plddt_filter=None):
+    """
+    Calculate contact order for a list of CIF files on the selected backend.
+    Tar shards in file_list are submitted as one task each, so every worker
+    reads a whole shard sequentially.
 
-    except Exception as e:
-        return {"file": cif_file, "contact_order": None, "error": str(e)}
+    Parameters:
+        file_list (list): Paths to the CIF files.
+        distance_cutoff (float | list): Distance threshold(s) (in Å) to define a contact.
+        max_workers (int): Pool size for the thread and process backends.
+        backend (str): "threads", "processes" (CPU-bound work scales past the GIL)
+            or "dask" (submits to `client`).
+        chunksize (int): Files per submitted task. Defaults to 1 for threads and to
+            about four chunks per worker otherwise, to amortize pickling and IPC.
+        client (dask.distributed.Client): Client for the dask backend.
+        store (CoordinateStore): Read coordinates from a packed coordinate store
+            (see coordinate_store.py) instead of parsing the files it covers;
+            file_list may then also hold bare accessions.
+        cache (ResultCache): Skip shard members that already have a cached result.
+        sizes (dict): Optional file sizes (see scheduling.input_sizes). Files are then
+            submitted longest-first and chunks are cut by bytes instead of by count
+            (unless chunksize is given), so chunks take about equally long.
+        completion_times (list): If given, the completion time of every task is appended to it.
+        trace (bool): Attach per-file stage timings to the results, see tracing.py.
+        plddt_filter (PlddtFilter): Confidence filter, see contact_order_common.PlddtFilter.
 
+    Returns:
+        list: Result dicts, in completion order. Files of a task whose worker died
+            get a "Worker failed" error, which is not cached, so they run again later.
+    """
+    executor = get_executor(backend, max_workers, client)
+    shards = [file for file in file_list if is_shard(file)]
+    cif_files = [file for file in file_list if not is_shard(file)]
+    if sizes is not None:
+        shards = longest_first(shards, sizes)
+        cif_files = longest_first(cif_files, sizes)
+
+    if chunksize is None and sizes is not None and backend != "threads":
+        target = sum(sizes.get(file, 0) for file in cif_files) / (max_workers * 4)
+        cif_chunks = split_by_weight(cif_files, sizes, target)
+    else:
+        if chunksize is None:
+            chunksize = 1 if backend == "threads" else max(1, len(cif_files) // (max_workers * 4))
+        cif_chunks = [cif_files[i:i + chunksize] for i in range(0, len(cif_files), chunksize)]
+    chunks = [[shard] for shard in shards] + cif_chunks
 
-def process_cif_files(file_list, distance_cutoff=8.0, max_workers=4):
     results = []
-
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        tasks = {executor.submit(calculate_contact_order, file, distance_cutoff): file for file in file_list}
-
-        for future in as_completed(tasks):
-            try:
-                result = future.result()
-                results.append(result)
-            except Exception as e:
-                results.append({"file": tasks[future], "contact_order": None, "error": str(e)})
+    tasks = {
+        executor.submit(calculate_contact_order_chunk, chunk, distance_cutoff, parser, method, metrics, store, cache,
+                        new_trace() if trace else None, plddt_filter): chunk
+        for chunk in chunks
+    }
+
+    for future in as_completed(tasks):
+        if completion_times is not None:
+            completion_times.append(time.time())
+        try:
+            results.extend(future.result())
+        except Exception as e:
+            error = str(e)
+            if isinstance(e, BrokenExecutor):
+                # The files never ran; replace the pool for the next checkpoint.
+                discard_executor(backend, max_workers)
+                error = f"Worker failed: {type(e).__name__}: {e}"
+            for file in tasks[future]:
+                results.append({"file": file, **dict.fromkeys(result_columns(distance_cutoff, metrics)), "error": error})
 
     return results
 
@@ -93,51 +134,53 @@ def process_cif_files(file_list, distance_cutoff=8.0, max_workers=4):
 if __name__ == "__main__":
     scratch_directory = os.getenv("SCRATCH")
     cif_directory = f"{scratch_directory}/lsc_data/data"
-    output_file = f"{scratch_directory}/lsc_data/concurrent/contact_order_results.csv"
-    output_log_file = f"{scratch_directory}/lsc_data/concurrent/logs.csv"
-
-    file_list = [os.path.join(cif_directory, f) for f in os.listdir(cif_directory) if f.endswith(".cif")]
+    # Optional list of the inputs with their sizes ("<path> <size>" lines), to schedule
+    # by without listing and stat-ing the directory.
+    manifest_file = None
+    # In a SLURM array job every task writes its share into its own directory; for
+    # the outputs and the settings below, see CheckpointRun.
+    shard_index, num_shards = shard_from_env()
+    run = CheckpointRun(
+        shard_directory(f"{scratch_directory}/lsc_data/concurrent", shard_index, num_shards),
+        results_format="parquet",  # or "csv"
+        organisms_file=None,
+        min_global_plddt=None,  # e.g. 70
+        min_residue_plddt=None,  # e.g. 70
+        store_directory=None,
+        shard_index=shard_index,
+        num_shards=num_shards,
+    )
+    trace_events = True
+    num_workers = int(os.getenv("SLURM_CPUS_PER_TASK", os.cpu_count()))
+
+    file_list, shard_list, sizes = input_sizes(cif_directory, manifest_file)
+    file_list = run.inputs(file_list, sizes, shard_list)
 
     if not file_list:
         print("No CIF files found in the specified directory.")
     else:
+        # Checkpoints of about 5 minutes each, sized from the throughput so far.
+        checkpoints = AdaptiveCheckpoints(file_list, sizes, target_seconds=300)
 
-        global_start_time = time.time()
-
-        num_checkpoints = 100
-        chunk_size = len(file_list) // num_checkpoints
-
-        for checkpoint_idx in range(num_checkpoints):
-            start_idx = checkpoint_idx * chunk_size
-            end_idx = (checkpoint_idx + 1) * chunk_size if checkpoint_idx < num_checkpoints - 1 else len(file_list)
-
+        for start_idx, end_idx in checkpoints:
+            completion_times = []
             start_time = time.time()
-            results = process_cif_files(file_list[start_idx:end_idx], distance_cutoff=8.0)
+            results = process_cif_files(
+                file_list[start_idx:end_idx],
+                distance_cutoff=8.0,
+                max_workers=num_workers,
+                backend="processes",
+                store=run.store,
+                cache=run.cache,
+                sizes=sizes,
+                completion_times=completion_times,
+                trace=trace_events,
+                plddt_filter=run.plddt_filter,
+            )
             end_time = time.time()
-
-            df = pd.DataFrame(results)
-            df_logs = pd.DataFrame.from_dict(
-                {
-                    "start_idx": [start_idx],
-                    "end_idx": [end_idx],
-                    "start_time": [start_time],
-                    "end_time": [end_time],
-                    "checkpoint_duration": [end_time-start_time],
-                    "global_duration": [end_time-global_start_time],
-                    }
-                )
-            if checkpoint_idx==0:
-                df.to_csv(output_file, index=False)
-                df_logs.to_csv(output_log_file, index=False)
-            else:
-                df.to_csv(output_file, mode='a', index=False, header=False)
-                df_logs.to_csv(output_log_file, mode='a', index=False, header=False)
-            
-            print(f"Checkpoint {checkpoint_idx+1}/{num_checkpoints}")
-            print(f"Processing time: {end_time - start_time:.2f} seconds")
-            print(f"Results saved to {output_file}, logs to {output_log_file}")
-        global_end_time = time.time()
-        
-        print(f"Processing time: {global_end_time - global_end_time:.2f} seconds")
-        print(f"Results saved to {output_file}")
-        print("Processing completed successfully.")
\ No newline at end of file
+            checkpoints.record(end_time - start_time)
+            run.write(results, start_idx, end_idx, start_time, end_time,
+                      checkpoint_bytes=sum(sizes.get(file, 0) for file in file_list[start_idx:end_idx]),
+                      straggler_tail=straggler_tail(completion_times, end_time, num_workers))
+        shutdown_executors()
+    run.close()
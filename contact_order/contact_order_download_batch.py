@@ -1,102 +1,242 @@
 import os
-import numpy as np
 import dask
 from dask import delayed
-from dask.distributed import Client, LocalCluster
-from Bio.PDB.MMCIFParser import MMCIFParser
-from google.cloud import storage
-import pandas as pd
+from contextlib import ExitStack
+from dask.distributed import Client, LocalCluster, performance_report
 import time
+from contact_order_common import CheckpointRun, calculate_contact_order, result_columns
+from gcs_client import get_storage_client
+from download_retry import RetryQueue, failure_message, fetch_with_retries
+from range_fetch import AtomSiteIndex, fetch_atom_site
+from scheduling import AdaptiveCheckpoints, read_manifest
+from sharding import shard_directory, shard_from_env
+from tracing import new_trace, worker_id
 from pathlib import Path
 import shutil
+import queue
+import threading
+import urllib.request
+
+# Seconds a stalled http(s) download may block its download thread (connect and each read).
+HTTP_TIMEOUT = 120
+
+# Downloads pass retry=None; failures are retried by the RetryQueue, see gcs_client.py.
 
 def download_with_storage_client(bucket_name, blob_name, local_path):
-    TOKEN_PATH = "..."
-    client = storage.Client.from_service_account_json(TOKEN_PATH)
+    client = get_storage_client()
+    bucket = client.bucket(bucket_name)
+    blob = bucket.blob(blob_name)
+    blob.download_to_filename(local_path, retry=None)
+
+def download_bytes_with_storage_client(bucket_name, blob_name):
+    client = get_storage_client()
     bucket = client.bucket(bucket_name)
     blob = bucket.blob(blob_name)
-    blob.download_to_filename(local_path)
+    return blob.download_as_bytes(retry=None)
+
+def fetch_bytes(url):
+    """
+    Fetch a file into memory. Besides gs:// URLs (set STORAGE_EMULATOR_HOST to
+    target a local fake GCS), http(s):// URLs and local paths are accepted, so the
+    pipeline can run against a local directory or an HTTP stand-in for the bucket.
+    """
+    if url.startswith("gs://"):
+        bucket_name, blob_name = url.replace('gs://', '').split('/', 1)
+        return download_bytes_with_storage_client(bucket_name, blob_name)
+    if url.startswith(("http://", "https://")):
+        with urllib.request.urlopen(url, timeout=HTTP_TIMEOUT) as response:
+            return response.read()
+    with open(url.removeprefix("file://"), 'rb') as f:
+        return f.read()
 
 def process_file(gs_url, download_folder):
     gs_url = gs_url.strip()
+    local_path = f"{download_folder}/{gs_url.split('/')[-1]}"
     if gs_url.startswith("gs://"):
         bucket_name, blob_name = gs_url.replace('gs://', '').split('/', 1)
-        local_path = f"{download_folder}/{blob_name.split('/')[-1]}"
         download_with_storage_client(bucket_name, blob_name, local_path)
-        
-        return local_path
-    return None
+    else:
+        data = fetch_bytes(gs_url)
+        with open(local_path, 'wb') as f:
+            f.write(data)
+    return local_path
 
-def calculate_contact_order(cif_file, distance_cutoff=8.0):
+def download_cif_files(file_list, download_folder="./tmp", num_workers=16, max_attempts=5, max_per_host=None):
     """
-    Calculate contact order for a protein structure in a CIF file.
-    Checks if the file is empty or contains valid data.
-
-    Parameters:
-        cif_file (str): Path to the CIF file.
-        distance_cutoff (float): Distance threshold (in Å) to define a contact.
+    Download a checkpoint's files through a RetryQueue: transient failures are
+    retried in the background while the other files keep downloading, so the
+    checkpoint needs no rerun for them.
 
     Returns:
-        dict: Filename and contact order result.
+        list: (local path or None, error or None) per file, in input order.
     """
-    parser = MMCIFParser(QUIET=True)
-
-    if os.path.getsize(cif_file) == 0:
-        return {"file": cif_file, "contact_order": None, "error": "File is empty"}
-
-    try:
-        structure = parser.get_structure("protein", cif_file)
-
-        residues = []
-        coordinates = []
-        
-        for model in structure:
-            for chain in model:
-                for residue in chain:
-                    if 'CA' in residue:
-                        residues.append(residue)
-                        coordinates.append(residue['CA'].get_coord())
-
-        if len(residues) == 0:
-            return {"file": cif_file, "contact_order": None, "error": "No residues found in the file"}
-
-        coordinates = np.array(coordinates)
-        num_residues = len(residues)
-
-        if num_residues < 2:
-            return {"file": cif_file, "contact_order": None, "error": "Too few residues to calculate contact order"}
-
-        distances = np.linalg.norm(coordinates[:, None, :] - coordinates[None, :, :], axis=-1)
-
-        contacts = (distances < distance_cutoff) & (distances > 0)
-
-        total_contact_order = 0
-        num_contacts = 0
-
-        for i in range(num_residues):
-            for j in range(i + 1, num_residues):
-                if contacts[i, j]:
-                    sequence_distance = abs(i - j)
-                    total_contact_order += sequence_distance
-                    num_contacts += 1
-
-        contact_order = total_contact_order / (num_residues * num_contacts) if num_contacts > 0 else 0
-
-        return {"file": cif_file, "contact_order": contact_order, "error": None}
+    downloads = {}
+    for url, local_path, error, attempts in fetch_with_retries(
+        file_list, lambda url: process_file(url, download_folder), num_workers=num_workers,
+        max_attempts=max_attempts, max_per_host=max_per_host,
+    ):
+        downloads[url] = (local_path, failure_message(error, attempts) if error is not None else None)
+    return [downloads[url.strip()] for url in file_list]
+
+def process_cif_files(file_list, distance_cutoff=8.0, parser="fast", method="cell_list", metrics=None, store=None,
+                      trace=False, plddt_filter=None):
+    tasks = [
+        delayed(calculate_contact_order)(file, distance_cutoff, parser, method, metrics, store=store,
+                                         trace=new_trace() if trace else None, plddt_filter=plddt_filter)
+        for file in file_list
+    ]
+    results = dask.compute(*tasks)
+    return results
 
-    except Exception as e:
-        return {"file": cif_file, "contact_order": None, "error": str(e)}
 
+class InFlightBudget:
+    """
+    Bounds the number of files and bytes held between download and compute.
+    A file slot is taken before downloading; its bytes are charged once known.
+    A single file larger than the byte limit is still let through on its own.
+    """
 
-def download_cif_files(file_list, download_folder="./tmp"):
-    tasks = [delayed(process_file)(gs_url, download_folder) for gs_url in file_list]
-    results = dask.compute(*tasks)
-    return results
+    def __init__(self, max_files, max_bytes):
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.files = 0
+        self.bytes = 0
+        self._condition = threading.Condition()
+
+    def acquire_file(self):
+        with self._condition:
+            self._condition.wait_for(lambda: self.files < self.max_files)
+            self.files += 1
+
+    def acquire_bytes(self, num_bytes):
+        with self._condition:
+            self._condition.wait_for(lambda: self.bytes == 0 or self.bytes + num_bytes <= self.max_bytes)
+            self.bytes += num_bytes
+
+    def release(self, num_bytes):
+        with self._condition:
+            self.files -= 1
+            self.bytes -= num_bytes
+            self._condition.notify_all()
+
+    def close(self):
+        """Stop bounding, so blocked downloads can finish when the consumer goes away."""
+        with self._condition:
+            self.max_files = self.max_bytes = float("inf")
+            self._condition.notify_all()
+
+def stream_contact_order(url_list, executor, distance_cutoff=8.0, parser="fast", method="cell_list", metrics=None,
+                         download_workers=16, max_files_in_flight=64, max_bytes_in_flight=512 * 2**20,
+                         download_folder=None, trace=False, plddt_filter=None, max_attempts=5, max_per_host=None,
+                         partial_fetch=False, atom_site_index=None):
+    """
+    Pipelined download -> compute. Download threads (a RetryQueue, see
+    download_retry.py) feed files to the compute executor as soon as they
+    arrive, bounded by InFlightBudget, and results are yielded in completion
+    order, so network and CPUs work at the same time.
 
-def process_cif_files(file_list, distance_cutoff=8.0):
-    tasks = [delayed(calculate_contact_order)(file, distance_cutoff) for file in file_list]
-    results = dask.compute(*tasks)
-    return results
+    Parameters:
+        url_list (list): gs://, http(s):// URLs or local paths, see fetch_bytes.
+        executor (Executor): concurrent.futures-compatible compute executor,
+            e.g. Client.get_executor() or a ProcessPoolExecutor.
+        download_workers (int): Number of concurrent downloads.
+        max_files_in_flight (int): Files downloaded but not yet yielded.
+        max_bytes_in_flight (int): Bytes downloaded but not yet yielded.
+        download_folder (str): If None, files are never written to disk and their
+            content is sent to the compute workers; otherwise each file is written
+            there and deleted as soon as its result has been yielded.
+        trace (bool): Attach per-file stage timings, including the download, to the
+            results, see tracing.py.
+        plddt_filter (PlddtFilter): Confidence filter, see contact_order_common.PlddtFilter.
+        max_attempts (int): Download attempts per file; transient failures are retried
+            with backoff while the other files keep downloading.
+        max_per_host (int): Concurrent downloads per bucket / server, download_workers if None.
+        partial_fetch (bool): Download only the _atom_site loop of every file with
+            ranged reads (see range_fetch.py). The global pLDDT is then not available,
+            so it cannot be combined with plddt_filter.min_global.
+        atom_site_index (AtomSiteIndex): Cached loop offsets for partial_fetch.
+
+    Yields:
+        dict: Result of calculate_contact_order; "file" is the source URL.
+    """
+    budget = InFlightBudget(max_files_in_flight, max_bytes_in_flight)
+    finished = queue.Queue()
+    columns = result_columns(distance_cutoff, metrics)
+    url_list = [url.strip() for url in url_list]
+    if partial_fetch and plddt_filter is not None and plddt_filter.min_global is not None:
+        raise ValueError("partial_fetch leaves out the global pLDDT, use plddt_filter.min_residue only")
+
+    def timed_fetch(url):
+        start = time.perf_counter()
+        data = fetch_atom_site(url, atom_site_index) if partial_fetch else fetch_bytes(url)
+        return data, time.perf_counter() - start
+
+    def downloaded(url, fetched, error, attempts):
+        if error is not None:
+            result = {"file": url, **dict.fromkeys(columns), "error": failure_message(error, attempts)}
+            if trace:
+                result["trace"] = {"worker": worker_id(), "attempts": attempts}
+            finished.put((result, None, 0))
+            return
+        data, download_time = fetched
+        file_trace = new_trace(download=download_time, attempts=attempts) if trace else None
+
+        budget.acquire_bytes(len(data))
+        local_path = None
+        try:
+            if download_folder is not None:
+                local_path = f"{download_folder}/{url.split('/')[-1]}"
+                with open(local_path, 'wb') as f:
+                    f.write(data)
+                future = executor.submit(calculate_contact_order, local_path, distance_cutoff, parser, method,
+                                         metrics, trace=file_trace, plddt_filter=plddt_filter)
+            else:
+                future = executor.submit(calculate_contact_order, url, distance_cutoff, parser, method, metrics,
+                                         data, trace=file_trace, plddt_filter=plddt_filter)
+        except Exception as e:
+            # A failed local write (e.g. disk full) or submit (e.g. a closed executor)
+            # still finishes the file, or the consumer would wait for it forever. The
+            # file never ran, so the error is not cached (see result_cache.TRANSIENT_ERRORS).
+            result = {"file": url, **dict.fromkeys(columns), "error": f"Worker failed: {type(e).__name__}: {e}"}
+            if local_path is not None and not os.path.exists(local_path):
+                local_path = None
+            finished.put((result, local_path, len(data)))
+            return
+
+        def done(future):
+            try:
+                result = future.result()
+                result["file"] = url
+            except Exception as e:
+                result = {"file": url, **dict.fromkeys(columns), "error": str(e)}
+            finished.put((result, local_path, len(data)))
+
+        future.add_done_callback(done)
+
+    downloader = RetryQueue(timed_fetch, downloaded, num_workers=download_workers, max_attempts=max_attempts,
+                            max_per_host=max_per_host)
+
+    def feed():
+        # A file slot is taken once per file, not per attempt.
+        try:
+            for url in url_list:
+                budget.acquire_file()
+                downloader.submit(url)
+            downloader.close()
+        except RuntimeError:
+            pass  # cancelled, see below
+
+    threading.Thread(target=feed, daemon=True).start()
+    try:
+        for _ in range(len(url_list)):
+            result, local_path, num_bytes = finished.get()
+            yield result
+            if local_path is not None:
+                os.remove(local_path)
+            budget.release(num_bytes)
+    finally:
+        budget.close()
+        downloader.cancel()
 
 
 if __name__ == "__main__":
@@ -112,58 +252,102 @@ if __name__ == "__main__":
     scratch_directory = os.getenv("SCRATCH")
     manifest_file = f"{scratch_directory}/lsc_data/manifest.txt"
     cif_directory = f"{scratch_directory}/lsc_data/data"
-    output_file = f"{scratch_directory}/lsc_data/contact_order_results.csv"
-    output_log_file = f"{scratch_directory}/lsc_data/logs.csv"
-    tmp_dir = "./tmp"
-
-    with open(manifest_file, 'r') as f:
-        file_list = f.readlines()
+    # In a SLURM array job every task writes its share of the manifest into its own
+    # directory; for the outputs and the settings below, see CheckpointRun.
+    shard_index, num_shards = shard_from_env()
+    output_directory = shard_directory(f"{scratch_directory}/lsc_data", shard_index, num_shards)
+    run = CheckpointRun(
+        output_directory,
+        results_format="parquet",  # or "csv"
+        organisms_file=None,
+        min_global_plddt=None,  # e.g. 70
+        min_residue_plddt=None,  # e.g. 70
+        shard_index=shard_index,
+        num_shards=num_shards,
+    )
+    trace_events = True
+    # Set to e.g. f"{scratch_directory}/lsc_data/dask-report.html" to capture a Dask performance report.
+    performance_report_file = None
+    tmp_dir = "./tmp" if num_shards == 1 else f"./tmp-{shard_index:04d}"
+
+    # Pipelined mode streams downloads into the compute workers instead of
+    # downloading, computing and deleting each checkpoint in separate phases.
+    pipelined = True
+    # In pipelined mode, download only the _atom_site loop of every file with ranged
+    # reads; the loop offsets are kept for reruns in atom_site_index.sqlite. Without the
+    # metadata there is no global pLDDT, so it combines with min_residue_plddt only.
+    partial_fetch = False
+    atom_site_index = AtomSiteIndex(f"{output_directory}/atom_site_index.sqlite") if partial_fetch else None
+
+    # The manifest may carry object sizes (e.g. `gsutil ls -l` output) to schedule by.
+    file_list, sizes = read_manifest(manifest_file)
+    file_list = run.inputs(file_list, sizes)
+
+    reports = ExitStack()
+    if performance_report_file:
+        reports.enter_context(performance_report(filename=performance_report_file))
 
     if not file_list:
         print("No CIF files found in the specified directory.")
-    else:
-
-        global_start_time = time.time()
+    elif pipelined:
+        # There is no barrier to wait at, so a checkpoint is simply written every
+        # few minutes (or every checkpoint_bytes of input, if sizes are known).
+        checkpoint_seconds = 300
+        checkpoint_bytes = 256 * 2**20
+
+        results = []
+        results_bytes = 0
+        start_idx = 0
+        start_time = time.time()
+        stream = stream_contact_order(file_list, client.get_executor(), distance_cutoff=8.0, trace=trace_events,
+                                      plddt_filter=run.plddt_filter, partial_fetch=partial_fetch,
+                                      atom_site_index=atom_site_index)
+
+        for idx, result in enumerate(stream, start=1):
+            results.append(result)
+            results_bytes += sizes.get(result["file"], 0)
+            if (idx < len(file_list) and time.time() - start_time < checkpoint_seconds
+                    and results_bytes < checkpoint_bytes):
+                continue
 
-        num_checkpoints = 100
-        chunk_size = len(file_list) // num_checkpoints
+            end_time = time.time()
+            run.write(results, start_idx, idx, start_time, end_time, checkpoint_bytes=results_bytes)
 
-        for checkpoint_idx in range(num_checkpoints):
-            start_idx = checkpoint_idx * chunk_size
-            end_idx = (checkpoint_idx + 1) * chunk_size if checkpoint_idx < num_checkpoints - 1 else len(file_list)
+            results = []
+            results_bytes = 0
+            start_idx = idx
+            start_time = end_time
+    else:
+        # Checkpoints of about 5 minutes (download and compute) each, sized from
+        # the throughput so far; without sizes in the manifest, by file count.
+        checkpoints = AdaptiveCheckpoints(file_list, sizes, target_seconds=300)
 
+        for start_idx, end_idx in checkpoints:
+            download_start_time = time.time()
             Path(tmp_dir).mkdir(exist_ok=True, parents=True)
-            filepaths = download_cif_files(file_list[start_idx:end_idx], download_folder=tmp_dir)
+            downloads = download_cif_files(file_list[start_idx:end_idx], download_folder=tmp_dir)
             
             start_time = time.time()
-            results = process_cif_files(filepaths, distance_cutoff=8.0)
+            # Only downloaded files are computed; the others get their download error as result.
+            downloaded = [local_path for local_path, error in downloads if error is None]
+            computed = iter(process_cif_files(downloaded, distance_cutoff=8.0, trace=trace_events,
+                                              plddt_filter=run.plddt_filter))
+            columns = result_columns(8.0, None)
+            results = [
+                next(computed) if error is None else {"file": None, **dict.fromkeys(columns), "error": error}
+                for local_path, error in downloads
+            ]
             end_time = time.time()
 
+            # Report (and cache) results by source URL rather than by the deleted tmp file.
+            for url, result in zip(file_list[start_idx:end_idx], results):
+                result["file"] = url.strip()
+
             shutil.rmtree(tmp_dir)
-            
-            df = pd.DataFrame(results)
-            df_logs = pd.DataFrame.from_dict(
-                {
-                    "start_idx": [start_idx],
-                    "end_idx": [end_idx],
-                    "start_time": [start_time],
-                    "end_time": [end_time],
-                    "checkpoint_duration": [end_time-start_time],
-                    "global_duration": [end_time-global_start_time],
-                    }
-                )
-            if checkpoint_idx==0:
-                df.to_csv(output_file, index=False)
-                df_logs.to_csv(output_log_file, index=False)
-            else:
-                df.to_csv(output_file, mode='a', index=False, header=False)
-                df_logs.to_csv(output_log_file, mode='a', index=False, header=False)
-            
-            print(f"Checkpoint {checkpoint_idx+1}/{num_checkpoints}")
-            print(f"Processing time: {end_time - start_time:.2f} seconds")
-            print(f"Results saved to {output_file}, logs to {output_log_file}")
-        global_end_time = time.time()
-        
-        print(f"Processing time: {global_end_time - global_end_time:.2f} seconds")
-        print(f"Results saved to {output_file}")
-        print("Processing completed successfully.")
\ No newline at end of file
+            checkpoints.record(end_time - download_start_time)
+            run.write(results, start_idx, end_idx, start_time, end_time,
+                      download_duration=start_time - download_start_time)
+    reports.close()
+    if atom_site_index is not None:
+        atom_site_index.close()
+    run.close()
@@ -0,0 +1,213 @@
+import os
+import time
+from pathlib import Path
+import numpy as np
+from cif_reader import read_coordinates
+from cif_sources import list_inputs
+from result_cache import accession
+
+INDEX_FILE = "index.npz"
+
+
+class CoordinateStoreWriter:
+    """
+    Packs CA coordinates of many structures into a few sharded float32 .npy
+    files plus an offset index by accession. Files that failed extraction are
+    recorded in the index with their error.
+
+    Parameters:
+        path (str): Store directory.
+        shard_residues (int): Residues per shard (12 bytes each).
+    """
+
+    def __init__(self, path, shard_residues=16 * 2**20):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.shard_residues = shard_residues
+
+        self.accessions = []
+        self.shards = []
+        self.offsets = []
+        self.lengths = []
+
+        self.error_accessions = []
+        self.error_messages = []
+
+        self._buffer = []
+        self._buffered = 0
+        self._num_shards = 0
+
+    def add_error(self, name, error):
+        self.error_accessions.append(name)
+        self.error_messages.append(error)
+
+    def append(self, name, coordinates):
+        self.accessions.append(name)
+        self.shards.append(self._num_shards)
+        self.offsets.append(self._buffered)
+        self.lengths.append(len(coordinates))
+
+        self._buffer.append(np.asarray(coordinates, dtype=np.float32))
+        self._buffered += len(coordinates)
+        if self._buffered >= self.shard_residues:
+            self._flush()
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        np.save(self.path / f"shard-{self._num_shards:05d}.npy", np.concatenate(self._buffer))
+        self._buffer = []
+        self._buffered = 0
+        self._num_shards += 1
+
+    def close(self):
+        self._flush()
+        # The index is written last and atomically; a store without it is incomplete.
+        tmp_path = self.path / f".{INDEX_FILE}"
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                accessions=np.array(self.accessions, dtype=str),
+                shards=np.array(self.shards, dtype=np.int32),
+                offsets=np.array(self.offsets, dtype=np.int64),
+                lengths=np.array(self.lengths, dtype=np.int64),
+                error_accessions=np.array(self.error_accessions, dtype=str),
+                error_messages=np.array(self.error_messages, dtype=str),
+            )
+        os.replace(tmp_path, self.path / INDEX_FILE)
+
+
+class CoordinateStore:
+    """
+    Read side of a store built by CoordinateStoreWriter. Shards are opened as
+    read-only memory maps and get() returns zero-copy slices of them.
+
+    The store pickles as just its path, so it can be passed to process pools
+    and Dask workers; every process maps the shards on first use.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        index = np.load(self.path / INDEX_FILE)
+        self.accessions = index["accessions"]
+        self.shards = index["shards"]
+        self.offsets = index["offsets"]
+        self.lengths = index["lengths"]
+        self.errors = dict(zip(index["error_accessions"].tolist(), index["error_messages"].tolist()))
+        self._positions = None
+        self._mmaps = {}
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+    def __len__(self):
+        return len(self.accessions)
+
+    def __contains__(self, name):
+        return self._position(name) is not None
+
+    def covers(self, name):
+        """
+        Whether the store has the coordinates of `name`, or the error its extraction
+        failed with; files added since the store was built are not covered.
+        """
+        return name in self or accession(name) in self.errors
+
+    def _position(self, name):
+        if self._positions is None:
+            self._positions = {str(a): i for i, a in enumerate(self.accessions)}
+        return self._positions.get(accession(name))
+
+    def _shard(self, shard):
+        if shard not in self._mmaps:
+            self._mmaps[shard] = np.load(self.path / f"shard-{shard:05d}.npy", mmap_mode="r")
+        return self._mmaps[shard]
+
+    def get(self, name):
+        """
+        Coordinates of an accession (or of a file/URL named after it).
+
+        Returns:
+            np.ndarray: Read-only float32 view of shape (num_residues, 3).
+        """
+        position = self._position(name)
+        if position is None:
+            if accession(name) in self.errors:
+                raise ValueError(self.errors[accession(name)])
+            raise LookupError(f"{name} is not in the coordinate store")
+        offset = self.offsets[position]
+        return self._shard(int(self.shards[position]))[offset:offset + self.lengths[position]]
+
+
+def _extract_chunk(file_list, parser="fast"):
+    extracted = []
+    for file in file_list:
+        if os.path.getsize(file) == 0:
+            extracted.append((file, None, "File is empty"))
+            continue
+        try:
+            extracted.append((file, read_coordinates(file, parser=parser), None))
+        except Exception as e:
+            extracted.append((file, None, str(e)))
+    return extracted
+
+
+def build_coordinate_store(file_list, path, executor=None, parser="fast", chunksize=256, shard_residues=16 * 2**20):
+    """
+    Extraction stage: parse every CIF once and pack its CA coordinates into a store.
+
+    Parameters:
+        file_list (list): Paths to the CIF files.
+        path (str): Store directory.
+        executor (Executor): Optional concurrent.futures-compatible executor to parse
+            chunks of files in parallel; files are parsed in-process if None.
+        parser (str): "fast" or "biopython", see cif_reader.read_coordinates.
+        chunksize (int): Files per parse task.
+        shard_residues (int): Residues per shard.
+
+    Returns:
+        list: {"file", "error"} dicts for files that could not be parsed.
+    """
+    writer = CoordinateStoreWriter(path, shard_residues)
+    chunks = [file_list[i:i + chunksize] for i in range(0, len(file_list), chunksize)]
+    if executor is None:
+        extracted_chunks = (_extract_chunk(chunk, parser) for chunk in chunks)
+    else:
+        extracted_chunks = executor.map(_extract_chunk, chunks, [parser] * len(chunks))
+
+    errors = []
+    for extracted in extracted_chunks:
+        for file, coordinates, error in extracted:
+            if error is None:
+                writer.append(accession(file), coordinates)
+            else:
+                writer.add_error(accession(file), error)
+                errors.append({"file": file, "error": error})
+    writer.close()
+
+    return errors
+
+
+if __name__ == "__main__":
+    from concurrent.futures import ProcessPoolExecutor
+
+    scratch_directory = os.getenv("SCRATCH")
+    cif_directory = f"{scratch_directory}/lsc_data/data"
+    store_directory = f"{scratch_directory}/lsc_data/ca_store"
+    num_workers = int(os.getenv("SLURM_CPUS_PER_TASK", os.cpu_count()))
+
+    # Loose .cif and .cif.gz files; tar shards are streamed by the workers and not stored.
+    file_list, shard_list = list_inputs(cif_directory)
+    if shard_list:
+        print(f"Skipping {len(shard_list)} tar shards; their members are read from the shards.")
+
+    start_time = time.time()
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        errors = build_coordinate_store(file_list, store_directory, executor=executor)
+    end_time = time.time()
+
+    print(f"Extracted {len(file_list) - len(errors)}/{len(file_list)} structures in {end_time - start_time:.2f} seconds")
+    print(f"Coordinate store saved to {store_directory}")
@@ -0,0 +1,254 @@
+import collections
+import heapq
+import queue
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+# Retry queue for downloads. A fixed set of worker threads fetch URLs; a
+# transient failure (timeout, dropped connection, 408/429/5xx) does not hold its
+# worker while it waits: the URL goes back into the queue with a jittered
+# exponential backoff and the worker moves on to the next URL, so a checkpoint
+# finishes at full throughput instead of needing a rerun for its failed files.
+# Permanent failures (404, 403, bad URLs, ...) fail the file at once.
+#
+# Requests are also throttled per host (GCS bucket or HTTP server): at most
+# max_per_host run against one host at a time, and a 429 (Too Many Requests)
+# halves that host's limit, which then grows back by one per `limit` successes.
+#
+# download_tests/fake_gcs_server.py can inject 503s, 429s and dropped
+# connections to test this locally.
+
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+
+# Statuses worth retrying; any other status is permanent.
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+THROTTLE_STATUS = 429
+
+
+def http_status(error):
+    """
+    HTTP status of a download error, or None: aiohttp's ClientResponseError and
+    urllib's HTTPError have `status` (aiohttp deprecates its `code`),
+    google.api_core exceptions have `code`, requests' HTTPError has
+    `response.status_code`.
+    """
+    for name in ("status", "code"):
+        value = getattr(error, name, None)
+        if isinstance(value, int) and 100 <= value < 600:
+            return value
+    value = getattr(getattr(error, "response", None), "status_code", None)
+    return value if isinstance(value, int) and 100 <= value < 600 else None
+
+
+def classify_failure(error):
+    """
+    TRANSIENT or PERMANENT. The exception and its causes are searched for an
+    HTTP status first; without one, network errors (OSError, which includes
+    socket, urllib and requests errors) are transient, missing or unreadable
+    local files and everything else are permanent.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        status = http_status(error)
+        if status is not None:
+            return TRANSIENT if status in RETRY_STATUSES else PERMANENT
+        if isinstance(error, (FileNotFoundError, IsADirectoryError, NotADirectoryError, PermissionError)):
+            return PERMANENT
+        if isinstance(error, (OSError, TimeoutError)):
+            return TRANSIENT
+        error = error.__cause__ or error.__context__
+    return PERMANENT
+
+
+def failure_message(error, attempts):
+    """
+    Result error for a failed download. It starts with "Download failed", so
+    the result is not cached (see result_cache.TRANSIENT_ERRORS) and counts as
+    one error reason in the statistics.
+    """
+    kind = classify_failure(error)
+    return f"Download failed: {kind} error after {attempts} attempt(s): {str(error) or type(error).__name__}"
+
+
+def backoff_delay(attempt, backoff=0.5, max_backoff=30.0):
+    """
+    Seconds to wait before retry number `attempt` (0 for the first retry): about
+    backoff * 2**attempt, at most max_backoff, jittered by +-50% so retries of
+    many files don't arrive together.
+    """
+    return min(max_backoff, backoff * 2**attempt) * random.uniform(0.5, 1.5)
+
+
+def host_key(url):
+    """
+    Throttling key of a URL: the bucket of gs:// URLs, the server of http(s)://
+    URLs, and one shared key for local paths.
+    """
+    url = url.strip()
+    if url.startswith("gs://"):
+        return "gs://" + url[len("gs://"):].split("/", 1)[0]
+    if url.startswith(("http://", "https://")):
+        return urlparse(url).netloc
+    return ""
+
+
+class RetryQueue:
+    """
+    Fetch URLs on `num_workers` threads, re-enqueueing transient failures with
+    jittered exponential backoff and throttling requests per host.
+
+    Parameters:
+        fetch (callable): fetch(url) -> value; raises on failure.
+        on_done (callable): Called as on_done(url, value, error, attempts) from a
+            worker thread when a URL is finished; error is None on success, else
+            the last exception.
+        num_workers (int): Concurrent fetches.
+        max_attempts (int): Attempts per URL, including the first one.
+        backoff (float): Base delay in seconds; attempt k waits about backoff * 2**k.
+        max_backoff (float): Upper bound of a single delay in seconds.
+        max_per_host (int): Concurrent fetches per host, num_workers if None.
+        classify (callable): classify(error) -> TRANSIENT or PERMANENT.
+    """
+
+    def __init__(self, fetch, on_done, num_workers=16, max_attempts=5, backoff=0.5, max_backoff=30.0,
+                 max_per_host=None, classify=classify_failure):
+        self.fetch = fetch
+        self.on_done = on_done
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_per_host = max_per_host or num_workers
+        self.classify = classify
+        # Counters of the whole run: fetch attempts, retries and final failures by kind.
+        self.counts = {"attempts": 0, "retries": 0, TRANSIENT: 0, PERMANENT: 0}
+
+        self._ready = collections.OrderedDict()  # host -> deque of (url, attempt)
+        self._delayed = []  # heap of (ready time, sequence number, url, attempt)
+        self._sequence = 0
+        self._active = collections.Counter()
+        self._limits = {}
+        self._pending = 0
+        self._closed = False
+        self._cancelled = False
+        self._condition = threading.Condition()
+        self._workers = [
+            threading.Thread(target=self._work, name=f"retry-queue-{i}", daemon=True) for i in range(num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, url):
+        url = url.strip()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Cannot submit to a closed RetryQueue")
+            self._pending += 1
+            self._ready.setdefault(host_key(url), collections.deque()).append((url, 0))
+            self._condition.notify()
+
+    def close(self):
+        """No more submissions; the workers stop once every URL is finished."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def cancel(self):
+        """Close and drop the URLs not started yet; fetches in progress still finish."""
+        with self._condition:
+            self._closed = self._cancelled = True
+            self._pending -= sum(len(urls) for urls in self._ready.values()) + len(self._delayed)
+            self._ready.clear()
+            self._delayed.clear()
+            self._condition.notify_all()
+
+    def join(self):
+        for worker in self._workers:
+            worker.join()
+
+    def _limit(self, host):
+        return self._limits.get(host, self.max_per_host)
+
+    def _next(self):
+        # Next URL whose host is below its limit, or None when the queue is done.
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                while self._delayed and self._delayed[0][0] <= now:
+                    _, _, url, attempt = heapq.heappop(self._delayed)
+                    self._ready.setdefault(host_key(url), collections.deque()).append((url, attempt))
+                for host, urls in self._ready.items():
+                    if self._active[host] < int(self._limit(host)):
+                        url, attempt = urls.popleft()
+                        if not urls:
+                            del self._ready[host]
+                        else:
+                            # Round robin over hosts.
+                            self._ready.move_to_end(host)
+                        self._active[host] += 1
+                        self.counts["attempts"] += 1
+                        return url, attempt
+                if self._closed and self._pending == 0:
+                    self._condition.notify_all()
+                    return None
+                self._condition.wait(self._delayed[0][0] - now if self._delayed else None)
+
+    def _work(self):
+        while (item := self._next()) is not None:
+            url, attempt = item
+            host = host_key(url)
+            value = error = None
+            try:
+                value = self.fetch(url)
+            except Exception as e:
+                error = e
+
+            with self._condition:
+                self._active[host] -= 1
+                self._condition.notify_all()
+                if error is None:
+                    limit = self._limit(host)
+                    if limit < self.max_per_host:
+                        self._limits[host] = min(self.max_per_host, limit + 1 / limit)
+                else:
+                    kind = self.classify(error)
+                    if http_status(error) == THROTTLE_STATUS:
+                        self._limits[host] = max(1.0, self._limit(host) / 2)
+                    if kind == TRANSIENT and attempt + 1 < self.max_attempts and not self._cancelled:
+                        delay = backoff_delay(attempt, self.backoff, self.max_backoff)
+                        heapq.heappush(self._delayed, (time.monotonic() + delay, self._sequence, url, attempt + 1))
+                        self._sequence += 1
+                        self.counts["retries"] += 1
+                        continue
+                    self.counts[kind] += 1
+
+            try:
+                self.on_done(url, value, error, attempt + 1)
+            finally:
+                with self._condition:
+                    self._pending -= 1
+                    self._condition.notify_all()
+
+
+def fetch_with_retries(urls, fetch, **kwargs):
+    """
+    Fetch all URLs through a RetryQueue (keyword arguments are passed to it).
+
+    Yields:
+        tuple: (url, value, error, attempts) per URL, in completion order.
+    """
+    finished = queue.Queue()
+    retry_queue = RetryQueue(fetch, lambda *result: finished.put(result), **kwargs)
+    try:
+        urls = [url.strip() for url in urls]
+        for url in urls:
+            retry_queue.submit(url)
+        retry_queue.close()
+        for _ in range(len(urls)):
+            yield finished.get()
+    finally:
+        retry_queue.cancel()
+        retry_queue.join()
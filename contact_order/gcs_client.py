@@ -0,0 +1,31 @@
+import os
+import threading
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import storage
+
+TOKEN_PATH = "..."
+
+_storage_clients = threading.local()
+
+
+def create_storage_client(token_path=TOKEN_PATH):
+    # With STORAGE_EMULATOR_HOST set (e.g. download_tests/fake_gcs_server.py) no credentials are needed.
+    if os.getenv("STORAGE_EMULATOR_HOST"):
+        return storage.Client(project="test", credentials=AnonymousCredentials())
+    return storage.Client.from_service_account_json(token_path)
+
+
+def get_storage_client():
+    """
+    Return the storage client of the current download thread. Credentials, auth
+    and the HTTP session are set up once per thread, and keep-alive connections
+    are reused by every download.
+
+    Downloads should pass retry=None: the library's own retries (retry=DEFAULT_RETRY)
+    would sleep in the download thread; failures are retried by the RetryQueue
+    instead, see download_retry.py.
+    """
+    client = getattr(_storage_clients, "client", None)
+    if client is None:
+        client = _storage_clients.client = create_storage_client()
+    return client
@@ -0,0 +1,35 @@
+#!/bin/bash
+#SBATCH --account=plglscclass24-cpu
+#SBATCH --partition=plgrid
+#SBATCH --job-name=contact_order
+#SBATCH --output=contact_order_%a.log
+#SBATCH --array=0-7
+#SBATCH --nodes=1
+#SBATCH --ntasks=1
+#SBATCH --cpus-per-task=16
+#SBATCH --mem-per-cpu=4GB
+#SBATCH --time=10:00:00
+
+# One node per array task, each processing its own shard of the inputs
+# (see sharding.py). Submit together with the merge job:
+#
+#   jobid=$(sbatch --parsable process_array.sh)
+#   sbatch --dependency=afterany:$jobid process_merge.sh
+#
+# SCRIPT=contact_order_concurrent.py or contact_order_download_batch.py
+# (sbatch --export=ALL,SCRIPT=...) runs another pipeline the same way.
+
+module load python
+
+# All tasks share the venv; the first one to get the lock creates it.
+(
+    flock 9
+    if [ ! -d venv ]; then
+        python -m venv venv
+        venv/bin/python -m pip install -r requirements.txt
+        venv/bin/python -m pip install "dask[distributed]" --upgrade
+    fi
+) 9>venv.lock
+source venv/bin/activate
+
+python "${SCRIPT:-contact_order.py}"
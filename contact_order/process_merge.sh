@@ -0,0 +1,19 @@
+#!/bin/bash
+#SBATCH --account=plglscclass24-cpu
+#SBATCH --partition=plgrid
+#SBATCH --job-name=contact_order_merge
+#SBATCH --output=contact_order_merge.log
+#SBATCH --nodes=1
+#SBATCH --ntasks=1
+#SBATCH --cpus-per-task=1
+#SBATCH --mem-per-cpu=16GB
+#SBATCH --time=1:00:00
+
+# Merges the shard outputs of process_array.sh and lists the inputs without a result.
+# For contact_order_concurrent.py use $SCRATCH/lsc_data/concurrent, for
+# contact_order_download_batch.py --manifest $SCRATCH/lsc_data/manifest.txt.
+
+module load python
+source venv/bin/activate
+
+python sharding.py "$SCRATCH/lsc_data" --cif-directory "$SCRATCH/lsc_data/data"
@@ -16,4 +16,7 @@ source venv/bin/activate
 python -m pip install -r requirements.txt
 python -m pip install "dask[distributed]" --upgrade
 
+# With DASK_CLUSTER=slurm (and DASK_JOBS=<n>) contact_order.py starts its Dask
+# workers as n extra SLURM jobs through dask-jobqueue; see process_array.sh for
+# independent array tasks instead.
 python contact_order.py
\ No newline at end of file
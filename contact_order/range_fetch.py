@@ -0,0 +1,319 @@
+import contextlib
+import io
+import itertools
+import re
+import sqlite3
+import threading
+import urllib.error
+import urllib.request
+from async_download import media_url
+from cif_reader import ATOM_SITE_PREFIX, read_ca_coordinates
+from result_cache import accession
+
+# Partial downloads of CIF files. Contact order needs only the CA rows of the
+# _atom_site loop, but AlphaFold files also carry metadata and per-residue QA
+# tables (_ma_qa_metric_local, _pdbx_poly_seq_scheme, ...). With HTTP Range
+# requests only the loop itself is fetched:
+#
+#   1. from a cached offset index (AtomSiteIndex): exactly its byte range;
+#   2. otherwise a small suffix probe reads the end of the file. If it ends in
+#      atom rows (the loop is the last category, as in AlphaFold files), the
+#      loop start is estimated from the serial number of the last atom and the
+#      row length, and only [estimate, probe) is fetched. An estimate past the
+#      loop header is detected on the first line and moved back;
+#   3. otherwise the file is read in growing ranged windows from the start,
+#      until the loop has ended.
+#
+# The lines of the loop are streamed into the CA extractor as they arrive
+# (read_atom_site_coordinates), or collected into a minimal mmCIF document for
+# compute workers (fetch_atom_site). Only uncompressed files can be read in part.
+
+TAIL_PROBE_SIZE = 2 * 1024
+# Room for the loop header (column names) and for rows longer than the ones in the probe.
+HEADER_SIZE = 1024
+ROW_LENGTH_MARGIN = 0.02
+WINDOW_SIZE = 16 * 1024
+# Seconds a stalled ranged read may block its download thread (connect and each read).
+HTTP_TIMEOUT = 120
+ATOM_RECORDS = (b"ATOM", b"HETATM")
+
+_CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+def open_range(url, start, end=None, headers=None):
+    """
+    Open a ranged read of bytes [start, end] (inclusive; to the end of the file
+    if end is None, the last -start bytes if start is negative) of a gs:// or
+    http(s):// URL (a GET with a Range header; see async_download.media_url) or a
+    local path. gs:// URLs are read anonymously, which works for public buckets
+    such as AlphaFold's; pass an Authorization header for others.
+
+    Returns:
+        tuple: (binary handle, start, end, size): the bytes [start, end) of the
+            file, which is `size` bytes long (None if unknown). A server that
+            ignores the range returns the whole file.
+    """
+    url = url.strip()
+    if not url.startswith(("gs://", "http://", "https://")):
+        handle = open(url.removeprefix("file://"), 'rb')
+        size = handle.seek(0, io.SEEK_END)
+        start = max(0, size + start) if start < 0 else min(start, size)
+        stop = size if end is None else min(end + 1, size)
+        handle.seek(start)
+        if stop < size:
+            with handle:
+                handle = io.BytesIO(handle.read(stop - start))
+        return handle, start, stop, size
+
+    byte_range = f"bytes={start}" if start < 0 else f"bytes={start}-{'' if end is None else end}"
+    request = urllib.request.Request(media_url(url), headers={**(headers or {}), "Range": byte_range})
+    try:
+        response = urllib.request.urlopen(request, timeout=HTTP_TIMEOUT)
+    except urllib.error.HTTPError as e:
+        # No range of an empty file is satisfiable; it reads as empty, as a local one does.
+        if e.code == 416 and e.headers.get("Content-Range", "").strip() == "bytes */0":
+            e.close()
+            return io.BytesIO(b""), 0, 0, 0
+        raise
+    length = response.headers.get("Content-Length")
+    if response.status == 206:
+        match = _CONTENT_RANGE.match(response.headers.get("Content-Range", ""))
+        if match is not None:
+            first, last, size = match.groups()
+            return response, int(first), int(last) + 1, int(size) if size != "*" else None
+    size = int(length) if length is not None else None
+    return response, 0, size, size
+
+
+def _lines(handles, offset, skip_partial=False):
+    """
+    (file offset, line) of the lines of binary handles read one after the other
+    from file offset `offset`; a line may continue from one handle into the next.
+    Every handle is closed once read. With skip_partial the first line, which
+    may start mid-line, is skipped.
+    """
+    carry = b""
+    for handle in handles:
+        with handle:
+            for line in handle:
+                if not line.endswith(b"\n"):
+                    carry += line
+                    continue
+                line, carry = carry + line, b""
+                if skip_partial:
+                    skip_partial = False
+                else:
+                    yield offset, line
+                offset += len(line)
+    if carry and not skip_partial:
+        yield offset, carry
+
+
+def _windows(url, start, headers=None, window=WINDOW_SIZE):
+    # Ranged reads of growing size from `start` to the end of the file.
+    while True:
+        handle, start, end, size = open_range(url, start, start + window - 1, headers)
+        yield handle
+        if size is None or end >= size:
+            return
+        start = end
+        window *= 2
+
+
+class _AtomSiteScanner:
+    """
+    Picks the _atom_site loop ("loop_", the column names and the rows) out of
+    (offset, line) pairs, as cif_reader._scan_atom_site delimits it, and records
+    its byte range [start, end).
+    """
+
+    def __init__(self):
+        self.start = None
+        self.end = None
+        # Size of the file, once known.
+        self.size = None
+        self._loop = None
+        self._in_rows = False
+
+    def scan(self, lines):
+        for offset, line in lines:
+            stripped = line.strip()
+            if self.start is None:
+                if stripped == b"loop_":
+                    self._loop = (offset, line)
+                elif self._loop is not None and stripped.startswith(ATOM_SITE_PREFIX):
+                    self.start = self._loop[0]
+                    yield self._loop[1]
+                    yield line
+                else:
+                    self._loop = None
+                continue
+
+            if not self._in_rows and not stripped.startswith(ATOM_SITE_PREFIX):
+                self._in_rows = True
+            if self._in_rows and stripped and (stripped[:1] in (b"#", b"_")
+                                               or stripped.startswith((b"loop_", b"data_"))):
+                self.end = offset
+                return
+            yield line
+            self.end = offset + len(line)
+
+
+def _estimate_start(tail, tail_offset):
+    """
+    Estimated start of the _atom_site loop if the probe `tail` (read from file
+    offset tail_offset) holds its last rows: the serial number (second column)
+    of the last atom times the mean row length before it, plus some margin.
+    None if the probe has no atom rows.
+    """
+    rows = []
+    offset = tail_offset
+    for i, line in enumerate(tail.splitlines(keepends=True)):
+        if (i > 0 or tail_offset == 0) and line.startswith(ATOM_RECORDS):
+            rows.append((offset, line))
+        offset += len(line)
+    if not rows:
+        return None
+    last_offset, last_row = rows[-1]
+    tokens = last_row.split()
+    if len(tokens) < 2 or not tokens[1].isdigit():
+        return None
+    row_length = sum(len(line) for _, line in rows) / len(rows)
+    return max(0, int(last_offset - (int(tokens[1]) - 1) * row_length * (1 + ROW_LENGTH_MARGIN) - HEADER_SIZE))
+
+
+def iter_atom_site(url, index=None, headers=None, probe_size=TAIL_PROBE_SIZE):
+    """
+    Stream the lines of the _atom_site loop of a remote (or local) uncompressed
+    CIF file with ranged reads, see the top of this module.
+
+    Parameters:
+        url (str): gs:// or http(s):// URL, or a local path (see open_range).
+        index (AtomSiteIndex): Offsets of loops seen before; found offsets are added.
+        headers (dict): Extra request headers, e.g. Authorization.
+        probe_size (int): Bytes of the suffix probe.
+
+    Yields:
+        bytes: "loop_", the _atom_site column names and the rows, with line endings;
+            nothing if the file has no _atom_site loop.
+    """
+    return _scan_atom_site(url, _AtomSiteScanner(), index, headers, probe_size)
+
+
+def _scan_atom_site(url, scanner, index=None, headers=None, probe_size=TAIL_PROBE_SIZE):
+    # iter_atom_site, recording the loop's byte range and the file size in `scanner`.
+    url = url.strip()
+    size = None
+
+    entry = index.get(url) if index is not None else None
+    if entry is not None:
+        size, start, end = entry
+        handle, offset, _, current_size = open_range(url, start, end - 1, headers)
+        with contextlib.closing(_lines([handle], offset)) as lines:
+            if current_size == size:
+                yield from scanner.scan(lines)
+
+    if scanner.start is None:
+        handle, tail_offset, _, size = open_range(url, -probe_size, headers=headers)
+        with handle:
+            tail = handle.read()
+        start = _estimate_start(tail, tail_offset) if tail_offset > 0 else 0
+        step = HEADER_SIZE
+
+        while start is not None and start < tail_offset:
+            # One byte early, so a loop header starting exactly at `start` is not skipped as partial.
+            handle, offset, end, _ = open_range(url, max(start - 1, 0), tail_offset - 1, headers)
+            handles = [handle, io.BytesIO(tail)] if end == tail_offset else [handle]
+            with contextlib.closing(_lines(handles, offset, skip_partial=offset > 0)) as lines:
+                first = next(lines, None)
+                past_header = first is not None and first[1].lstrip().startswith(ATOM_RECORDS + (ATOM_SITE_PREFIX,))
+                if not (offset > 0 and past_header):
+                    yield from scanner.scan(itertools.chain([first] if first is not None else [], lines))
+                    break
+            # Past the loop header: move back.
+            start, step = max(0, start - step), step * 2
+        else:
+            if start is not None or tail_offset == 0:
+                # The probe holds the loop header (or the whole file).
+                yield from scanner.scan(_lines([io.BytesIO(tail)], tail_offset, skip_partial=tail_offset > 0))
+
+        if scanner.start is None and tail_offset > 0:
+            # The loop is not at the end of the file (or was not found from the estimate).
+            with contextlib.closing(_lines(_windows(url, 0, headers), 0)) as lines:
+                yield from scanner.scan(lines)
+
+    scanner.size = size
+    # A file without the loop yields nothing, and gets the usual "no residues" result.
+    if index is not None and scanner.start is not None and entry != (size, scanner.start, scanner.end):
+        index.put(url, size, scanner.start, scanner.end)
+
+
+def fetch_atom_site(url, index=None, headers=None):
+    """
+    Fetch only the _atom_site loop of a CIF file (see iter_atom_site) as a
+    minimal mmCIF document, which read_coordinates and Biopython both parse.
+    Compressed (.gz) files are fetched whole.
+
+    Returns:
+        bytes: "data_<accession>", "#" and the _atom_site loop; empty for an empty
+            file, so it gets the usual "File is empty" result.
+    """
+    url = url.strip()
+    if url.endswith(".gz"):
+        handle, _, _, _ = open_range(url, 0, headers=headers)
+        with handle:
+            return handle.read()
+    scanner = _AtomSiteScanner()
+    loop = b"".join(_scan_atom_site(url, scanner, index, headers))
+    if scanner.size == 0:
+        return b""
+    return f"data_{accession(url)}\n#\n".encode() + loop
+
+
+def read_atom_site_coordinates(url, index=None, headers=None, min_plddt=None):
+    """
+    CA coordinates of a remote CIF file, parsed from the _atom_site loop as its
+    lines arrive (see cif_reader.read_ca_coordinates).
+    """
+    return read_ca_coordinates(iter_atom_site(url, index, headers), min_plddt)
+
+
+class AtomSiteIndex:
+    """
+    Persistent byte ranges of the _atom_site loops of remote files (in SQLite),
+    so later runs fetch every loop with a single ranged request. Entries record
+    the file size and are ignored when it changes.
+
+    Parameters:
+        path (str): SQLite database file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        # Used from the download threads.
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS atom_site (url TEXT PRIMARY KEY, size INTEGER, start INTEGER, end INTEGER)"
+        )
+        self.connection.commit()
+
+    def get(self, url):
+        """
+        (size, start, end) of the loop of `url`, or None.
+        """
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT size, start, end FROM atom_site WHERE url = ?", (url.strip(),)
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def put(self, url, size, start, end):
+        with self._lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO atom_site VALUES (?, ?, ?, ?)", (url.strip(), size, start, end)
+            )
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+import sqlite3
+from cif_sources import SHARD_SUFFIXES
+
+# Results with these error prefixes depend on the run, not on the file, so they are not cached.
+TRANSIENT_ERRORS = ("Download failed", "Worker failed")
+
+
+def accession(file):
+    """
+    AlphaFold accession of a path or URL, e.g. "AF-G4MV54-F1-model_v4".
+    """
+    name = os.path.basename(file.strip())
+    for extension in (".gz", ".cif"):
+        name = name.removesuffix(extension)
+    return name
+
+
+def split_shard_member(file):
+    """
+    Split "<shard>.tar/<member>" names (see cif_sources.iter_shard) into the
+    shard path and the member name; returns (None, None) for other names.
+    """
+    for suffix in SHARD_SUFFIXES:
+        shard, separator, member = file.partition(suffix + "/")
+        if separator:
+            return shard + suffix, member
+    return None, None
+
+
+def file_key(file, hash_content=False):
+    """
+    Identity of an input file. Local files are identified by accession plus
+    size and mtime, or plus a SHA-256 of the content if `hash_content` is set;
+    members of tar shards by accession plus the shard's size and mtime;
+    remote URLs (immutable bucket objects) by the URL itself.
+    """
+    file = file.strip()
+    if "://" in file and not file.startswith("file://"):
+        return file
+
+    path = file.removeprefix("file://")
+    shard, _ = split_shard_member(path)
+    if shard is not None and not os.path.exists(path):
+        stat = os.stat(shard)
+        return f"{accession(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    if hash_content:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return f"{accession(path)}:sha256:{digest.hexdigest()}"
+
+    stat = os.stat(path)
+    return f"{accession(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class ResultCache:
+    """
+    Persistent cache of contact order results, keyed by file identity (see
+    file_key) and computation parameters (cutoffs and metrics).
+
+    Results live in SQLite, so every put_many() is one atomic transaction and a
+    job killed mid-write leaves the cache at the last committed checkpoint.
+    The cache pickles as its settings, so workers can open it to skip finished files.
+
+    Parameters:
+        path (str): SQLite database file.
+        distance_cutoff (float | list): Cutoff(s) the results were computed with.
+        metrics (list): Metrics the results were computed with.
+        hash_content (bool): Identify local files by content hash instead of size/mtime.
+        filters (dict): Settings of input filters that change results (e.g.
+            PlddtFilter.params()), so runs with other filters don't share results.
+    """
+
+    def __init__(self, path, distance_cutoff=8.0, metrics=None, hash_content=False, filters=None):
+        self.path = path
+        self.distance_cutoff = distance_cutoff
+        self.metrics = metrics
+        params = {"distance_cutoff": distance_cutoff, "metrics": metrics}
+        if filters:
+            params["filters"] = filters
+        self.params = json.dumps(params, sort_keys=True)
+        self.hash_content = hash_content
+        self.filters = filters
+        self._keys = {}
+
+        # Workers unpickle the cache in one thread and use it in another.
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "file_key TEXT, params TEXT, accession TEXT, result TEXT, "
+            "PRIMARY KEY (file_key, params))"
+        )
+        self.connection.commit()
+
+    def __getstate__(self):
+        return {
+            "path": self.path,
+            "distance_cutoff": self.distance_cutoff,
+            "metrics": self.metrics,
+            "hash_content": self.hash_content,
+            "filters": self.filters,
+        }
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def key(self, file):
+        if file not in self._keys:
+            self._keys[file] = file_key(file, self.hash_content)
+        return self._keys[file]
+
+    def get(self, file):
+        row = self.connection.execute(
+            "SELECT result FROM results WHERE file_key = ? AND params = ?", (self.key(file), self.params)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def missing(self, file_list):
+        """
+        Files without a cached result for these parameters, in input order.
+        """
+        done = {key for (key,) in self.connection.execute("SELECT file_key FROM results WHERE params = ?", (self.params,))}
+        return [file for file in file_list if self.key(file) not in done]
+
+    def put_many(self, results):
+        """
+        Store result dicts (as returned by calculate_contact_order) in one transaction.
+        """
+        rows = [
+            (self.key(result["file"]), self.params, accession(result["file"]), json.dumps(result))
+            for result in results
+            if not (result["error"] or "").startswith(TRANSIENT_ERRORS)
+        ]
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)", rows)
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,349 @@
+import copy
+import csv
+import json
+import math
+import os
+import re
+import numpy as np
+from result_cache import accession
+
+# Running statistics of the results, updated from every checkpoint's results and
+# saved as a JSON snapshot next to logs.csv, so distributions and error counts
+# are available during and after a run without reloading the results. All parts
+# are mergeable: the snapshots of shards (or of several runs) combine into the
+# statistics of all their results (see ResultStats.merge).
+
+QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+# Linear histograms (low, high, bins) for result columns, matched by prefix.
+HISTOGRAM_RANGES = {
+    "contact_order": (0.0, 1.0, 100),
+    "relative_co": (0.0, 1.0, 100),
+}
+
+
+class QuantileSketch:
+    """
+    Streaming quantiles with relative accuracy (DDSketch): positive values are
+    counted in logarithmic buckets of relative width 2 * relative_accuracy, so
+    every quantile estimate is within that relative error of a true value.
+    Sketches with the same accuracy merge by adding bucket counts.
+    Values <= 0 are counted as zeros.
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.buckets = {}
+        self.zeros = 0
+        self.count = 0
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        positive = values[values > 0]
+        self.zeros += len(values) - len(positive)
+        self.count += len(values)
+        if len(positive):
+            keys, counts = np.unique(np.ceil(np.log(positive) / math.log(self.gamma)).astype(np.int64),
+                                     return_counts=True)
+            for key, count in zip(keys.tolist(), counts.tolist()):
+                self.buckets[key] = self.buckets.get(key, 0) + count
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with different accuracy")
+        for key, count in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zeros:
+            return 0.0
+        seen = self.zeros
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                # Midpoint (in relative terms) of the bucket (gamma^(key-1), gamma^key].
+                return 2 * self.gamma**key / (self.gamma + 1)
+        return 2 * self.gamma**max(self.buckets) / (self.gamma + 1)
+
+    def to_dict(self):
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "zeros": self.zeros,
+            "count": self.count,
+            "buckets": {str(key): count for key, count in sorted(self.buckets.items())},
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        sketch = cls(state["relative_accuracy"])
+        sketch.zeros = state["zeros"]
+        sketch.count = state["count"]
+        sketch.buckets = {int(key): count for key, count in state["buckets"].items()}
+        return sketch
+
+
+class ColumnStats:
+    """
+    Count, mean and variance (Welford / Chan et al. for merging batches),
+    min, max, a QuantileSketch and optionally a linear histogram of one column.
+    """
+
+    def __init__(self, histogram_range=None, relative_accuracy=0.01):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.sketch = QuantileSketch(relative_accuracy)
+        self.histogram_range = histogram_range
+        # Bins plus an underflow (first) and an overflow (last) counter.
+        self.histogram = [0] * (histogram_range[2] + 2) if histogram_range else None
+
+    def _combine(self, count, mean, m2):
+        total = self.count + count
+        if total == 0:
+            return
+        delta = mean - self.mean
+        self.m2 += m2 + delta**2 * self.count * count / total
+        self.mean += delta * count / total
+        self.count = total
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return
+        mean = float(values.mean())
+        self._combine(len(values), mean, float(((values - mean)**2).sum()))
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.sketch.update(values)
+        if self.histogram is not None:
+            low, high, bins = self.histogram_range
+            index = np.clip(np.floor((values - low) / (high - low) * bins).astype(np.int64) + 1, 0, bins + 1)
+            index[values == high] = bins  # the last bin includes its upper edge
+            for k, count in enumerate(np.bincount(index, minlength=bins + 2).tolist()):
+                self.histogram[k] += count
+
+    def merge(self, other):
+        self._combine(other.count, other.mean, other.m2)
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.sketch.merge(other.sketch)
+        if self.histogram is not None and other.histogram is not None:
+            if self.histogram_range != other.histogram_range:
+                raise ValueError("Cannot merge histograms with different ranges")
+            self.histogram = [a + b for a, b in zip(self.histogram, other.histogram)]
+
+    def to_dict(self):
+        summary = {
+            "count": self.count,
+            "mean": self.mean if self.count else None,
+            "std": math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else None,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+            "quantiles": {f"p{round(q * 100):02d}": self.sketch.quantile(q) for q in QUANTILES},
+            # State for merging.
+            "m2": self.m2,
+            "sketch": self.sketch.to_dict(),
+        }
+        if self.histogram is not None:
+            summary["histogram"] = {"range": list(self.histogram_range), "counts": self.histogram}
+        return summary
+
+    @classmethod
+    def from_dict(cls, state):
+        histogram = state.get("histogram")
+        stats = cls(tuple(histogram["range"]) if histogram else None, state["sketch"]["relative_accuracy"])
+        stats.count = state["count"]
+        stats.mean = state["mean"] or 0.0
+        stats.m2 = state["m2"]
+        stats.min = state["min"] if state["min"] is not None else math.inf
+        stats.max = state["max"] if state["max"] is not None else -math.inf
+        stats.sketch = QuantileSketch.from_dict(state["sketch"])
+        if histogram:
+            stats.histogram = list(histogram["counts"])
+        return stats
+
+
+def error_reason(error):
+    """
+    Error class of a result: the message up to its first colon ("Download
+    failed", "Skipped", ...), so per-file details don't split the counts.
+    """
+    return error.split(":", 1)[0].strip()[:100]
+
+
+# AlphaFold proteome names, as in the proteome archives: UniProt proteome ID,
+# NCBI taxonomy ID and organism mnemonic, e.g. UP000005640_9606_HUMAN_v4.tar.
+PROTEOME_NAME = re.compile(r"UP\d{9}_\d+(?:_[A-Z0-9]+)?")
+UNKNOWN_GROUP = "unknown"
+
+
+def uniprot_accession(file):
+    """
+    UniProt accession of an AlphaFold file, e.g. "G4MV54" for AF-G4MV54-F1-model_v4.cif.
+    """
+    name = accession(file)
+    if name.startswith("AF-"):
+        name = name[len("AF-"):]
+    return name.partition("-F")[0]
+
+
+def read_organisms(path):
+    """
+    Organism of every UniProt accession, from a CSV (or, for .tsv files,
+    tab-separated) table with an accession column ("accession" or "Entry", as in
+    UniProt downloads) and an "organism" column, e.g. a UniProt export of the
+    fields accession,organism_name.
+
+    Returns:
+        dict: UniProt accession -> organism.
+    """
+    with open(path, 'r', newline='') as f:
+        reader = csv.DictReader(f, delimiter="\t" if path.endswith(".tsv") else ",")
+        columns = {name.lower(): name for name in reader.fieldnames or ()}
+        accession_column = columns.get("accession") or columns.get("entry")
+        organism_column = columns.get("organism")
+        if accession_column is None or organism_column is None:
+            raise ValueError(f"{path}: expected an accession (or Entry) and an organism column")
+        return {
+            uniprot_accession(row[accession_column]): row[organism_column].strip()
+            for row in reader if row[accession_column] and row[organism_column]
+        }
+
+
+def result_group(file, organisms=None):
+    """
+    Group of a result: its organism from `organisms` (see read_organisms), else
+    the AlphaFold proteome named in its path (e.g. the proteome archive it was
+    read from, "UP000005640_9606_HUMAN"), else UNKNOWN_GROUP.
+    """
+    file = file.strip()
+    if organisms:
+        organism = organisms.get(uniprot_accession(file))
+        if organism is not None:
+            return organism
+    proteomes = PROTEOME_NAME.findall(file)
+    return proteomes[-1] if proteomes else UNKNOWN_GROUP
+
+
+class ResultStats:
+    """
+    Mergeable running statistics of results: counts, errors by reason, and
+    ColumnStats of every numeric result column, overall and per organism (see
+    result_group).
+
+    Parameters:
+        by_group (bool): Also keep statistics per organism.
+        relative_accuracy (float): Accuracy of the quantile sketches.
+        organisms (dict): UniProt accession -> organism, see read_organisms.
+    """
+
+    def __init__(self, by_group=True, relative_accuracy=0.01, organisms=None):
+        self.by_group = by_group
+        self.relative_accuracy = relative_accuracy
+        self.organisms = organisms
+        self.count = 0
+        self.errors = {}
+        self.columns = {}
+        self.groups = {}
+
+    def _column(self, name):
+        if name not in self.columns:
+            histogram_range = next(
+                (value for prefix, value in HISTOGRAM_RANGES.items() if name.startswith(prefix)), None
+            )
+            self.columns[name] = ColumnStats(histogram_range, self.relative_accuracy)
+        return self.columns[name]
+
+    def update(self, results):
+        """
+        Add result dicts (or a results DataFrame's records) to the statistics.
+        """
+        results = list(results)
+        if not results:
+            return
+        self.count += len(results)
+        for result in results:
+            if result.get("error"):
+                reason = error_reason(result["error"])
+                self.errors[reason] = self.errors.get(reason, 0) + 1
+
+        names = [name for name in results[0] if name not in ("file", "error", "trace")]
+        for name in names:
+            values = [result.get(name) for result in results]
+            values = [value for value in values if isinstance(value, (int, float)) and not isinstance(value, bool)]
+            if values:
+                self._column(name).update(values)
+
+        if self.by_group:
+            grouped = {}
+            for result in results:
+                grouped.setdefault(result_group(result["file"], self.organisms), []).append(result)
+            for group, group_results in grouped.items():
+                if group not in self.groups:
+                    self.groups[group] = ResultStats(by_group=False, relative_accuracy=self.relative_accuracy)
+                self.groups[group].update(group_results)
+
+    def merge(self, other):
+        self.count += other.count
+        for reason, count in other.errors.items():
+            self.errors[reason] = self.errors.get(reason, 0) + count
+        for name, column in other.columns.items():
+            if name in self.columns:
+                self.columns[name].merge(column)
+            else:
+                # A copy, so updating the merged statistics leaves `other` unchanged.
+                self.columns[name] = copy.deepcopy(column)
+        for group, stats in other.groups.items():
+            if group in self.groups:
+                self.groups[group].merge(stats)
+            else:
+                self.groups[group] = copy.deepcopy(stats)
+        return self
+
+    def to_dict(self):
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "count": self.count,
+            "errors": dict(sorted(self.errors.items())),
+            "columns": {name: column.to_dict() for name, column in self.columns.items()},
+            "groups": {group: stats.to_dict() for group, stats in sorted(self.groups.items())},
+        }
+
+    @classmethod
+    def from_dict(cls, state, by_group=True, organisms=None):
+        stats = cls(by_group, state["relative_accuracy"], organisms)
+        stats.count = state["count"]
+        stats.errors = dict(state["errors"])
+        stats.columns = {name: ColumnStats.from_dict(column) for name, column in state["columns"].items()}
+        stats.groups = {group: cls.from_dict(group_state, by_group=False)
+                        for group, group_state in state["groups"].items()}
+        return stats
+
+    def write(self, path):
+        """
+        Save a snapshot; written to a temporary file first, so a killed job
+        leaves the previous snapshot intact.
+        """
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=1)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, organisms=None):
+        """
+        Snapshot from `path`, or empty statistics if there is none yet (so resumed runs keep counting).
+        """
+        if not os.path.exists(path):
+            return cls(organisms=organisms)
+        with open(path, 'r') as f:
+            return cls.from_dict(json.load(f), organisms=organisms)
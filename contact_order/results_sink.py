@@ -0,0 +1,117 @@
+import os
+import time
+from pathlib import Path
+import pandas as pd
+from result_cache import accession
+
+FORMATS = ("csv", "parquet")
+
+
+class CsvSink:
+    """
+    Appends checkpoint DataFrames to a CSV file, writing the header only when
+    the file is new (so resumed runs keep appending).
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, df):
+        if df.empty:
+            return
+        df.to_csv(self.path, mode='a', index=False, header=not os.path.exists(self.path))
+
+    def close(self):
+        pass
+
+
+class ParquetSink:
+    """
+    Writes every checkpoint as one Parquet file (a single row group) inside the
+    directory `path`; pd.read_parquet(path) loads all of them as one table.
+
+    Each file is written under a temporary name and renamed when complete, so
+    a killed job never leaves a truncated file behind.
+
+    Result tables are stored compactly: the "file" column is replaced by
+    dictionary-encoded "accession" and "source" (directory or bucket prefix)
+    columns, "error" is dictionary-encoded, and metric columns are typed
+    nullable floats/integers.
+    """
+
+    def __init__(self, path):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("ParquetSink requires pyarrow: pip install pyarrow") from None
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        # Unique per run, so resumed runs add files instead of overwriting them.
+        self.prefix = f"part-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        self.num_parts = 0
+
+    def _prepare(self, df):
+        df = df.copy()
+        if "file" in df.columns:
+            files = df.pop("file").astype(str).str.strip()
+            df.insert(0, "accession", files.map(accession))
+            df.insert(1, "source", files.str.rpartition("/")[0])
+        for column in df.columns:
+            if column.startswith("num_contacts"):
+                df[column] = df[column].astype("Int64")
+            elif column.startswith(("contact_order", "relative_co", "absolute_co")):
+                df[column] = df[column].astype("float64")
+
+        table = self._pa.Table.from_pandas(df, preserve_index=False)
+        for column in ("accession", "source", "error"):
+            if column in table.column_names:
+                index = table.column_names.index(column)
+                encoded = table[column].cast(self._pa.string()).dictionary_encode()
+                table = table.set_column(index, self._pa.field(column, encoded.type), encoded)
+        return table
+
+    def write(self, df):
+        if df.empty:
+            return
+        table = self._prepare(df)
+        final_path = self.path / f"{self.prefix}-{self.num_parts:05d}.parquet"
+        # Dot-prefixed names are skipped by pd.read_parquet on the directory.
+        tmp_path = self.path / f".{final_path.name}.tmp"
+
+        self._pq.write_table(table, tmp_path)
+        os.replace(tmp_path, final_path)
+        self.num_parts += 1
+
+    def close(self):
+        pass
+
+
+def make_sink(path, results_format="csv"):
+    """
+    Create a results sink with a write(df)/close() interface.
+
+    Parameters:
+        path (str): CSV file, or directory of Parquet files.
+        results_format (str): "csv" or "parquet".
+
+    Returns:
+        CsvSink | ParquetSink
+    """
+    if results_format == "csv":
+        return CsvSink(path)
+    if results_format == "parquet":
+        return ParquetSink(path)
+    raise ValueError(f"Unknown results format: {results_format}")
+
+
+def read_results(path):
+    """
+    Load results written by either sink into one DataFrame.
+    """
+    if os.path.isdir(path) or str(path).endswith(".parquet"):
+        return pd.read_parquet(path)
+    return pd.read_csv(path)
@@ -0,0 +1,168 @@
+import heapq
+from cif_sources import CIF_SUFFIXES, is_shard, list_inputs
+
+
+def input_sizes(cif_directory=None, manifest_file=None):
+    """
+    The inputs of a local run and their sizes in bytes, the cost estimate of
+    each work item. With a manifest (see read_manifest) its paths and sizes are
+    used and no file is touched; otherwise the directory is listed once, with
+    the sizes read in the same pass (see cif_sources.list_inputs).
+
+    Returns:
+        tuple: (cif_files, shards, sizes): lists of paths and a dict path -> size.
+            Inputs without a size in the manifest are left out of `sizes`.
+    """
+    if manifest_file is None:
+        return list_inputs(cif_directory, with_sizes=True)
+    paths, sizes = read_manifest(manifest_file)
+    cif_files = [path for path in paths if path.endswith(CIF_SUFFIXES)]
+    shards = [path for path in paths if is_shard(path)]
+    return cif_files, shards, sizes
+
+
+def read_manifest(manifest_file):
+    """
+    Read a manifest of URLs (or paths), one per line. Lines may also carry the object size,
+    as in the output of `gsutil ls -l` ("<size>  <date>  <url>") or as
+    "<url or path> <size>"; lines without a URL (such as the TOTAL line) are skipped.
+
+    Returns:
+        tuple: (urls, sizes), the list of URLs in manifest order and a dict
+            URL -> size for the lines that have one.
+    """
+    urls = []
+    sizes = {}
+    with open(manifest_file, 'r') as f:
+        for line in f:
+            tokens = line.split()
+            local = len(tokens) == 1 or (len(tokens) == 2 and tokens[1].isdigit())
+            url = next((token for token in tokens if "://" in token), tokens[0] if local else None)
+            if url is None:
+                continue
+            urls.append(url)
+            size = next((token for token in tokens if token.isdigit()), None)
+            if size is not None:
+                sizes[url] = int(size)
+    return urls, sizes
+
+
+def longest_first(file_list, sizes):
+    """
+    Order work longest-first (LPT), so the biggest proteins start early and the
+    small ones fill in the gaps at the end instead of being waited on.
+    Files with an unknown size are treated as size 0.
+    """
+    return sorted(file_list, key=lambda file: sizes.get(file, 0), reverse=True)
+
+
+def split_by_weight(file_list, sizes, target):
+    """
+    Cut file_list (in order) into chunks of about `target` bytes each; a chunk
+    always holds at least one file.
+    """
+    chunks = []
+    chunk = []
+    weight = 0
+    for file in file_list:
+        chunk.append(file)
+        weight += sizes.get(file, 0)
+        if weight >= target:
+            chunks.append(chunk)
+            chunk = []
+            weight = 0
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def balance(file_list, sizes, num_bins):
+    """
+    Greedy LPT assignment of files to `num_bins` bins of roughly equal total
+    size (each file goes to the currently lightest bin, largest files first).
+
+    Returns:
+        list: num_bins lists of files.
+    """
+    bins = [[] for _ in range(num_bins)]
+    heap = [(0, i) for i in range(num_bins)]
+    for file in longest_first(file_list, sizes):
+        weight, i = heapq.heappop(heap)
+        bins[i].append(file)
+        heapq.heappush(heap, (weight + sizes.get(file, 0), i))
+    return bins
+
+
+class AdaptiveCheckpoints:
+    """
+    Cuts a file list into checkpoints by bytes instead of by a fixed file count.
+
+    With `target_seconds`, the size of every next checkpoint is adapted to the
+    throughput measured so far, so checkpoints take about that long each.
+    With `target_bytes` (and no target_seconds), every checkpoint holds about
+    that many bytes.
+
+    Files without a known size weigh as much as the average file with one. If
+    no file has a size (e.g. a manifest without sizes), checkpoints are cut by
+    file count instead, `target_files` each until a throughput is known.
+
+    Iterating yields (start_idx, end_idx) slices of file_list; call record()
+    with the checkpoint's duration after processing it.
+    """
+
+    def __init__(self, file_list, sizes, target_seconds=None, target_bytes=256 * 2**20, target_files=1000):
+        self.file_list = file_list
+        self.target_seconds = target_seconds
+        known = [sizes[file] for file in file_list if sizes.get(file)]
+        if known:
+            average = sum(known) / len(known)
+            self.weights = [sizes.get(file) or average for file in file_list]
+            self.target = target_bytes
+        else:
+            self.weights = [1] * len(file_list)
+            self.target = target_files
+        self.weight_done = 0
+        self.seconds_done = 0.0
+        self._last_weight = 0
+
+    def record(self, duration):
+        self.weight_done += self._last_weight
+        self.seconds_done += duration
+
+    def _budget(self):
+        if self.target_seconds is None or self.seconds_done <= 0:
+            return self.target
+        throughput = self.weight_done / self.seconds_done
+        return max(1, throughput * self.target_seconds)
+
+    def __iter__(self):
+        start_idx = 0
+        while start_idx < len(self.file_list):
+            budget = self._budget()
+            end_idx = start_idx
+            weight = 0
+            while end_idx < len(self.file_list) and (end_idx == start_idx or weight < budget):
+                weight += self.weights[end_idx]
+                end_idx += 1
+            self._last_weight = weight
+            yield start_idx, end_idx
+            start_idx = end_idx
+
+
+def straggler_tail(completion_times, end_time, num_workers):
+    """
+    Seconds at the end of a checkpoint during which fewer tasks than workers
+    were left, i.e. some workers sat idle waiting for the last stragglers.
+
+    Parameters:
+        completion_times (list): Completion timestamps of the checkpoint's tasks.
+        end_time (float): End of the checkpoint.
+        num_workers (int): Number of workers.
+
+    Returns:
+        float: Tail duration in seconds (0 if there were fewer tasks than workers).
+    """
+    if len(completion_times) < num_workers:
+        return 0.0
+    # Once the num_workers-th to last task finished, at least one worker had nothing left to do.
+    return end_time - sorted(completion_times)[-num_workers]
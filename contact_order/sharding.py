@@ -0,0 +1,227 @@
+import argparse
+import glob
+import json
+import os
+import shutil
+import tarfile
+import time
+import pandas as pd
+from cif_sources import CIF_SUFFIXES, list_inputs
+from result_cache import accession
+from result_stats import ResultStats, read_organisms
+from results_sink import make_sink, read_results
+from scheduling import balance, read_manifest
+
+# Multi-node runs as a SLURM array job (see process_array.sh): every array task
+# takes a deterministic share of the inputs, runs the usual checkpoint loop on
+# it and writes results, logs, events and result cache into its own directory
+#
+#   <output directory>/shards/shard-<index>-of-<count>/
+#
+# Afterwards `python sharding.py <output directory> ...` merges the shards into
+# <output directory>, drops duplicate results and lists the files that have no
+# result in missing.txt (a manifest for a rerun).
+
+
+def shard_from_env():
+    """
+    Shard index and shard count of this process: the SLURM array task
+    (--array=0-N, contiguous) or (0, 1) outside an array job.
+    """
+    if "SLURM_ARRAY_TASK_ID" not in os.environ:
+        return 0, 1
+    task_id = int(os.environ["SLURM_ARRAY_TASK_ID"])
+    task_min = int(os.getenv("SLURM_ARRAY_TASK_MIN", "0"))
+    return task_id - task_min, int(os.environ["SLURM_ARRAY_TASK_COUNT"])
+
+
+def select_shard(file_list, sizes, shard_index, num_shards):
+    """
+    The files of one shard. Shards are balanced by size (LPT over the sorted
+    file list, so every task computes the same assignment whatever order its
+    listing came in); files of unknown size count as 1 byte.
+
+    Returns:
+        list: The shard's files, in file_list order.
+    """
+    if num_shards == 1:
+        return list(file_list)
+    weights = {file: sizes.get(file) or 1 for file in file_list}
+    selected = set(balance(sorted(set(file_list)), weights, num_shards)[shard_index])
+    return [file for file in file_list if file in selected]
+
+
+def shard_directory(output_directory, shard_index, num_shards):
+    """
+    Output directory of a shard; the output directory itself for unsharded runs.
+    """
+    if num_shards == 1:
+        return output_directory
+    directory = os.path.join(output_directory, "shards", f"shard-{shard_index:04d}-of-{num_shards:04d}")
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def write_shard_marker(directory, shard_index, num_shards, num_files):
+    """
+    Mark a shard as finished; merge_shards reports shards without a marker.
+    """
+    with open(os.path.join(directory, "shard.json"), 'w') as f:
+        json.dump({"shard": shard_index, "num_shards": num_shards, "files": num_files, "finished": time.time()}, f)
+
+
+def expected_inputs(cif_directory=None, manifest_file=None):
+    """
+    Inputs that a complete run has results for: the loose CIF files and tar
+    shard members of `cif_directory` (members are listed, not extracted), or the
+    URLs of `manifest_file`.
+
+    Returns:
+        dict: Accession -> file, shard member or URL.
+    """
+    if manifest_file is not None:
+        urls, _ = read_manifest(manifest_file)
+        return {accession(url): url for url in urls}
+
+    cif_files, shards = list_inputs(cif_directory)
+    expected = {accession(file): file for file in cif_files}
+    for shard in shards:
+        with tarfile.open(shard, "r|*") as tar:
+            for member in tar:
+                if member.isfile() and member.name.endswith(CIF_SUFFIXES):
+                    expected[accession(member.name)] = f"{shard}/{member.name}"
+    return expected
+
+
+def _key(df):
+    # CSV results have the "file" column, Parquet results its accession (see ParquetSink).
+    if "file" in df.columns:
+        return df["file"].astype(str).map(accession)
+    return df["accession"].astype(str)
+
+
+def _result_records(df, chunk_size=100_000):
+    """
+    Result dicts of a results table, chunk by chunk, as ResultStats.update takes
+    them: missing values as None, and the "file" of Parquet results (see
+    ParquetSink) put back together from their source and accession.
+    """
+    for start in range(0, len(df), chunk_size):
+        chunk = df.iloc[start:start + chunk_size]
+        records = chunk.astype(object).where(chunk.notna(), None).to_dict("records")
+        if "file" not in chunk.columns and "accession" in chunk.columns:
+            for record in records:
+                source, name = record.pop("source", None), record.pop("accession")
+                record["file"] = f"{source}/{name}" if source else name
+        yield records
+
+
+def merge_shards(output_directory, results_format="parquet", expected=None, organisms=None):
+    """
+    Merge the shard outputs under <output_directory>/shards into <output_directory>:
+    results (deduplicated by accession, a result without error winning over a
+    failed one), logs.csv and events.jsonl (with a "shard" column), stats.json
+    (running statistics of the merged results, see result_stats.py), and
+    missing.txt with the expected inputs that have no result.
+
+    Parameters:
+        output_directory (str): Output directory of the sharded run.
+        results_format (str): "csv" or "parquet", as the shards were written.
+        expected (dict): All inputs by accession, see expected_inputs.
+        organisms (dict): UniProt accession -> organism for the per-organism
+            statistics, see result_stats.read_organisms.
+
+    Returns:
+        dict: Verification report (shards, unfinished shards, rows, duplicates, errors, missing).
+    """
+    results_name = f"contact_order_results.{results_format}"
+    shard_directories = sorted(glob.glob(os.path.join(output_directory, "shards", "shard-*")))
+    if not shard_directories:
+        raise FileNotFoundError(f"No shard directories in {output_directory}/shards")
+
+    results = []
+    logs = []
+    unfinished = []
+    for directory in shard_directories:
+        shard = os.path.basename(directory)
+        if not os.path.exists(os.path.join(directory, "shard.json")):
+            unfinished.append(shard)
+        if os.path.exists(os.path.join(directory, results_name)):
+            results.append(read_results(os.path.join(directory, results_name)))
+        if os.path.exists(os.path.join(directory, "logs.csv")):
+            logs.append(pd.read_csv(os.path.join(directory, "logs.csv")).assign(shard=shard))
+
+    df = pd.concat(results, ignore_index=True) if results else pd.DataFrame(columns=["file", "error"])
+    num_rows = len(df)
+    key = _key(df)
+    failed = df["error"].notna() if "error" in df.columns else pd.Series(False, index=df.index)
+    order = failed.sort_values(kind="stable").index
+    ordered = df.loc[order]
+    df = ordered[~key.loc[order].duplicated()].sort_index()
+    present = set(_key(df))
+    num_errors = int(df["error"].notna().sum()) if "error" in df.columns else 0
+
+    merged_results = os.path.join(output_directory, results_name)
+    if os.path.isdir(merged_results):
+        shutil.rmtree(merged_results)
+    elif os.path.exists(merged_results):
+        os.remove(merged_results)
+    sink = make_sink(merged_results, results_format)
+    sink.write(df)
+    sink.close()
+
+    if logs:
+        pd.concat(logs, ignore_index=True).to_csv(os.path.join(output_directory, "logs.csv"), index=False)
+    # Rebuilt from the merged results: the shards' snapshots also count results
+    # that were computed twice (e.g. by a rerun) or failed before they succeeded.
+    stats = ResultStats(organisms=organisms)
+    for records in _result_records(df):
+        stats.update(records)
+    stats.write(os.path.join(output_directory, "stats.json"))
+    with open(os.path.join(output_directory, "events.jsonl"), 'w') as out:
+        for directory in shard_directories:
+            events_file = os.path.join(directory, "events.jsonl")
+            if not os.path.exists(events_file):
+                continue
+            shard = os.path.basename(directory)
+            with open(events_file, 'r') as f:
+                for line in f:
+                    out.write(json.dumps({**json.loads(line), "shard": shard}) + "\n")
+
+    missing = [expected[name] for name in sorted(expected.keys() - present)] if expected is not None else []
+    with open(os.path.join(output_directory, "missing.txt"), 'w') as f:
+        f.writelines(f"{file}\n" for file in missing)
+
+    return {
+        "shards": len(shard_directories),
+        "unfinished_shards": unfinished,
+        "rows": num_rows,
+        "duplicates": num_rows - len(df),
+        "results": len(df),
+        "errors": num_errors,
+        "missing": len(missing) if expected is not None else None,
+    }
+
+
+if __name__ == "__main__":
+    argument_parser = argparse.ArgumentParser(description="Merge and verify the shard outputs of a SLURM array run.")
+    argument_parser.add_argument("output_directory", help="Output directory of the run (holding shards/)")
+    argument_parser.add_argument("--format", default="parquet", choices=("csv", "parquet"))
+    inputs = argument_parser.add_mutually_exclusive_group()
+    inputs.add_argument("--cif-directory", help="Input directory, to report files without a result")
+    inputs.add_argument("--manifest", help="Input manifest, to report files without a result")
+    argument_parser.add_argument("--organisms", help="Organism of every accession, as organisms_file of the run")
+    args = argument_parser.parse_args()
+
+    expected = None
+    if args.cif_directory or args.manifest:
+        expected = expected_inputs(args.cif_directory, args.manifest)
+
+    organisms = read_organisms(args.organisms) if args.organisms else None
+    report = merge_shards(args.output_directory, args.format, expected, organisms)
+    print(f"Merged {report['shards']} shards: {report['results']} results "
+          f"({report['duplicates']} duplicates dropped, {report['errors']} with errors)")
+    if report["unfinished_shards"]:
+        print(f"Unfinished shards: {', '.join(report['unfinished_shards'])}")
+    if report["missing"] is not None:
+        print(f"{report['missing']} files without a result, listed in {args.output_directory}/missing.txt")
@@ -0,0 +1,115 @@
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+# Per-file stage timings. When tracing is on, every result dict carries a
+# "trace" dict that is filled in along the way (by the download side, then by
+# calculate_contact_order on the worker). The main loop pops the traces off the
+# results before they are written and appends them to an EventLog as JSON lines.
+#
+# Fields (seconds unless noted):
+#   checkpoint   checkpoint index
+#   file         input file / URL
+#   worker       "<host>:<pid>:<thread>" or the Dask worker address
+#   queue_wait   submission -> start of the file's task on its worker
+#   task_wait    start of the task -> start of the file, i.e. the time spent on
+#                the earlier files of the same task (0 for single-file tasks)
+#   download     fetching the bytes (bucket download, or reading the member out of a tar shard)
+#   attempts     download attempts, see download_retry.py
+#   parse        reading CA coordinates (parser or coordinate store)
+#   compute      contact search and metrics; for files whose contacts were computed
+#                together in padded blocks, the time of the whole batch
+#   compute_batch  number of files that compute time is shared by (1 if measured per file)
+#   write        the checkpoint's sink write time, split evenly over its files
+#   bytes        input size in bytes
+#   residues     number of residues
+#   error        error message of the result, if any
+EVENT_FIELDS = (
+    "checkpoint", "file", "worker", "queue_wait", "task_wait", "download", "attempts", "parse", "compute",
+    "compute_batch", "write", "bytes", "residues", "error",
+)
+
+
+def worker_id():
+    # Only a process that already runs Dask can be a Dask worker; don't import it otherwise.
+    if "distributed" in sys.modules:
+        try:
+            return sys.modules["distributed"].get_worker().address
+        except ValueError:
+            pass
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}"
+
+
+def new_trace(**fields):
+    """
+    Trace for a file about to be submitted; the submission time is used for queue_wait.
+    """
+    return {"submitted": time.time(), **fields}
+
+
+def start_task(trace):
+    """
+    Called on the worker when it starts on a task of several files: the queue
+    wait of all of them ends here, see start_trace. A trace whose task has
+    already started is returned unchanged.
+    """
+    if "task_started" in trace:
+        return trace
+    return {**trace, "task_started": time.time()}
+
+
+def start_trace(trace):
+    """
+    Called on the worker when it starts on a file: records the worker, the queue
+    wait and, within a task (see start_task), the wait for its earlier files.
+    """
+    trace = dict(trace)
+    now = time.time()
+    submitted = trace.pop("submitted", None)
+    task_started = trace.pop("task_started", now)
+    trace["queue_wait"] = task_started - submitted if submitted is not None else None
+    trace["task_wait"] = now - task_started
+    trace["worker"] = worker_id()
+    return trace
+
+
+def pop_traces(results):
+    """
+    Remove the "trace" dicts from results (so they are not written with the
+    results) and return them as events.
+    """
+    events = []
+    for result in results:
+        trace = result.pop("trace", None)
+        if trace is not None:
+            events.append({**trace, "file": result["file"], "error": result.get("error")})
+    return events
+
+
+class EventLog:
+    """
+    Appends trace events to a JSON lines file; load it with
+    pd.read_json(path, lines=True).
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, events, checkpoint=None, write_duration=None):
+        if not events:
+            return
+        write_share = write_duration / len(events) if write_duration is not None else None
+        with open(self.path, 'a') as f:
+            for event in events:
+                event = {**event, "checkpoint": checkpoint, "write": write_share}
+                record = {}
+                for field in EVENT_FIELDS:
+                    value = event.get(field)
+                    record[field] = round(value, 6) if isinstance(value, float) else value
+                f.write(json.dumps(record) + "\n")
+
+    def close(self):
+        pass
@@ -0,0 +1,373 @@
+import argparse
+import csv
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+
+# Benchmark harness for download backends: downloads the first files of a
+# manifest with every backend and worker count, and writes the throughput,
+# speedup, efficiency and Karp-Flatt serial fraction of every run as CSV and
+# JSON (the same quantities analyze_results.ipynb plots for the old sweeps).
+#
+# With --fake-gcs-root the runs go to a local fake_gcs_server.py instead of
+# GCS, optionally with latency, bandwidth limit and failure injection:
+#
+#   python download_benchmark.py test_manifest.txt --fake-gcs-root ./bucket \
+#       --backends storage_client http --workers 1 2 4 8 --latency 0.05
+#
+# A backend is any class with the DownloadBackend interface registered in BACKENDS.
+
+# The download engines of the pipeline live with its code.
+sys.path.append(str(Path(__file__).resolve().parent.parent / "contact_order"))
+
+
+def split_gs_url(gs_url):
+    bucket_name, blob_name = gs_url.strip().replace('gs://', '').split('/', 1)
+    return bucket_name, blob_name
+
+
+class DownloadBackend:
+    """
+    Interface of a download backend. By default download_many() calls download()
+    from `num_workers` threads at once; per-thread state (clients, sessions)
+    belongs in threading.local(). Backends that are not thread-based override
+    download_many() instead.
+    """
+
+    name = None
+
+    def download(self, gs_url, local_path):
+        raise NotImplementedError
+
+    def download_many(self, urls, download_folder, num_workers):
+        """
+        Returns:
+            list: Local path of every downloaded file, None for failed ones.
+        """
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            futures = {}
+            for url in urls:
+                local_path = os.path.join(download_folder, split_gs_url(url)[1].split('/')[-1])
+                futures[executor.submit(self.download, url, local_path)] = local_path
+            local_paths = []
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    local_paths.append(futures[future])
+                except Exception:
+                    local_paths.append(None)
+        return local_paths
+
+    def close(self):
+        pass
+
+
+class StorageClientBackend(DownloadBackend):
+    """
+    google-cloud-storage with one client per worker thread (reused connections),
+    from the pipeline's gcs_client.get_storage_client.
+    """
+
+    name = "storage_client"
+
+    def __init__(self):
+        self._clients = set()
+
+    def download(self, gs_url, local_path):
+        from gcs_client import get_storage_client
+        bucket_name, blob_name = split_gs_url(gs_url)
+        client = get_storage_client()
+        self._clients.add(client)
+        # No library retries, as in the pipeline (see gcs_client.get_storage_client).
+        client.bucket(bucket_name).blob(blob_name).download_to_filename(local_path, retry=None)
+
+    def close(self):
+        # The worker threads of every run are gone by now; close their sessions.
+        for client in self._clients:
+            client.close()
+
+
+class StorageClientPerCallBackend(DownloadBackend):
+    """
+    google-cloud-storage with a new client for every file (the baseline).
+    """
+
+    name = "storage_client_per_call"
+
+    def download(self, gs_url, local_path):
+        from download_parallel_tests import download_with_storage_client_per_call
+        bucket_name, blob_name = split_gs_url(gs_url)
+        download_with_storage_client_per_call(bucket_name, blob_name, local_path)
+
+
+class HttpBackend(DownloadBackend):
+    """
+    Plain HTTP GET on the XML API (public objects only), one requests.Session
+    per worker thread. Uses STORAGE_EMULATOR_HOST if set.
+    """
+
+    name = "http"
+
+    def __init__(self):
+        import requests
+        self._requests = requests
+        self._local = threading.local()
+        self.endpoint = os.getenv("STORAGE_EMULATOR_HOST", "https://storage.googleapis.com")
+
+    def download(self, gs_url, local_path):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = self._requests.Session()
+        bucket_name, blob_name = split_gs_url(gs_url)
+        response = session.get(f"{self.endpoint}/{bucket_name}/{blob_name}")
+        response.raise_for_status()
+        with open(local_path, 'wb') as f:
+            f.write(response.content)
+
+
+class AsyncioBackend(DownloadBackend):
+    """
+    contact_order/async_download.py: one event loop with `num_workers` requests
+    in flight over a small keep-alive connection pool.
+    """
+
+    name = "asyncio"
+
+    def download(self, gs_url, local_path):
+        if self.download_many([gs_url], os.path.dirname(local_path), 1) == [None]:
+            raise RuntimeError(f"Download of {gs_url} failed")
+
+    def download_many(self, urls, download_folder, num_workers):
+        from async_download import download_all
+        results = download_all(urls, download_folder, max_in_flight=num_workers, max_connections=min(num_workers, 64))
+        return [local_path for _, local_path, _ in results]
+
+
+class AtomSiteRangeBackend(DownloadBackend):
+    """
+    contact_order/range_fetch.py: only the _atom_site loop of every file, with
+    ranged GETs (public objects only). Uses STORAGE_EMULATOR_HOST if set.
+    """
+
+    name = "atom_site_range"
+
+    def __init__(self):
+        from range_fetch import fetch_atom_site
+        self._fetch_atom_site = fetch_atom_site
+
+    def download(self, gs_url, local_path):
+        data = self._fetch_atom_site(gs_url)
+        with open(local_path, 'wb') as f:
+            f.write(data)
+
+
+class CommandBackend(DownloadBackend):
+    """
+    One CLI process per file. These only talk to the real GCS.
+    """
+
+    command = None
+
+    def download(self, gs_url, local_path):
+        subprocess.run(self.command + [gs_url.strip(), local_path], check=True, capture_output=True)
+
+
+class GsutilBackend(CommandBackend):
+    name = "gsutil"
+    command = ["gsutil", "cp"]
+
+
+class GcloudStorageBackend(CommandBackend):
+    name = "gcloud_storage"
+    command = ["gcloud", "storage", "cp"]
+
+
+class BatchCommandBackend(DownloadBackend):
+    """
+    One `cp -I` CLI process for the whole URL list, see
+    download_parallel_tests.download_batch_with_cli. $GCS_CLI_STUB (e.g.
+    "python stub_gcs_cli.py") replaces the CLI executable.
+    """
+
+    tool = None
+
+    def download(self, gs_url, local_path):
+        if self.download_many([gs_url], os.path.dirname(local_path), 1) == [None]:
+            raise RuntimeError(f"Download of {gs_url} failed")
+
+    def download_many(self, urls, download_folder, num_workers):
+        from download_parallel_tests import download_batch_with_cli
+        stub = os.getenv("GCS_CLI_STUB")
+        executable = stub.split() + [self.tool.split("_")[0]] if stub else None
+        errors = download_batch_with_cli(urls, download_folder, self.tool, num_workers, executable=executable)
+        return [
+            None if errors[url.strip()] is not None else os.path.join(download_folder, url.strip().split('/')[-1])
+            for url in urls
+        ]
+
+
+class GsutilBatchBackend(BatchCommandBackend):
+    name = "gsutil_batch"
+    tool = "gsutil"
+
+
+class GcloudStorageBatchBackend(BatchCommandBackend):
+    name = "gcloud_storage_batch"
+    tool = "gcloud_storage"
+
+
+BACKENDS = {
+    backend.name: backend
+    for backend in (StorageClientBackend, StorageClientPerCallBackend, HttpBackend, AsyncioBackend, AtomSiteRangeBackend,
+                    GsutilBackend, GcloudStorageBackend, GsutilBatchBackend, GcloudStorageBatchBackend)
+}
+
+
+def run_download(backend, urls, num_workers, server=None):
+    """
+    Download `urls` with `num_workers` workers into a temporary folder.
+
+    Parameters:
+        server (FakeGCSServer): If given, the bytes it sent are reported as
+            transferred_bytes (which includes probes and retries, unlike bytes).
+
+    Returns:
+        dict: Run statistics (files, errors, bytes, elapsed, files_per_second, bytes_per_second).
+    """
+    download_folder = tempfile.mkdtemp()
+    bytes_sent = server.bytes_sent if server is not None else None
+    start_time = time.perf_counter()
+    try:
+        local_paths = backend.download_many(urls, download_folder, num_workers)
+        elapsed = time.perf_counter() - start_time
+        num_errors = local_paths.count(None)
+        num_bytes = sum(os.path.getsize(local_path) for local_path in local_paths if local_path is not None)
+    finally:
+        shutil.rmtree(download_folder)
+
+    run = {
+        "files": len(urls),
+        "errors": num_errors,
+        "bytes": num_bytes,
+        "elapsed": elapsed,
+        "files_per_second": (len(urls) - num_errors) / elapsed if elapsed > 0 else 0.0,
+        "bytes_per_second": num_bytes / elapsed if elapsed > 0 else 0.0,
+    }
+    if server is not None:
+        run["transferred_bytes"] = server.bytes_sent - bytes_sent
+    return run
+
+
+def scaling_metrics(runs):
+    """
+    Add speedup, efficiency and Karp-Flatt serial fraction to the runs of one
+    backend, relative to its run with the fewest workers (1 in a full sweep):
+
+        speedup = T(p0) / T(p) * p0,  efficiency = speedup / p,
+        serial_fraction = (1/speedup - 1/p) / (1 - 1/p)   (undefined for p = 1)
+
+    Parameters:
+        runs (list): Dicts with "workers" and "elapsed", as from run_download.
+
+    Returns:
+        list: The runs sorted by workers, with the metrics added.
+    """
+    runs = sorted(runs, key=lambda run: run["workers"])
+    base = runs[0]
+    for run in runs:
+        p = run["workers"]
+        speedup = base["elapsed"] / run["elapsed"] * base["workers"] if run["elapsed"] > 0 else float("nan")
+        run["speedup"] = speedup
+        run["efficiency"] = speedup / p
+        run["serial_fraction"] = (1 / speedup - 1 / p) / (1 - 1 / p) if p > 1 else float("nan")
+    return runs
+
+
+def run_benchmark(urls, backends, workers_list, repeats=1, server=None):
+    """
+    Sweep backends x worker counts; every configuration is run `repeats` times
+    and the fastest run is kept.
+
+    Returns:
+        list: One result dict per backend and worker count, with scaling metrics.
+    """
+    results = []
+    for name in backends:
+        backend = BACKENDS[name]()
+        runs = []
+        try:
+            for num_workers in workers_list:
+                best = min((run_download(backend, urls, num_workers, server) for _ in range(repeats)),
+                           key=lambda run: run["elapsed"])
+                runs.append({"backend": name, "workers": num_workers, **best})
+                transferred = (f", {best['transferred_bytes'] / 2**20:.1f} MiB transferred"
+                               if "transferred_bytes" in best else "")
+                print(f"{name}, {num_workers} workers: {best['files_per_second']:.1f} files/s, "
+                      f"{best['errors']} errors, {best['elapsed']:.2f} s{transferred}")
+        finally:
+            backend.close()
+        results.extend(scaling_metrics(runs))
+    return results
+
+
+def write_results(results, output, config):
+    """
+    Write results to <output>.csv and <output>.json (the JSON also records the
+    benchmark configuration, for comparing runs later).
+    """
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output.with_suffix(".csv"), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(results[0]))
+        writer.writeheader()
+        writer.writerows(results)
+    with open(output.with_suffix(".json"), 'w') as f:
+        # NaN (serial fraction at 1 worker) is not valid JSON.
+        rows = [{key: (None if value != value else value) for key, value in row.items()} for row in results]
+        json.dump({"config": config, "results": rows}, f, indent=1)
+
+
+if __name__ == "__main__":
+    argument_parser = argparse.ArgumentParser(description="Benchmark download backends over worker counts.")
+    argument_parser.add_argument("manifest", help="File with one gs:// URL per line")
+    argument_parser.add_argument("--backends", nargs="+", default=["storage_client"], choices=sorted(BACKENDS))
+    argument_parser.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4, 8, 16, 32])
+    argument_parser.add_argument("--max-files", type=int, default=1000)
+    argument_parser.add_argument("--repeats", type=int, default=1)
+    argument_parser.add_argument("--output", default=f"download_benchmark_{datetime.now():%Y%m%d-%H%M%S}",
+                                 help="Output path without suffix; .csv and .json are written")
+    argument_parser.add_argument("--fake-gcs-root", help="Serve the files from this directory with fake_gcs_server.py")
+    argument_parser.add_argument("--latency", type=float, default=0.0, help="Fake server latency per request (s)")
+    argument_parser.add_argument("--bandwidth", type=float, help="Fake server bandwidth per connection (bytes/s)")
+    argument_parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of fake server requests failing with 503")
+    argument_parser.add_argument("--seed", type=int, default=0)
+    args = argument_parser.parse_args()
+
+    with open(args.manifest, 'r') as f:
+        urls = [line.strip() for line in f if line.strip()][:args.max_files]
+
+    server = None
+    if args.fake_gcs_root:
+        from fake_gcs_server import start_fake_gcs
+        server = start_fake_gcs(args.fake_gcs_root, latency=args.latency, bandwidth=args.bandwidth,
+                                failure_rate=args.failure_rate, seed=args.seed)
+        os.environ["STORAGE_EMULATOR_HOST"] = server.endpoint
+
+    try:
+        results = run_benchmark(urls, args.backends, args.workers, args.repeats, server)
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    config = {key: value for key, value in vars(args).items() if key != "output"}
+    config["files"] = len(urls)
+    write_results(results, args.output, config)
+    print(f"Results saved to {args.output}.csv and {args.output}.json")
@@ -1,24 +1,147 @@
+import collections
+import csv
+import os
+import sys
 import time
-from google.cloud import storage
+import tempfile
+import threading
 from datetime import datetime
 import shutil
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import subprocess
 
-TOKEN_PATH = "..."
-client = storage.Client.from_service_account_json(TOKEN_PATH)
+# The asyncio engine and the retry queue live with the pipeline code.
+sys.path.append(str(Path(__file__).resolve().parent.parent / "contact_order"))
+from async_download import download_all
+from download_retry import fetch_with_retries
+from gcs_client import TOKEN_PATH, create_storage_client, get_storage_client
 
 def download_with_gcloud_storage(gs_url, local_path):
-    subprocess.run(["gcloud", "storage", "cp", gs_url, local_path])
+    subprocess.run(["gcloud", "storage", "cp", gs_url, local_path], check=True)
 
 def download_with_gsutil(gs_url, local_path):
-    subprocess.run(["gsutil", "cp", gs_url, local_path])
+    subprocess.run(["gsutil", "cp", gs_url, local_path], check=True)
+
+def download_batch_with_cli(urls, download_folder, tool="gsutil", max_workers=8, on_done=None, executable=None,
+                            poll_interval=0.5):
+    """
+    Download a whole URL list with a single `cp -I` invocation (URLs on stdin)
+    instead of one CLI process per file.
+
+    Per-file completion is read from the copy manifest the CLI writes as it goes
+    (gsutil -L, gcloud storage --manifest-path; one CSV row per file with its
+    Result), which is polled while the transfer runs. URLs missing from the
+    manifest when the CLI exits are failures.
+
+    Parameters:
+        urls (list): gs:// URLs.
+        download_folder (str): Destination folder.
+        tool (str): "gsutil" (run as `gsutil -m`) or "gcloud_storage".
+        max_workers (int): Parallel threads of the CLI.
+        on_done (callable): Called as on_done(url, error) per file, error being None on success.
+        executable (list): Command replacing "gsutil"/"gcloud", e.g. a stub CLI in tests.
+        poll_interval (float): Seconds between manifest reads.
+
+    Returns:
+        dict: URL -> error message, None for downloaded files.
+    """
+    urls = [url.strip() for url in urls]
+    manifest_folder = tempfile.mkdtemp()
+    manifest_path = os.path.join(manifest_folder, "cp_manifest.csv")
+
+    env = dict(os.environ)
+    if tool == "gsutil":
+        command = (executable or ["gsutil"]) + [
+            "-m", "-o", f"GSUtil:parallel_thread_count={max_workers}", "-o", "GSUtil:parallel_process_count=1",
+            "cp", "-I", "-L", manifest_path, download_folder,
+        ]
+    elif tool == "gcloud_storage":
+        command = (executable or ["gcloud"]) + ["storage", "cp", "-I", f"--manifest-path={manifest_path}", download_folder]
+        env["CLOUDSDK_STORAGE_THREAD_COUNT"] = str(max_workers)
+        env["CLOUDSDK_STORAGE_PROCESS_COUNT"] = "1"
+    else:
+        raise ValueError(f"Unknown tool: {tool}")
+
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                               text=True, env=env)
+    # stdin is fed and stderr drained in threads, so neither pipe can fill up and block the CLI.
+    stderr_tail = collections.deque(maxlen=20)
+
+    def feed():
+        try:
+            process.stdin.write("".join(f"{url}\n" for url in urls))
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+
+    def drain():
+        for line in process.stderr:
+            stderr_tail.append(line.rstrip())
+
+    threads = [threading.Thread(target=feed, daemon=True), threading.Thread(target=drain, daemon=True)]
+    for thread in threads:
+        thread.start()
+
+    results = {}
+    manifest_offset = 0
+
+    def read_manifest():
+        nonlocal manifest_offset
+        if not os.path.exists(manifest_path):
+            return
+        with open(manifest_path, 'r', newline='') as f:
+            f.seek(manifest_offset)
+            chunk = f.read()
+        # Only complete lines; a row being written is picked up by the next read.
+        complete = chunk[:chunk.rfind("\n") + 1]
+        manifest_offset += len(complete.encode())
+        for row in csv.reader(complete.splitlines()):
+            if not row or row[0] == "Source":
+                continue
+            url, result, description = row[0], row[8], row[9]
+            if url in results:
+                continue
+            results[url] = None if result == "OK" else f"{tool}: {description or result}"
+            if on_done is not None:
+                on_done(url, results[url])
+
+    while True:
+        try:
+            process.wait(timeout=poll_interval)
+            break
+        except subprocess.TimeoutExpired:
+            read_manifest()
+    for thread in threads:
+        thread.join()
+    read_manifest()
+    shutil.rmtree(manifest_folder)
+
+    reason = stderr_tail[-1] if stderr_tail else "no output"
+    for url in urls:
+        if url not in results:
+            results[url] = f"{tool} exited with {process.returncode} without copying the file: {reason}"
+            if on_done is not None:
+                on_done(url, results[url])
+    return results
+
+# Failures are retried by the RetryQueue (see download_files_from_manifest), not
+# by the library's retry=DEFAULT_RETRY, which would sleep in the download thread.
 
 def download_with_storage_client(bucket_name, blob_name, local_path):
+    client = get_storage_client()
     bucket = client.bucket(bucket_name)
     blob = bucket.blob(blob_name)
-    blob.download_to_filename(local_path)
+    blob.download_to_filename(local_path, retry=None)
+
+def download_with_storage_client_per_call(bucket_name, blob_name, local_path):
+    # Baseline: a new client (credentials, auth, HTTP session) for every file.
+    client = create_storage_client()
+    bucket = client.bucket(bucket_name)
+    blob = bucket.blob(blob_name)
+    try:
+        blob.download_to_filename(local_path, retry=None)
+    finally:
+        client.close()
 
 def process_file(gs_url, download_folder, download_type):
     gs_url = gs_url.strip()
@@ -28,6 +151,8 @@ def process_file(gs_url, download_folder, download_type):
 
         if download_type == "storage_client":
             download_with_storage_client(bucket_name, blob_name, local_path)
+        elif download_type == "storage_client_per_call":
+            download_with_storage_client_per_call(bucket_name, blob_name, local_path)
         elif download_type == "gsutil":
             download_with_gsutil(gs_url, local_path)
         elif download_type == "gcloud_storage":
@@ -36,11 +161,13 @@ def process_file(gs_url, download_folder, download_type):
         return local_path
     return None
 
-def download_files_from_manifest(manifest_file, download_folder, log_folder, interval_log=10, interval_print=10, max_workers=10, download_type="storage_client"):
+BATCH_DOWNLOAD_TYPES = {"gsutil_batch": "gsutil", "gcloud_storage_batch": "gcloud_storage"}
+
+def download_files_from_manifest(manifest_file, download_folder, log_folder, interval_log=10, interval_print=10, max_workers=10, download_type="storage_client", max_files=1000, batch_size=None, cli_executable=None, max_attempts=5):
     with open(manifest_file, 'r') as f:
         lines = f.readlines()
 
-    lines = lines[:1000]
+    lines = lines[:max_files]
     
     total_files = len(lines)
     start_time = time.time()
@@ -51,81 +178,179 @@ def download_files_from_manifest(manifest_file, download_folder, log_folder, int
         log.write(f"time,num_file,rel_time\n")
     
     with open(error_log_file, 'w+') as log:
-        log.write(f"file")
+        log.write(f"file\n")
 
 
     # Monitorowanie postępu
     downloaded_files = 0
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(process_file, line, download_folder, download_type): line for line in lines}
-
-        for future in as_completed(futures):
-            
-            try:
-                url = futures[future]
-                
-                future.result()
+    num_errors = 0
+    num_retries = 0
+    if download_type == "asyncio" or download_type in BATCH_DOWNLOAD_TYPES:
+        def on_done(url, error):
+            nonlocal downloaded_files, num_errors
+            elapsed_time = time.time() - start_time
+            relative_time = time.strftime("%H:%M:%S", time.gmtime(elapsed_time))
+            if error is not None:
+                with open(error_log_file, 'a') as log:
+                    log.write(f"{url}\n")
+                num_errors += 1
+            elif downloaded_files % interval_log == 0 or total_files - downloaded_files == 1:
+                with open(log_file, 'a') as log:
+                    log.write(f"{datetime.now()},{downloaded_files},{relative_time}\n")
+            if downloaded_files % interval_print == 0 or total_files - downloaded_files == 1:
+                print(f"Downloaded {downloaded_files}/{total_files} files... | Elapsed: {relative_time}")
+            downloaded_files += 1
+
+        if download_type == "asyncio":
+            # One event loop with max_workers requests in flight instead of max_workers threads.
+            download_all(lines, download_folder, on_done=on_done, max_in_flight=max_workers,
+                         max_connections=min(max_workers, 64), token_path=TOKEN_PATH)
+        else:
+            # One long-lived `cp -I` per batch (checkpoint) of batch_size URLs.
+            batch_size = batch_size or total_files
+            for start_idx in range(0, total_files, batch_size):
+                download_batch_with_cli(lines[start_idx:start_idx + batch_size], download_folder,
+                                        BATCH_DOWNLOAD_TYPES[download_type], max_workers, on_done, cli_executable)
+    else:
+        # Transient failures (503s, timeouts, dropped connections) are retried with
+        # backoff while the other files keep downloading, see download_retry.py.
+        downloads = fetch_with_retries(lines, lambda url: process_file(url, download_folder, download_type),
+                                       num_workers=max_workers, max_attempts=max_attempts)
+        for url, _, error, attempts in downloads:
+            num_retries += attempts - 1
+            if error is None:
                 elapsed_time = time.time() - start_time
                 avg_time_per_file = elapsed_time / downloaded_files if downloaded_files > 0 else 0
                 remaining_files = total_files - downloaded_files
 
                 eta = remaining_files * avg_time_per_file
-                
+                relative_time = time.strftime("%H:%M:%S", time.gmtime(elapsed_time))
+
                 if downloaded_files % interval_log == 0 or remaining_files==1:
-                    relative_time = time.strftime("%H:%M:%S", time.gmtime(elapsed_time))
                     with open(log_file, 'a') as log:
                         log.write(f"{datetime.now()},{downloaded_files},{relative_time}\n")
 
                 if downloaded_files % interval_print == 0 or remaining_files==1:
                     print(f"Downloaded {downloaded_files}/{total_files} files... | ETA: {time.strftime('%H:%M:%S', time.gmtime(eta))}, {round(eta/60/60, 2)} h | Elapsed: {relative_time}")
-
-            except Exception as e:
+            else:
                 with open(error_log_file, 'a') as log:
-                    log.write(f"{url}")
+                    log.write(f"{url}\n")
+                num_errors += 1
 
-
-                print(f"Error downloading {e}")
-            finally:
-                downloaded_files += 1
+                print(f"Error downloading {url} after {attempts} attempt(s): {error}")
+            downloaded_files += 1
 
 
     elapsed_time = time.time() - start_time
     relative_time = time.strftime("%H:%M:%S", time.gmtime(elapsed_time))
     print(f"Zakończono pobieranie {total_files} plików w czasie {relative_time}.")
 
-
-downloads = [
-    {
-        "download_type": "gsutil",
-        "workers_list": [1,2,4,8,10,12,14,18,24,32]
-    }, 
-    {
-        "download_type": "storage_client",
-        "workers_list": [1,2,4,8,10,12,14,18,24,32,48,64,80,96,128]
-    }, 
-    {
-        "download_type": "gcloud_storage",
-        "workers_list": [1,2,4,8,10,12,14,18,24,32]
+    return {
+        "download_type": download_type,
+        "workers": max_workers,
+        "files": total_files,
+        "errors": num_errors,
+        "retries": num_retries,
+        "elapsed": elapsed_time,
+        "files_per_second": (total_files - num_errors) / elapsed_time if elapsed_time > 0 else 0,
     }
-]
-
-for download in downloads:
-    for num_workers in download["workers_list"]:
-
-        download_folder = './tmp'
-        Path(download_folder).mkdir(exist_ok=True, parents=True)
-        manifest_file = "./test_manifest.txt"
-        log_folder = f"./{download["download_type"]}/results_{num_workers}_workers"
-        Path(log_folder).mkdir(exist_ok=True, parents=True)
-
-        download_files_from_manifest(
-            manifest_file=manifest_file,
-            download_folder=download_folder,
-            log_folder=log_folder,
-            interval_log=100,
-            interval_print=100,
-            max_workers=num_workers,
-            download_type=download["download_type"]
-        )
+
+
+def benchmark_client_reuse(manifest_file, fake_gcs_root, workers_list=(1, 4, 16), max_files=1000):
+    """
+    Compare a per-worker cached storage client against a new client per file,
+    downloading from a local fake GCS (fake_gcs_server.py) so no credentials or
+    network are needed. Prints and returns the throughput of both variants.
+    """
+    from fake_gcs_server import start_fake_gcs
+
+    server = start_fake_gcs(fake_gcs_root)
+    os.environ["STORAGE_EMULATOR_HOST"] = server.endpoint
+
+    summary = []
+    try:
+        for num_workers in workers_list:
+            for download_type in ("storage_client_per_call", "storage_client"):
+                download_folder = './tmp'
+                Path(download_folder).mkdir(exist_ok=True, parents=True)
+                # Progress logs go to a temporary folder, so they don't mix with the GCS results.
+                log_folder = tempfile.mkdtemp()
+
+                summary.append(download_files_from_manifest(
+                    manifest_file=manifest_file,
+                    download_folder=download_folder,
+                    log_folder=log_folder,
+                    interval_log=100,
+                    interval_print=100,
+                    max_workers=num_workers,
+                    download_type=download_type,
+                    max_files=max_files,
+                ))
+                shutil.rmtree(download_folder)
+                shutil.rmtree(log_folder)
+
+            per_call, cached = summary[-2], summary[-1]
+            gain = cached["files_per_second"] / per_call["files_per_second"] if per_call["files_per_second"] else float("inf")
+            print(f"{num_workers} workers: {per_call['files_per_second']:.1f} files/s per call, "
+                  f"{cached['files_per_second']:.1f} files/s cached client ({gain:.2f}x)")
+    finally:
+        server.shutdown()
+        del os.environ["STORAGE_EMULATOR_HOST"]
+
+    return summary
+
+
+if __name__ == "__main__":
+    # FAKE_GCS_ROOT=<dir with the manifest's .cif files> benchmarks client reuse offline.
+    fake_gcs_root = os.getenv("FAKE_GCS_ROOT")
+    if fake_gcs_root:
+        benchmark_client_reuse("./test_manifest.txt", fake_gcs_root)
+        raise SystemExit
+
+    downloads = [
+        {
+            "download_type": "gsutil",
+            "workers_list": [1,2,4,8,10,12,14,18,24,32]
+        }, 
+        {
+            "download_type": "storage_client",
+            "workers_list": [1,2,4,8,10,12,14,18,24,32,48,64,80,96,128]
+        }, 
+        {
+            "download_type": "gcloud_storage",
+            "workers_list": [1,2,4,8,10,12,14,18,24,32]
+        },
+        {
+            "download_type": "asyncio",
+            "workers_list": [1,2,4,8,16,32,64,128,256,512]
+        },
+        {
+            "download_type": "gsutil_batch",
+            "workers_list": [1,2,4,8,10,12,14,18,24,32]
+        },
+        {
+            "download_type": "gcloud_storage_batch",
+            "workers_list": [1,2,4,8,10,12,14,18,24,32]
+        }
+    ]
+
+    for download in downloads:
+        for num_workers in download["workers_list"]:
+
+            download_folder = './tmp'
+            Path(download_folder).mkdir(exist_ok=True, parents=True)
+            manifest_file = "./test_manifest.txt"
+            log_folder = f"./{download['download_type']}/results_{num_workers}_workers"
+            Path(log_folder).mkdir(exist_ok=True, parents=True)
+
+            download_files_from_manifest(
+                manifest_file=manifest_file,
+                download_folder=download_folder,
+                log_folder=log_folder,
+                interval_log=100,
+                interval_print=100,
+                max_workers=num_workers,
+                download_type=download["download_type"]
+            )
         
-        shutil.rmtree(download_folder)
\ No newline at end of file
+            shutil.rmtree(download_folder)
\ No newline at end of file
@@ -0,0 +1,227 @@
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+
+# Local stand-in for the GCS bucket, serving files from a directory.
+# Object names are looked up in `root` by their last path component, so a
+# directory of downloaded .cif files can serve any gs://<bucket>/<name> URL.
+#
+# Supported endpoints (enough for google-cloud-storage with STORAGE_EMULATOR_HOST
+# and for plain HTTP clients):
+#   GET /download/storage/v1/b/<bucket>/o/<object>?alt=media   JSON API media download
+#   GET /storage/v1/b/<bucket>/o/<object>?alt=media            JSON API media download
+#   GET /storage/v1/b/<bucket>/o/<object>                      JSON API object metadata
+#   GET /<bucket>/<object>                                     XML API download
+#
+# Downloads honour single-range "Range: bytes=a-b", "bytes=a-" and "bytes=-n"
+# headers with 206 Partial Content (416 if the range is not satisfiable), and
+# the server counts the body bytes it sends, to measure partial fetches.
+#
+# To mimic a real bucket the server can add latency before every response,
+# cap the bandwidth of every connection, fail a fraction of the requests with
+# 503 (which GCS clients treat as retryable; failure_status=429 mimics rate
+# limiting instead) and drop a fraction of the connections without an answer.
+# Missing objects are 404s, i.e. permanent failures.
+
+
+def parse_range(header, size):
+    """
+    (start, end), inclusive and clipped to the file, of a single-range "bytes=a-b",
+    "bytes=a-" or "bytes=-n" header, or None if it is not satisfiable.
+    """
+    unit, _, spec = header.partition("=")
+    first, _, last = spec.strip().partition("-")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    if first == "":
+        if not last or int(last) == 0:
+            return None
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return None
+    return start, end
+
+
+class FakeGCSHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; without this, keep-alive clients stall on delayed ACKs.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _object_path(self, path):
+        parts = [unquote(p) for p in path.strip("/").split("/")]
+        if parts[:1] == ["download"]:
+            parts = parts[1:]
+        if parts[:3] == ["storage", "v1", "b"] and len(parts) >= 5 and parts[4] == "o":
+            return parts[3], "/".join(parts[5:]), True
+        if len(parts) >= 2:
+            return parts[0], "/".join(parts[1:]), False
+        return None, None, False
+
+    def _send(self, status, body, content_type="application/octet-stream", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.server.count_bytes(len(body))
+        self._write(body)
+
+    def _write(self, body):
+        bandwidth = self.server.bandwidth
+        if not bandwidth:
+            self.wfile.write(body)
+            return
+        # Send in blocks of ~10 ms worth of data, sleeping to hold the rate.
+        block_size = max(1024, int(bandwidth / 100))
+        start_time = time.monotonic()
+        for offset in range(0, len(body), block_size):
+            self.wfile.write(body[offset:offset + block_size])
+            delay = start_time + (offset + block_size) / bandwidth - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    def do_GET(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.should_fail(self.server.reset_rate):
+            self.server.count_failure()
+            # Close without a response, as a reset connection looks to the client.
+            self.close_connection = True
+            return
+        if self.server.should_fail(self.server.failure_rate):
+            self.server.count_failure()
+            status = self.server.failure_status
+            self._send(status, json.dumps({"error": {"code": status, "message": "Injected failure"}}).encode(),
+                       "application/json")
+            return
+
+        url = urlparse(self.path)
+        bucket, name, json_api = self._object_path(url.path)
+        local_path = os.path.join(self.server.root, os.path.basename(name)) if name else None
+
+        if local_path is None or not os.path.isfile(local_path):
+            self._send(404, json.dumps({"error": {"code": 404, "message": "Not Found"}}).encode(), "application/json")
+            return
+
+        self.server.count_request()
+        if json_api and "alt=media" not in url.query:
+            metadata = {
+                "kind": "storage#object",
+                "bucket": bucket,
+                "name": name,
+                "size": str(os.path.getsize(local_path)),
+                "generation": "1",
+            }
+            self._send(200, json.dumps(metadata).encode(), "application/json")
+            return
+
+        with open(local_path, "rb") as f:
+            body = f.read()
+        if "Range" not in self.headers:
+            self._send(200, body)
+            return
+        byte_range = parse_range(self.headers["Range"], len(body))
+        if byte_range is None:
+            self._send(416, b"", headers={"Content-Range": f"bytes */{len(body)}"})
+            return
+        start, end = byte_range
+        self._send(206, body[start:end + 1], headers={"Content-Range": f"bytes {start}-{end}/{len(body)}"})
+
+
+class FakeGCSServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, root, host="127.0.0.1", port=0, latency=0.0, bandwidth=None, failure_rate=0.0, seed=None,
+                 failure_status=503, reset_rate=0.0):
+        super().__init__((host, port), FakeGCSHandler)
+        self.root = root
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.reset_rate = reset_rate
+        self.requests = 0
+        self.bytes_sent = 0
+        self.failures = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @property
+    def endpoint(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def count_bytes(self, num_bytes):
+        with self._lock:
+            self.bytes_sent += num_bytes
+
+    def handle_error(self, request, client_address):
+        # Clients dropping idle keep-alive connections is expected, not a server error.
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    def count_failure(self):
+        with self._lock:
+            self.failures += 1
+
+    def should_fail(self, rate):
+        if not rate:
+            return False
+        with self._lock:
+            return self._random.random() < rate
+
+
+def start_fake_gcs(root, host="127.0.0.1", port=0, latency=0.0, bandwidth=None, failure_rate=0.0, seed=None,
+                   failure_status=503, reset_rate=0.0):
+    """
+    Start the fake GCS server in a background thread.
+
+    Parameters:
+        root (str): Directory with the files to serve.
+        host (str): Address to bind.
+        port (int): Port to bind, 0 for any free port.
+        latency (float): Seconds to wait before answering every request.
+        bandwidth (float): Bytes per second per connection, unlimited if None.
+        failure_rate (float): Fraction of requests answered with failure_status.
+        seed (int): Seed for the failure injection, for reproducible runs.
+        failure_status (int): Status of the injected failures, e.g. 503 or 429.
+        reset_rate (float): Fraction of connections closed without a response.
+
+    Returns:
+        FakeGCSServer: Running server; use server.endpoint as STORAGE_EMULATOR_HOST
+            and server.shutdown() to stop it.
+    """
+    server = FakeGCSServer(root, host, port, latency, bandwidth, failure_rate, seed, failure_status, reset_rate)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    # python fake_gcs_server.py <directory> [port] [latency_s] [bandwidth_bytes_per_s] [failure_rate]
+    args = sys.argv[1:] + [None] * (5 - len(sys.argv[1:]))
+    server = FakeGCSServer(
+        args[0],
+        port=int(args[1]) if args[1] else 8080,
+        latency=float(args[2]) if args[2] else 0.0,
+        bandwidth=float(args[3]) if args[3] else None,
+        failure_rate=float(args[4]) if args[4] else 0.0,
+    )
+    print(f"Serving {server.root} at {server.endpoint} "
+          f"(latency {server.latency}s, bandwidth {server.bandwidth or 'unlimited'} B/s, failure rate {server.failure_rate})")
+    server.serve_forever()
@@ -0,0 +1,91 @@
+import csv
+import os
+import shutil
+import sys
+import time
+from datetime import datetime, timezone
+
+# Stand-in for the gsutil / gcloud CLIs, covering the batch copy used by
+# download_parallel_tests.download_batch_with_cli without GCS or credentials:
+#
+#   python stub_gcs_cli.py gsutil [-m] [-o OPTION]... cp -I -L <manifest> <folder>
+#   python stub_gcs_cli.py gcloud storage cp -I --manifest-path=<manifest> <folder>
+#
+# URLs are read from stdin; gs://<bucket>/<name> is copied from $STUB_GCS_ROOT/<name>.
+# Every file gets a manifest row in the CLI's format (Result "OK" or "error"),
+# and the exit status is 1 if any copy failed, like the real tools.
+# $STUB_GCS_DELAY adds seconds per file, to watch progress being picked up.
+
+MANIFEST_HEADER = [
+    "Source", "Destination", "Start", "End", "Md5", "UploadId", "Source Size", "Bytes Transferred", "Result",
+    "Description",
+]
+
+
+def parse_arguments(argv):
+    tool, argv = argv[0], argv[1:]
+    if tool == "gcloud":
+        argv = argv[1:]  # "storage"
+    manifest_path = None
+    positional = []
+    i = 0
+    while i < len(argv):
+        argument = argv[i]
+        if argument in ("-o", "-L"):
+            if argument == "-L":
+                manifest_path = argv[i + 1]
+            i += 2
+            continue
+        if argument.startswith("--manifest-path="):
+            manifest_path = argument.split("=", 1)[1]
+        elif not argument.startswith("-"):
+            positional.append(argument)
+        i += 1
+    if positional[:1] != ["cp"] or len(positional) != 2:
+        raise SystemExit(f"stub_gcs_cli: unsupported command: {' '.join(sys.argv[1:])}")
+    return tool, manifest_path, positional[1]
+
+
+def main():
+    tool, manifest_path, destination = parse_arguments(sys.argv[1:])
+    root = os.environ["STUB_GCS_ROOT"]
+    delay = float(os.getenv("STUB_GCS_DELAY", "0"))
+
+    manifest = None
+    if manifest_path:
+        new_file = not os.path.exists(manifest_path)
+        manifest = open(manifest_path, 'a', newline='')
+        writer = csv.writer(manifest)
+        if new_file:
+            writer.writerow(MANIFEST_HEADER)
+
+    failed = False
+    for line in sys.stdin:
+        url = line.strip()
+        if not url:
+            continue
+        name = url.split('/')[-1]
+        local_path = os.path.join(destination, name)
+        start = datetime.now(timezone.utc).isoformat()
+        print(f"Copying {url}...", file=sys.stderr, flush=True)
+        time.sleep(delay)
+        try:
+            shutil.copyfile(os.path.join(root, name), local_path)
+            size = os.path.getsize(local_path)
+            row = [url, f"file://{local_path}", start, datetime.now(timezone.utc).isoformat(), "", "", size, size, "OK", ""]
+        except OSError as e:
+            failed = True
+            print(f"CommandException: {e.strerror}: {url}", file=sys.stderr, flush=True)
+            row = [url, f"file://{local_path}", start, datetime.now(timezone.utc).isoformat(), "", "", "", 0, "error",
+                   f"{e.strerror}"]
+        if manifest is not None:
+            writer.writerow(row)
+            manifest.flush()
+
+    if manifest is not None:
+        manifest.close()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
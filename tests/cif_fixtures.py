@@ -0,0 +1,97 @@
+import math
+import numpy as np
+
+# Small AlphaFold-style mmCIF files for the tests: a CA trace on a helix with
+# backbone N/C atoms, metadata around the _atom_site loop and the usual
+# AlphaFold columns.
+
+AF_COLUMNS = (
+    "group_PDB", "id", "type_symbol", "label_atom_id", "label_alt_id", "label_comp_id", "label_asym_id",
+    "label_entity_id", "label_seq_id", "pdbx_PDB_ins_code", "Cartn_x", "Cartn_y", "Cartn_z", "occupancy",
+    "B_iso_or_equiv", "pdbx_formal_charge", "auth_seq_id", "auth_comp_id", "auth_asym_id", "auth_atom_id",
+    "pdbx_PDB_model_num",
+)
+
+
+def helix(num_residues, seed=None):
+    # With a seed, residues are displaced randomly, so contacts are not all local.
+    points = np.array([
+        (2.3 * math.cos(math.radians(100 * k)), 2.3 * math.sin(math.radians(100 * k)), 1.5 * k)
+        for k in range(num_residues)
+    ])
+    if seed is not None and num_residues:
+        points += np.random.default_rng(seed).normal(scale=3.0, size=points.shape)
+    return points.tolist()
+
+
+def global_plddt_lines(value):
+    return ["_ma_qa_metric_global.metric_id 1", f"_ma_qa_metric_global.metric_value {value:.2f}", "#"]
+
+
+def af_cif(num_residues=40, columns=AF_COLUMNS, atom_names=("N", "CA", "C"), extra_rows=None, entry="AF-TEST-F1",
+           global_plddt=81.5, global_plddt_last=False, plddt=None, padding=None, leading=None, trailing=None,
+           seed=None):
+    """
+    Text of an AlphaFold-style mmCIF file.
+
+    Parameters:
+        global_plddt (float): _ma_qa_metric_global value, None to leave it out.
+        global_plddt_last (bool): Put the global metric after the _atom_site loop.
+        plddt (callable): plddt(residue number) -> B-factor, 50 + k % 40 by default.
+        padding (callable): padding(residue number) -> extra spaces in the rows of
+            that residue, to vary the row length.
+        leading (list): Lines between the metadata and the _atom_site loop.
+        trailing (list): Lines after the _atom_site loop.
+    """
+    global_lines = global_plddt_lines(global_plddt) if global_plddt is not None else []
+    lines = ["data_" + entry, "#", f"_entry.id {entry}", "#"]
+    if not global_plddt_last:
+        lines.extend(global_lines)
+    lines.extend(leading or [])
+    lines.extend(["loop_", *(f"_atom_site.{name}" for name in columns)])
+    serial = 1
+    for k, (x, y, z) in enumerate(helix(num_residues, seed), start=1):
+        for n, name in enumerate(atom_names):
+            values = {
+                "group_PDB": "ATOM", "id": str(serial), "type_symbol": name.strip("'\"")[0],
+                "label_atom_id": name, "label_alt_id": ".", "label_comp_id": "ALA", "label_asym_id": "A",
+                "label_entity_id": "1", "label_seq_id": str(k), "pdbx_PDB_ins_code": "?",
+                "Cartn_x": f"{x + 0.3 * n:.3f}", "Cartn_y": f"{y:.3f}", "Cartn_z": f"{z:.3f}",
+                "occupancy": "1.00", "B_iso_or_equiv": f"{plddt(k) if plddt else 50 + k % 40:.2f}",
+                "pdbx_formal_charge": "?", "auth_seq_id": str(k), "auth_comp_id": "ALA", "auth_asym_id": "A",
+                "auth_atom_id": name, "pdbx_PDB_model_num": "1",
+            }
+            separator = " " * (1 + (padding(k) if padding else 0))
+            lines.append(separator.join(values[column] for column in columns))
+            serial += 1
+    lines.extend(extra_rows or [])
+    lines.append("#")
+    if global_plddt_last:
+        lines.extend(global_lines)
+    lines.extend(trailing or [])
+    return "\n".join(lines) + "\n"
+
+
+def qa_metric_local(num_residues):
+    # A per-residue QA loop, as AlphaFold files have after the coordinates.
+    lines = ["loop_", "_ma_qa_metric_local.label_asym_id", "_ma_qa_metric_local.label_seq_id",
+             "_ma_qa_metric_local.metric_id", "_ma_qa_metric_local.metric_value",
+             "_ma_qa_metric_local.ordinal_id", "_ma_qa_metric_local.model_id"]
+    lines.extend(f"A {k} 2 {50 + k % 40:.2f} {k} 1" for k in range(1, num_residues + 1))
+    lines.append("#")
+    return lines
+
+
+def nxn_contact_order(coordinates, distance_cutoff=8.0):
+    # The original N x N implementation of contact_order.py.
+    num_residues = len(coordinates)
+    distances = np.linalg.norm(coordinates[:, None, :] - coordinates[None, :, :], axis=-1)
+    contacts = (distances < distance_cutoff) & (distances > 0)
+    total_contact_order = 0
+    num_contacts = 0
+    for i in range(num_residues):
+        for j in range(i + 1, num_residues):
+            if contacts[i, j]:
+                total_contact_order += abs(i - j)
+                num_contacts += 1
+    return total_contact_order / (num_residues * num_contacts) if num_contacts > 0 else 0
@@ -0,0 +1,30 @@
+import sys
+from pathlib import Path
+import pytest
+
+# The pipeline and the download tests are flat script directories, imported by module name.
+ROOT = Path(__file__).resolve().parent.parent
+for directory in ("contact_order", "download_tests"):
+    sys.path.insert(0, str(ROOT / directory))
+
+from fake_gcs_server import start_fake_gcs  # noqa: E402
+
+
+@pytest.fixture
+def fake_gcs(monkeypatch):
+    """
+    Start fake GCS servers (see download_tests/fake_gcs_server.py) with
+    fake_gcs(root, **options); gs:// URLs resolve to the last one started.
+    """
+    servers = []
+
+    def start(root, **options):
+        server = start_fake_gcs(str(root), **options)
+        servers.append(server)
+        monkeypatch.setenv("STORAGE_EMULATOR_HOST", server.endpoint)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,118 @@
+import asyncio
+import pytest
+from async_download import download_all, fetch_all, media_url
+from download_retry import PERMANENT, TRANSIENT, classify_failure
+
+NAMES = [f"AF-P{i:05d}-F1-model_v4.cif" for i in range(30)]
+
+
+@pytest.fixture
+def bucket(tmp_path):
+    root = tmp_path / "bucket"
+    root.mkdir()
+    for name in NAMES:
+        (root / name).write_text(f"data_{name}\n" * 100)
+    return root
+
+
+def test_media_url(monkeypatch):
+    monkeypatch.setenv("STORAGE_EMULATOR_HOST", "http://127.0.0.1:9023/")
+    assert media_url("gs://bucket/dir/AF-X.cif\n") == (
+        "http://127.0.0.1:9023/download/storage/v1/b/bucket/o/dir%2FAF-X.cif?alt=media"
+    )
+    assert media_url("gs://bucket/dir/AF-X.cif", api="xml") == "http://127.0.0.1:9023/bucket/dir/AF-X.cif"
+    assert media_url("https://host/AF-X.cif") == "https://host/AF-X.cif"
+
+
+@pytest.mark.parametrize("api", ["json", "xml"])
+def test_download_to_folder(api, bucket, fake_gcs, tmp_path):
+    fake_gcs(bucket)
+    download_folder = tmp_path / "downloads"
+    download_folder.mkdir()
+    urls = [f"gs://test-bucket/{name}" for name in NAMES]
+    done = []
+
+    results = download_all(urls, str(download_folder), on_done=lambda url, error: done.append((url, error)),
+                           max_in_flight=64, max_connections=4, api=api)
+
+    assert results == [(url, str(download_folder / name), None) for url, name in zip(urls, NAMES)]
+    assert sorted(done) == sorted((url, None) for url in urls)
+    for name in NAMES:
+        assert (download_folder / name).read_bytes() == (bucket / name).read_bytes()
+
+
+def test_bytes_handed_over_in_memory(bucket, fake_gcs):
+    server = fake_gcs(bucket)
+    received = {}
+    urls = [f"{server.endpoint}/test-bucket/{name}" for name in NAMES]
+
+    results = download_all(urls, on_data=received.__setitem__, max_in_flight=8)
+
+    assert all(local_path is None and error is None for _, local_path, error in results)
+    assert received == {url: (bucket / name).read_bytes() for url, name in zip(urls, NAMES)}
+
+
+@pytest.mark.parametrize("failure_status", [503, 429])
+def test_injected_faults_recover(failure_status, bucket, fake_gcs):
+    server = fake_gcs(bucket, failure_rate=0.3, reset_rate=0.1, failure_status=failure_status, seed=2)
+    received = {}
+
+    results = download_all([f"gs://test-bucket/{name}" for name in NAMES], on_data=received.__setitem__,
+                           max_in_flight=16, max_connections=4, retries=20, backoff=0.005, max_backoff=0.05)
+
+    assert [error for _, _, error in results] == [None] * len(NAMES)
+    assert received == {f"gs://test-bucket/{name}": (bucket / name).read_bytes() for name in NAMES}
+    assert server.failures > 0
+
+
+def test_missing_file_fails_permanently(bucket, fake_gcs):
+    server = fake_gcs(bucket)
+    done = []
+
+    results = download_all(["gs://test-bucket/AF-MISSING-F1-model_v4.cif", f"gs://test-bucket/{NAMES[0]}"],
+                           on_done=lambda url, error: done.append(error), retries=3, backoff=0.005)
+
+    url, local_path, error = results[0]
+    assert local_path is None
+    assert error.startswith("Download failed: permanent error after 1 attempt(s): 404")
+    assert results[1][2] is None
+    assert server.requests == 1
+    assert len(done) == 2
+
+
+def test_transient_failures_give_up_after_retries(bucket, fake_gcs):
+    server = fake_gcs(bucket, failure_rate=1.0)
+
+    results = download_all([f"gs://test-bucket/{name}" for name in NAMES[:3]], retries=2, backoff=0.005)
+
+    for _, _, error in results:
+        assert error.startswith("Download failed: transient error after 3 attempt(s): 503")
+    assert server.failures == 9
+
+
+def test_errors_carry_the_status(bucket, fake_gcs):
+    # Failures from the engine classify like those of the other download paths.
+    import aiohttp
+    from async_download import _AccessToken, _fetch
+    server = fake_gcs(bucket)
+
+    async def fetch_error(url):
+        async with aiohttp.ClientSession() as session:
+            try:
+                await _fetch(session, url, _AccessToken())
+            except Exception as e:
+                return e
+
+    missing = asyncio.run(fetch_error(media_url("gs://test-bucket/AF-MISSING-F1-model_v4.cif")))
+    assert missing.status == 404 and classify_failure(missing) == PERMANENT
+    host, port = server.server_address[:2]
+    server.shutdown()
+    server.server_close()
+    refused = asyncio.run(fetch_error(f"http://{host}:{port}/test-bucket/{NAMES[0]}"))
+    assert isinstance(refused, ConnectionError) and classify_failure(refused) == TRANSIENT
+
+
+def test_fetch_all_is_a_coroutine(bucket, fake_gcs):
+    fake_gcs(bucket)
+    results = asyncio.run(fetch_all([f"gs://test-bucket/{NAMES[0]}"]))
+    assert results == [(f"gs://test-bucket/{NAMES[0]}", None, None)]
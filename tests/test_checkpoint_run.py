@@ -0,0 +1,84 @@
+import json
+import pandas as pd
+import pytest
+from cif_fixtures import af_cif
+from contact_order_common import CheckpointRun, calculate_contact_order
+from results_sink import read_results
+from sharding import shard_directory
+from tracing import new_trace
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    directory = tmp_path / "data"
+    directory.mkdir()
+    files, sizes = [], {}
+    for k, num_residues in enumerate((20, 60, 40, 30)):
+        path = directory / f"AF-P{k:05d}-F1-model_v4.cif"
+        path.write_text(af_cif(num_residues))
+        files.append(str(path))
+        sizes[str(path)] = path.stat().st_size
+    return files, sizes
+
+
+def compute(files):
+    return [calculate_contact_order(file, 8.0, trace=new_trace()) for file in files]
+
+
+def test_checkpoints_and_resume(tmp_path, inputs, capsys):
+    files, sizes = inputs
+    output_directory = str(tmp_path / "out")
+    # CSV, as both runs are in one process (whose Parquet parts would be named alike).
+    run = CheckpointRun(shard_directory(output_directory, 0, 1), results_format="csv")
+    file_list = run.inputs(files, sizes)
+    # Largest first.
+    assert file_list == [files[1], files[2], files[3], files[0]]
+
+    run.write(compute(file_list[:2]), 0, 2, 10.0, 12.5, checkpoint_bytes=123, straggler_tail=0.5)
+    run.close()
+    assert "Checkpoint 1: files 2/4" in capsys.readouterr().out
+
+    # A rerun only gets the files without results, and appends to the outputs.
+    run = CheckpointRun(output_directory, results_format="csv")
+    assert run.inputs(files, sizes) == [files[3], files[0]]
+    run.write(compute([files[3], files[0]]), 0, 2, 20.0, 21.0, checkpoint_bytes=45, straggler_tail=0.0)
+    run.close()
+
+    results = read_results(f"{output_directory}/contact_order_results.csv")
+    assert sorted(results["file"]) == files and results["error"].isna().all()
+    logs = pd.read_csv(f"{output_directory}/logs.csv")
+    assert logs["checkpoint_duration"].tolist() == [2.5, 1.0]
+    assert logs["checkpoint_bytes"].tolist() == [123, 45] and logs["straggler_tail"].tolist() == [0.5, 0.0]
+    with open(f"{output_directory}/stats.json") as f:
+        assert json.load(f)["count"] == 4
+    with open(f"{output_directory}/events.jsonl") as f:
+        events = [json.loads(line) for line in f]
+    # Traces go to the event log, not into the results.
+    assert len(events) == 4 and "trace" not in results.columns
+    assert {event["residues"] for event in events} == {20, 30, 40, 60}
+
+    run = CheckpointRun(output_directory, results_format="csv")
+    assert run.inputs(files, sizes) == []
+    run.close()
+
+
+def test_shards(tmp_path, inputs):
+    files, sizes = inputs
+    shards = []
+    for index in range(2):
+        run = CheckpointRun(shard_directory(str(tmp_path), index, 2), shard_index=index, num_shards=2)
+        shards.append(run.inputs(files, sizes))
+        run.write(compute(shards[-1]), 0, len(shards[-1]), 0.0, 1.0)
+        run.close()
+        with open(f"{run.output_directory}/shard.json") as f:
+            assert json.load(f)["files"] == len(shards[-1])
+    assert sorted(shards[0] + shards[1]) == files
+
+
+def test_settings(tmp_path):
+    run = CheckpointRun(str(tmp_path), results_format="csv", min_residue_plddt=70)
+    assert run.plddt_filter.params() == {"min_global_plddt": None, "min_residue_plddt": 70}
+    assert run.store is None and run.output_file.endswith(".csv")
+    run.close()
+    with pytest.raises(ValueError):
+        CheckpointRun(str(tmp_path), min_global_plddt=70, store_directory=str(tmp_path / "store"))
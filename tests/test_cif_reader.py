@@ -0,0 +1,166 @@
+import gzip
+import numpy as np
+import pytest
+from cif_reader import (MissingPlddtError, read_ca_coordinates, read_ca_coordinates_biopython, read_coordinates,
+                        read_global_plddt)
+from contact_order_common import PlddtFilter, calculate_contact_order
+from cif_fixtures import AF_COLUMNS, af_cif, nxn_contact_order, qa_metric_local
+
+
+@pytest.fixture
+def af_file(tmp_path):
+    path = tmp_path / "AF-TEST-F1-model_v4.cif"
+    path.write_text(af_cif())
+    return path
+
+
+@pytest.fixture
+def unusual_columns_file(tmp_path):
+    # Reordered and missing columns, and an alternate location whose second CA has the higher occupancy.
+    columns = (
+        "group_PDB", "id", "label_atom_id", "label_comp_id", "auth_asym_id", "auth_seq_id",
+        "Cartn_z", "Cartn_y", "Cartn_x", "occupancy", "B_iso_or_equiv", "label_alt_id", "pdbx_PDB_ins_code",
+        "type_symbol", "label_asym_id", "label_entity_id", "label_seq_id", "pdbx_PDB_model_num",
+    )
+    text = af_cif(columns=columns)
+    lines = text.splitlines()
+    rows = [i for i, line in enumerate(lines) if line.startswith("ATOM") and " CA " in line]
+    first, second = lines[rows[5]].split(), lines[rows[5]].split()
+    first[columns.index("label_alt_id")], first[columns.index("occupancy")] = "A", "0.40"
+    second[columns.index("label_alt_id")], second[columns.index("occupancy")] = "B", "0.60"
+    second[columns.index("Cartn_x")] = "0.500"
+    lines[rows[5]:rows[5] + 1] = [" ".join(first), " ".join(second)]
+    path = tmp_path / "AF-UNUSUAL-F1-model_v4.cif"
+    path.write_text("\n".join(lines) + "\n")
+    return path
+
+
+@pytest.fixture
+def quoted_file(tmp_path):
+    # Quoted atom names (as in nucleic acids), tokenised by the regex slow path.
+    path = tmp_path / "AF-QUOTED-F1-model_v4.cif"
+    path.write_text(af_cif(atom_names=('"N"', "CA", "'C1''")))
+    return path
+
+
+@pytest.fixture
+def fallback_file(tmp_path):
+    # A text field (";"-delimited value on its own lines) the fast reader does not
+    # support, so read_coordinates falls back to Biopython.
+    text = af_cif()
+    lines = text.splitlines()
+    row = next(i for i, line in enumerate(lines) if line.startswith("ATOM") and " CA " in line)
+    tokens = lines[row].split()
+    lines[row:row + 1] = [" ".join(tokens[:-2]), ";CA", ";", tokens[-1]]
+    path = tmp_path / "AF-TEXTFIELD-F1-model_v4.cif"
+    path.write_text("\n".join(lines) + "\n")
+    return path
+
+
+@pytest.mark.parametrize("fixture", ["af_file", "unusual_columns_file", "quoted_file"])
+def test_fast_reader_matches_biopython(fixture, request):
+    path = request.getfixturevalue(fixture)
+    fast = read_ca_coordinates(str(path))
+    reference = read_ca_coordinates_biopython(str(path))
+    assert fast.dtype == np.float32 and fast.flags["C_CONTIGUOUS"]
+    assert fast.shape == (40, 3)
+    np.testing.assert_array_equal(fast, reference)
+
+
+def test_alternate_location_keeps_highest_occupancy(unusual_columns_file):
+    coordinates = read_ca_coordinates(str(unusual_columns_file))
+    assert coordinates[5, 0] == np.float32(0.5)
+
+
+def test_fast_reader_matches_biopython_from_bytes(af_file):
+    data = af_file.read_bytes()
+    np.testing.assert_array_equal(read_ca_coordinates(data), read_ca_coordinates_biopython(data))
+
+
+def test_unsupported_layout_falls_back_to_biopython(fallback_file):
+    with pytest.raises(ValueError):
+        read_ca_coordinates(str(fallback_file))
+    coordinates = read_coordinates(str(fallback_file), parser="fast")
+    assert coordinates.shape == (40, 3)
+    np.testing.assert_array_equal(coordinates, read_ca_coordinates_biopython(str(fallback_file)))
+
+
+@pytest.mark.parametrize("fixture", ["af_file", "unusual_columns_file", "quoted_file", "fallback_file"])
+@pytest.mark.parametrize("distance_cutoff", [6.0, 8.0, 12.0])
+def test_contact_order_matches_nxn(fixture, distance_cutoff, request):
+    path = str(request.getfixturevalue(fixture))
+    expected = nxn_contact_order(read_ca_coordinates_biopython(path), distance_cutoff)
+    for parser in ("fast", "biopython"):
+        result = calculate_contact_order(path, distance_cutoff, parser=parser)
+        assert result["error"] is None
+        assert result["contact_order"] == pytest.approx(expected, rel=1e-12)
+
+
+GLOBAL_METRIC_LOOP = [
+    "loop_", "_ma_qa_metric_global.metric_id", "_ma_qa_metric_global.metric_type",
+    "_ma_qa_metric_global.metric_value", "_ma_qa_metric_global.model_id",
+    "1 pLDDT 64.25 1", "#",
+]
+
+
+@pytest.mark.parametrize("text, expected", [
+    (af_cif(global_plddt=81.5), 81.5),
+    # After the coordinates (and past the first 64 KiB block), as some writers order it.
+    (af_cif(num_residues=400, global_plddt=42.0, global_plddt_last=True), 42.0),
+    (af_cif(num_residues=400, global_plddt=None, trailing=qa_metric_local(400) + GLOBAL_METRIC_LOOP), 64.25),
+    (af_cif(global_plddt=None, leading=GLOBAL_METRIC_LOOP), 64.25),
+    (af_cif(num_residues=400, global_plddt=None), None),
+])
+def test_read_global_plddt(text, expected, tmp_path):
+    data = text.encode()
+    path = tmp_path / "AF-TEST-F1-model_v4.cif.gz"
+    path.write_bytes(gzip.compress(data))
+    for source in (data, gzip.compress(data), str(path)):
+        assert read_global_plddt(source) == expected
+
+
+@pytest.mark.parametrize("global_plddt_last", [False, True])
+def test_global_plddt_filter(global_plddt_last, tmp_path):
+    path = tmp_path / "AF-TEST-F1-model_v4.cif"
+    path.write_text(af_cif(num_residues=400, global_plddt=55.0, global_plddt_last=global_plddt_last))
+    result = calculate_contact_order(str(path), plddt_filter=PlddtFilter(min_global=70))
+    assert result["error"] == "Skipped: global pLDDT 55.00 below 70"
+    assert result["contact_order"] is None
+    assert calculate_contact_order(str(path), plddt_filter=PlddtFilter(min_global=50))["error"] is None
+
+
+def test_residue_plddt_masks_with_nan(af_file):
+    # B-factors are 50 + k % 40 for residue k: residues 30..39 are at least 80.
+    for reader in (read_ca_coordinates, read_ca_coordinates_biopython):
+        coordinates = reader(str(af_file), min_plddt=80)
+        assert coordinates.shape == (40, 3)
+        masked = np.isnan(coordinates).all(axis=1)
+        assert np.flatnonzero(~masked).tolist() == list(range(29, 39))
+        assert not np.isnan(coordinates[~masked]).any()
+        np.testing.assert_array_equal(coordinates[~masked], read_ca_coordinates(str(af_file))[~masked])
+
+
+def test_residue_plddt_filter(af_file):
+    result = calculate_contact_order(str(af_file), plddt_filter=PlddtFilter(min_residue=80))
+    assert result["error"] is None
+    # Contacts among the 10 kept residues, normalised by their number; the masked
+    # residues keep their place, so separations are those of the full chain.
+    coordinates = read_ca_coordinates(str(af_file))[29:39]
+    distances = np.linalg.norm(coordinates[:, None] - coordinates[None], axis=-1)
+    i, j = np.nonzero(np.triu((distances < 8.0) & (distances > 0), 1))
+    assert result["contact_order"] == pytest.approx(np.abs(i - j).sum() / (10 * len(i)), rel=1e-12)
+
+    result = calculate_contact_order(str(af_file), plddt_filter=PlddtFilter(min_residue=95))
+    assert result["error"] == "Skipped: fewer than 2 residues with pLDDT of at least 95"
+
+
+def test_residue_plddt_needs_b_factors(tmp_path):
+    path = tmp_path / "AF-NOBFACTOR-F1-model_v4.cif"
+    path.write_text(af_cif(columns=tuple(column for column in AF_COLUMNS if column != "B_iso_or_equiv")))
+    for parser in ("fast", "biopython"):
+        with pytest.raises(MissingPlddtError):
+            read_coordinates(str(path), parser=parser, min_plddt=70)
+    # Without a threshold the fast reader does not need the column.
+    assert read_coordinates(str(path)).shape == (40, 3)
+    result = calculate_contact_order(str(path), plddt_filter=PlddtFilter(min_residue=70))
+    assert result["error"].startswith("Missing _atom_site column: B_iso_or_equiv")
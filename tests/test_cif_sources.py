@@ -0,0 +1,86 @@
+import gzip
+import io
+import tarfile
+import numpy as np
+import pytest
+from cif_reader import read_ca_coordinates
+from cif_sources import is_shard, iter_shard, list_inputs
+from contact_order_common import calculate_contact_order, calculate_contact_order_chunk, calculate_contact_order_shard
+from result_cache import ResultCache
+from cif_fixtures import af_cif
+
+MEMBERS = {
+    "AF-A-F1-model_v4.cif.gz": af_cif(40, entry="AF-A-F1", seed=1),
+    "AF-B-F1-model_v4.cif.gz": af_cif(55, entry="AF-B-F1", seed=2),
+    "AF-C-F1-model_v4.cif": af_cif(30, entry="AF-C-F1", seed=3),
+    "AF-EMPTY-F1-model_v4.cif.gz": "",
+}
+
+
+def add_member(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+
+@pytest.fixture(params=[".tar", ".tar.gz", ".tgz"])
+def shard(request, tmp_path):
+    # An AlphaFold proteome archive: gzipped models, plus files that are not CIFs.
+    path = tmp_path / f"UP000005640_9606_HUMAN_v4{request.param}"
+    with tarfile.open(path, "w:gz" if request.param != ".tar" else "w") as tar:
+        add_member(tar, "README.txt", b"not a model\n")
+        for name, text in MEMBERS.items():
+            add_member(tar, name, gzip.compress(text.encode()) if name.endswith(".gz") else text.encode())
+        add_member(tar, "AF-A-F1-predicted_aligned_error_v4.json.gz", gzip.compress(b"{}"))
+        directory = tarfile.TarInfo("models.cif")
+        directory.type = tarfile.DIRTYPE
+        tar.addfile(directory)
+    return str(path)
+
+
+def test_iter_shard(shard):
+    members = list(iter_shard(shard))
+    # CIF members only, in archive order, decompressed.
+    assert [name for name, _ in members] == [f"{shard}/{name}" for name in MEMBERS]
+    assert [data for _, data in members] == [text.encode() for text in MEMBERS.values()]
+
+
+def test_shard_members_match_loose_files(shard, tmp_path):
+    for name, data in iter_shard(shard):
+        member = name.rsplit("/", 1)[1]
+        loose = tmp_path / member.removesuffix(".gz")
+        loose.write_text(MEMBERS[member])
+        expected = calculate_contact_order(str(loose))
+        assert calculate_contact_order(name, data=data) == {**expected, "file": name}
+        if data:
+            np.testing.assert_array_equal(read_ca_coordinates(data), read_ca_coordinates(str(loose)))
+
+
+def test_shard_results_and_cache(shard, tmp_path):
+    results = calculate_contact_order_shard(shard)
+    assert [result["file"] for result in results] == [f"{shard}/{name}" for name in MEMBERS]
+    assert [result["error"] for result in results] == [None, None, None, "File is empty"]
+
+    # Members with a cached result are skipped while the shard is read.
+    cache = ResultCache(str(tmp_path / "cache.sqlite"))
+    cache.put_many(results[:2])
+    assert [result["file"] for result in calculate_contact_order_shard(shard, cache=cache)] == [
+        f"{shard}/{name}" for name in list(MEMBERS)[2:]]
+    # A chunk expands shards in place.
+    loose = tmp_path / "AF-D-F1-model_v4.cif"
+    loose.write_text(af_cif(20, entry="AF-D-F1"))
+    chunk = calculate_contact_order_chunk([str(loose), shard], cache=cache)
+    assert [result["file"] for result in chunk] == [str(loose)] + [f"{shard}/{name}" for name in list(MEMBERS)[2:]]
+
+
+def test_list_inputs(tmp_path):
+    names = ["AF-A-F1-model_v4.cif", "AF-B-F1-model_v4.cif.gz", "UP1_1_A_v4.tar", "UP2_2_B_v4.tar.gz",
+             "UP3_3_C_v4.tgz", "notes.txt", "AF-A-F1-predicted_aligned_error_v4.json"]
+    for k, name in enumerate(names):
+        (tmp_path / name).write_bytes(b"x" * (k + 1))
+    cif_files, shards = list_inputs(str(tmp_path))
+    assert sorted(cif_files) == [str(tmp_path / name) for name in names[:2]]
+    assert sorted(shards) == [str(tmp_path / name) for name in names[2:5]]
+    _, _, sizes = list_inputs(str(tmp_path), with_sizes=True)
+    assert sizes == {str(tmp_path / name): k + 1 for k, name in enumerate(names[:5])}
+    assert is_shard("x.tgz") and not is_shard("x.cif.gz")
@@ -0,0 +1,57 @@
+import os
+import pytest
+import download_parallel_tests
+import gcs_client
+from download_parallel_tests import benchmark_client_reuse
+
+NAMES = [f"AF-P{i:05d}-F1-model_v4.cif" for i in range(12)]
+
+
+@pytest.fixture
+def created_clients(monkeypatch):
+    # Storage clients built by every benchmark run: (download_type, workers) -> count.
+    created = {}
+    counter = [0]
+    create = gcs_client.create_storage_client
+    download = download_parallel_tests.download_files_from_manifest
+
+    def counting_create(*args):
+        counter[0] += 1
+        return create(*args)
+
+    def counting_download(**kwargs):
+        before = counter[0]
+        result = download(**kwargs)
+        created[kwargs["download_type"], kwargs["max_workers"]] = counter[0] - before
+        return result
+
+    monkeypatch.setattr(gcs_client, "create_storage_client", counting_create)
+    monkeypatch.setattr(download_parallel_tests, "create_storage_client", counting_create)
+    monkeypatch.setattr(download_parallel_tests, "download_files_from_manifest", counting_download)
+    return created
+
+
+def test_benchmark_client_reuse(tmp_path, monkeypatch, created_clients):
+    root = tmp_path / "bucket"
+    root.mkdir()
+    for name in NAMES:
+        (root / name).write_text(f"data_{name}\n")
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text("".join(f"gs://public-datasets-deepmind-alphafold-v4/{name}\n" for name in NAMES))
+    # The downloads go to ./tmp.
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("STORAGE_EMULATOR_HOST", raising=False)
+
+    summary = benchmark_client_reuse(str(manifest), str(root), workers_list=(1, 4), max_files=10)
+
+    assert [(run["download_type"], run["workers"]) for run in summary] == [
+        ("storage_client_per_call", 1), ("storage_client", 1), ("storage_client_per_call", 4), ("storage_client", 4),
+    ]
+    for run in summary:
+        assert run["files"] == 10 and run["errors"] == 0 and run["files_per_second"] > 0
+    # A client per file for the baseline, at most one per download thread for the cached client.
+    assert created_clients[("storage_client_per_call", 1)] == created_clients[("storage_client_per_call", 4)] == 10
+    assert created_clients[("storage_client", 1)] == 1
+    assert 1 <= created_clients[("storage_client", 4)] <= 4
+    assert "STORAGE_EMULATOR_HOST" not in os.environ
+    assert not (tmp_path / "tmp").exists()
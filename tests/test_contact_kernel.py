@@ -0,0 +1,193 @@
+import numpy as np
+import pytest
+import contact_kernel
+from contact_kernel import (METRICS, contact_metrics_batch, contact_metrics_from_coordinates,
+                            contact_order_from_coordinates, count_residues, find_contacts_cell_list,
+                            find_contacts_dense, metric_column)
+from contact_order_common import calculate_contact_order
+from cif_fixtures import af_cif, helix, nxn_contact_order
+
+
+def sorted_contacts(contacts):
+    i, j, distances = contacts
+    order = np.lexsort((j, i))
+    return i[order], j[order], distances[order]
+
+
+def assert_same_contacts(actual, expected):
+    for a, e in zip(sorted_contacts(actual), sorted_contacts(expected)):
+        np.testing.assert_array_equal(a, e)
+
+
+def random_cloud(num_residues, seed, scale=30.0, dtype=np.float32):
+    return np.random.default_rng(seed).uniform(0, scale, (num_residues, 3)).astype(dtype)
+
+
+STRUCTURES = {
+    "helix": np.array(helix(120), dtype=np.float32),
+    "displaced_helix": np.array(helix(300, seed=1), dtype=np.float32),
+    "cloud": random_cloud(500, seed=2),
+    "cloud_float64": random_cloud(200, seed=3, dtype=np.float64),
+    # All residues in one cell, and none in contact.
+    "compact": random_cloud(50, seed=4, scale=3.0),
+    "sparse": random_cloud(20, seed=5, scale=2000.0),
+    # Pairs exactly at the cutoff (not contacts) and on cell boundaries.
+    "grid": (np.indices((6, 6, 6)).reshape(3, -1).T * 4.0).astype(np.float32),
+    # Coincident residues (distance 0) are not contacts.
+    "duplicates": np.repeat(random_cloud(30, seed=6), 2, axis=0),
+}
+
+
+@pytest.mark.parametrize("name", STRUCTURES)
+@pytest.mark.parametrize("distance_cutoff", [4.0, 6.0, 8.0, 12.0])
+def test_cell_list_matches_dense(name, distance_cutoff):
+    coordinates = STRUCTURES[name]
+    contacts = find_contacts_cell_list(coordinates, distance_cutoff)
+    assert contacts[0].dtype == np.int64 and contacts[2].dtype == coordinates.dtype
+    assert (contacts[0] < contacts[1]).all()
+    assert_same_contacts(contacts, find_contacts_dense(coordinates, distance_cutoff))
+
+
+def test_grid_boundary_pairs():
+    i, j, distances = find_contacts_cell_list(STRUCTURES["grid"], 4.0)
+    assert len(i) == 0
+    # Just above the spacing, every grid neighbour is in contact.
+    i, j, distances = find_contacts_cell_list(STRUCTURES["grid"], 4.0 + 1e-4)
+    assert len(i) == 3 * 5 * 36 and (distances == 4.0).all()
+
+
+@pytest.mark.parametrize("num_residues", [0, 1])
+def test_too_few_residues(num_residues):
+    i, j, distances = find_contacts_cell_list(np.zeros((num_residues, 3), dtype=np.float32))
+    assert len(i) == len(j) == len(distances) == 0
+
+
+CUTOFFS = [4.0, 6.0, 8.0, 12.0]
+
+
+@pytest.mark.parametrize("name", STRUCTURES)
+@pytest.mark.parametrize("method", ["cell_list", "dense"])
+def test_single_pass_matches_separate_runs(name, method):
+    coordinates = STRUCTURES[name]
+    row = contact_metrics_from_coordinates(coordinates, CUTOFFS, list(METRICS), method=method)
+    assert list(row) == [metric_column(metric, cutoff) for cutoff in CUTOFFS for metric in METRICS]
+    for cutoff in CUTOFFS:
+        for metric in METRICS:
+            separate = contact_metrics_from_coordinates(coordinates, [cutoff], [metric], method=method)
+            assert row[metric_column(metric, cutoff)] == separate[metric_column(metric, cutoff)]
+        i, j, _ = find_contacts_dense(coordinates, cutoff)
+        assert row[metric_column("num_contacts", cutoff)] == len(i)
+        if len(i):
+            assert row[metric_column("absolute", cutoff)] == np.abs(i - j).sum() / len(i)
+        assert row[metric_column("relative", cutoff)] == pytest.approx(nxn_contact_order(coordinates, cutoff), rel=1e-12)
+        assert contact_order_from_coordinates(coordinates, cutoff, method) == row[metric_column("relative", cutoff)]
+
+
+def test_metric_order_and_unknown_names():
+    coordinates = STRUCTURES["helix"]
+    row = contact_metrics_from_coordinates(coordinates, [8.0, 6.0], ["num_contacts", "relative"])
+    assert list(row) == ["num_contacts_8", "relative_co_8", "num_contacts_6", "relative_co_6"]
+    with pytest.raises(ValueError, match="Unknown metric"):
+        contact_metrics_from_coordinates(coordinates, [8.0], ["median"])
+    with pytest.raises(ValueError, match="Unknown contact method"):
+        contact_metrics_from_coordinates(coordinates, [8.0], method="kd_tree")
+
+
+def test_calculate_contact_order_with_several_cutoffs(tmp_path):
+    path = tmp_path / "AF-TEST-F1-model_v4.cif"
+    path.write_text(af_cif(200, seed=7))
+    combined = calculate_contact_order(str(path), CUTOFFS, metrics=list(METRICS))
+    for cutoff in CUTOFFS:
+        single = calculate_contact_order(str(path), cutoff)
+        assert combined[metric_column("relative", cutoff)] == single["contact_order"]
+    # A single cutoff in a list gets metric columns instead of "contact_order".
+    assert list(calculate_contact_order(str(path), [8.0])) == ["file", "relative_co_8", "error"]
+
+
+def batch_structures():
+    rng = np.random.default_rng(8)
+    structures = [np.array(helix(n, seed=n), dtype=np.float32) for n in (2, 3, 17, 40, 41, 90, 256, 257, 400)]
+    structures += [random_cloud(n, seed=n) for n in rng.integers(2, 120, 12)]
+    masked = np.array(helix(60, seed=9), dtype=np.float32)
+    masked[rng.random(60) < 0.3] = np.nan
+    return structures + [masked, STRUCTURES["duplicates"], STRUCTURES["sparse"]]
+
+
+@pytest.fixture
+def blocks(monkeypatch):
+    # Sizes (structures, width) of every padded block.
+    recorded = []
+    block_metrics = contact_kernel._block_metrics
+
+    def recording_block_metrics(coordinate_list, *args):
+        recorded.append((len(coordinate_list), max(len(coordinates) for coordinates in coordinate_list)))
+        return block_metrics(coordinate_list, *args)
+
+    monkeypatch.setattr(contact_kernel, "_block_metrics", recording_block_metrics)
+    return recorded
+
+
+@pytest.mark.parametrize("max_block_pairs", [1, 50_000, 2**21])
+@pytest.mark.parametrize("method", ["cell_list", "dense"])
+def test_batch_matches_per_structure(max_block_pairs, method, blocks):
+    structures = batch_structures()
+    rows = contact_metrics_batch(structures, CUTOFFS, list(METRICS), method=method, max_block_pairs=max_block_pairs)
+    for coordinates, row in zip(structures, rows):
+        assert row == contact_metrics_from_coordinates(coordinates, CUTOFFS, list(METRICS), method=method)
+
+    # Structures above max_residues are not packed; every small one is, once.
+    small = sorted(len(coordinates) for coordinates in structures if len(coordinates) <= 256)
+    assert sum(count for count, _ in blocks) == len(small)
+    for count, width in blocks:
+        # A block holds as many structures as fit in max_block_pairs, but at least one.
+        assert count == 1 or count * width**2 <= max_block_pairs
+    if max_block_pairs == 1:
+        assert [width for _, width in blocks] == small
+    if max_block_pairs == 2**21:
+        assert len(blocks) == 1
+
+
+def test_batch_block_split_at_max_block_pairs(blocks):
+    structures = [np.array(helix(n), dtype=np.float32) for n in (10, 10, 10, 20, 20, 30)]
+    rows = contact_metrics_batch(structures, max_block_pairs=3 * 20**2)
+    # Sorted by length, a block grows while (structures * width²) fits: adding a 20 to
+    # the three 10s would make 4 * 20², and adding the 30 to the two 20s 3 * 30².
+    assert blocks == [(3, 10), (2, 20), (1, 30)]
+    assert rows == [contact_metrics_from_coordinates(coordinates) for coordinates in structures]
+
+
+def test_batch_of_nothing(blocks):
+    assert contact_metrics_batch([]) == []
+    assert blocks == []
+
+
+@pytest.mark.parametrize("name", ["displaced_helix", "cloud", "grid"])
+@pytest.mark.parametrize("masked_fraction", [0.1, 0.5, 0.9])
+def test_masked_residues_keep_their_indices(name, masked_fraction):
+    coordinates = STRUCTURES[name].copy()
+    masked = np.random.default_rng(10).random(len(coordinates)) < masked_fraction
+    masked[[0, -1]] = True
+    coordinates[masked] = np.nan
+    kept = np.flatnonzero(~masked)
+
+    i, j, distances = find_contacts_cell_list(coordinates, 8.0)
+    # Indices are those of the full chain, and no masked residue is in contact.
+    assert not masked[i].any() and not masked[j].any()
+    sub_i, sub_j, sub_distances = find_contacts_dense(coordinates[kept], 8.0)
+    assert_same_contacts((i, j, distances), (kept[sub_i], kept[sub_j], sub_distances))
+    # The dense path leaves NaN rows out the same way (NaN is never below the cutoff).
+    assert_same_contacts((i, j, distances), find_contacts_dense(coordinates, 8.0))
+
+    row = contact_metrics_from_coordinates(coordinates, [8.0], list(METRICS))
+    assert count_residues(coordinates) == len(kept)
+    if len(i):
+        assert row["relative_co_8"] == np.abs(i - j).sum() / (len(kept) * len(i))
+
+
+@pytest.mark.parametrize("num_kept", [0, 1])
+def test_masked_until_too_few_residues(num_kept):
+    coordinates = STRUCTURES["helix"].copy()
+    coordinates[num_kept:] = np.nan
+    i, j, distances = find_contacts_cell_list(coordinates, 8.0)
+    assert len(i) == len(j) == len(distances) == 0
+    assert contact_metrics_from_coordinates(coordinates, [8.0], ["num_contacts"]) == {"num_contacts_8": 0}
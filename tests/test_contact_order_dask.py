@@ -0,0 +1,80 @@
+from types import SimpleNamespace
+import pytest
+from dask.distributed import Client
+from distributed.scheduler import KilledWorker
+import contact_order
+from contact_order_common import calculate_contact_order_chunk
+from cif_fixtures import af_cif
+
+BROKEN = "AF-BROKEN-F1-model_v4.cif"
+KILLED = "AF-KILLED-F1-model_v4.cif"
+
+
+def flaky_chunk(files, *args):
+    # A task that raises instead of returning results, as when its worker dies.
+    names = [str(file).rsplit("/", 1)[-1] for file in files]
+    if KILLED in names:
+        raise KilledWorker("calculate_contact_order_chunk", SimpleNamespace(address="tcp://127.0.0.1:1"),
+                           allowed_failures=3)
+    if BROKEN in names:
+        raise MemoryError("Unable to allocate array")
+    return calculate_contact_order_chunk(files, *args)
+
+
+@pytest.fixture(scope="module")
+def client():
+    with Client(processes=False, n_workers=2, threads_per_worker=1, dashboard_address=None) as client:
+        yield client
+
+
+@pytest.fixture
+def files(tmp_path, monkeypatch):
+    monkeypatch.setattr(contact_order, "calculate_contact_order_chunk", flaky_chunk)
+    paths = []
+    for k, name in enumerate(["AF-A-F1-model_v4.cif", BROKEN, "AF-B-F1-model_v4.cif", KILLED,
+                              "AF-C-F1-model_v4.cif"]):
+        path = tmp_path / name
+        path.write_text(af_cif(30 + k, seed=k))
+        paths.append(str(path))
+    return paths
+
+
+def expected_error(batch):
+    names = [file.rsplit("/", 1)[-1] for file in batch]
+    if KILLED in names:
+        return "Worker failed: KilledWorker"
+    if BROKEN in names:
+        return "Unable to allocate array"
+    return None
+
+
+def check_results(results, batch):
+    # Every file of a task that raised gets an error row, the others a value.
+    error = expected_error(batch)
+    assert [result["file"] for result in results] == batch
+    for result in results:
+        assert set(result) == {"file", "contact_order", "error"}
+        assert (result["error"] or "").startswith(error or "")
+        assert (result["error"] is None) == (error is None)
+        assert (result["contact_order"] is None) == (error is not None)
+
+
+def test_process_cif_files_reports_failed_tasks(client, files):
+    results = contact_order.process_cif_files(files)
+    assert sorted(result["file"] for result in results) == sorted(files)
+    for result in results:
+        check_results([result], [result["file"]])
+
+
+@pytest.mark.parametrize("batch_size", [1, 2])
+def test_stream_cif_files_reports_failed_tasks(client, files, batch_size):
+    batches = list(contact_order.stream_cif_files(files, batch_size=batch_size, max_in_flight=2))
+    assert sorted(file for batch, _ in batches for file in batch) == sorted(files)
+    for batch, results in batches:
+        check_results(results, batch)
+
+
+def test_failed_results_columns():
+    results = contact_order.failed_results(["a.cif"], ValueError("bad"), [6.0, 8.0], ["relative", "num_contacts"])
+    assert results == [{"file": "a.cif", "relative_co_6": None, "num_contacts_6": None, "relative_co_8": None,
+                        "num_contacts_8": None, "error": "bad"}]
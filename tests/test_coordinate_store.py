@@ -0,0 +1,84 @@
+import gzip
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pytest
+from cif_reader import read_coordinates
+from contact_order_common import PlddtFilter, calculate_contact_order, calculate_contact_order_chunk
+from coordinate_store import CoordinateStore, build_coordinate_store
+from cif_fixtures import af_cif
+
+LENGTHS = {"AF-A-F1": 40, "AF-B-F1": 75, "AF-C-F1": 12, "AF-D-F1": 300}
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    directory = tmp_path / "data"
+    directory.mkdir()
+    files = []
+    for k, (entry, num_residues) in enumerate(LENGTHS.items()):
+        text = af_cif(num_residues, entry=entry, seed=k)
+        if k % 2:
+            path = directory / f"{entry}-model_v4.cif.gz"
+            path.write_bytes(gzip.compress(text.encode()))
+        else:
+            path = directory / f"{entry}-model_v4.cif"
+            path.write_text(text)
+        files.append(str(path))
+    (directory / "AF-EMPTY-F1-model_v4.cif").write_text("")
+    (directory / "AF-NOATOMS-F1-model_v4.cif").write_text("data_AF-NOATOMS-F1\n#\n_entry.id AF-NOATOMS-F1\n#\n")
+    return files, [str(directory / "AF-EMPTY-F1-model_v4.cif"), str(directory / "AF-NOATOMS-F1-model_v4.cif")]
+
+
+@pytest.mark.parametrize("parallel", [False, True])
+def test_round_trip(inputs, tmp_path, parallel):
+    files, bad_files = inputs
+    path = tmp_path / "store"
+    # Small shards, so structures are spread over several of them.
+    if parallel:
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            errors = build_coordinate_store(files + bad_files, str(path), executor=executor, chunksize=2,
+                                            shard_residues=100)
+    else:
+        errors = build_coordinate_store(files + bad_files, str(path), shard_residues=100)
+    assert errors == [{"file": bad_files[0], "error": "File is empty"}]
+    assert len(list(path.glob("shard-*.npy"))) == 3
+
+    store = CoordinateStore(str(path))
+    assert len(store) == len(files) + 1
+    for file in files:
+        coordinates = store.get(file)
+        assert isinstance(coordinates.base, np.memmap) or isinstance(coordinates, np.memmap)
+        assert coordinates.dtype == np.float32 and not coordinates.flags.writeable
+        np.testing.assert_array_equal(coordinates, read_coordinates(file))
+    # By accession as well as by path or URL.
+    np.testing.assert_array_equal(store.get("AF-C-F1-model_v4"), read_coordinates(files[2]))
+    np.testing.assert_array_equal(store.get("gs://bucket/AF-D-F1-model_v4.cif"), read_coordinates(files[3]))
+    assert store.get(bad_files[1]).shape == (0, 3)
+
+    with pytest.raises(ValueError, match="File is empty"):
+        store.get(bad_files[0])
+    with pytest.raises(LookupError):
+        store.get("AF-MISSING-F1-model_v4.cif")
+    assert store.covers(bad_files[0]) and bad_files[0] not in store
+    assert not store.covers("AF-MISSING-F1-model_v4.cif")
+
+    # Pickled as its path, for process pools and Dask workers.
+    restored = pickle.loads(pickle.dumps(store))
+    np.testing.assert_array_equal(restored.get(files[1]), store.get(files[1]))
+
+
+def test_contact_order_from_store(inputs, tmp_path):
+    files, bad_files = inputs
+    build_coordinate_store(files[:3] + bad_files, str(tmp_path / "store"))
+    store = CoordinateStore(str(tmp_path / "store"))
+
+    expected = [calculate_contact_order(file) for file in files + bad_files]
+    assert [calculate_contact_order(file, store=store) for file in files + bad_files] == expected
+    # The batch path, with files[3] not in the store and parsed instead.
+    assert calculate_contact_order_chunk(files + bad_files, store=store) == expected
+
+    traced = calculate_contact_order(files[0], store=store, trace={})
+    assert traced["trace"]["bytes"] is None and traced["trace"]["residues"] == 40
+    with pytest.raises(ValueError, match="no pLDDT"):
+        calculate_contact_order(files[0], store=store, plddt_filter=PlddtFilter(min_residue=70))
@@ -0,0 +1,89 @@
+import sys
+from pathlib import Path
+import pytest
+from download_parallel_tests import download_batch_with_cli
+
+STUB_CLI = str(Path(__file__).resolve().parent.parent / "download_tests" / "stub_gcs_cli.py")
+TOOLS = {"gsutil": "gsutil", "gcloud_storage": "gcloud"}
+NAMES = [f"AF-P{i:05d}-F1-model_v4.cif" for i in range(5)]
+
+
+@pytest.fixture
+def bucket(tmp_path, monkeypatch):
+    root = tmp_path / "bucket"
+    root.mkdir()
+    for name in NAMES:
+        (root / name).write_text(f"data_{name}\n")
+    monkeypatch.setenv("STUB_GCS_ROOT", str(root))
+    return root
+
+
+def run_batch(urls, download_folder, tool, **kwargs):
+    done = []
+    results = download_batch_with_cli(
+        urls, str(download_folder), tool=tool, executable=[sys.executable, STUB_CLI, TOOLS[tool]],
+        on_done=lambda url, error: done.append((url, error)), poll_interval=0.05, **kwargs,
+    )
+    return results, done
+
+
+@pytest.mark.parametrize("tool", TOOLS)
+def test_all_files_copied(tool, bucket, tmp_path):
+    download_folder = tmp_path / "downloads"
+    download_folder.mkdir()
+    urls = [f"gs://public-datasets-deepmind-alphafold-v4/{name}\n" for name in NAMES]
+
+    results, done = run_batch(urls, download_folder, tool)
+
+    assert results == {url.strip(): None for url in urls}
+    assert sorted(done) == sorted(results.items())
+    for name in NAMES:
+        assert (download_folder / name).read_text() == (bucket / name).read_text()
+
+
+@pytest.mark.parametrize("tool", TOOLS)
+def test_missing_file_is_a_per_file_error(tool, bucket, tmp_path):
+    download_folder = tmp_path / "downloads"
+    download_folder.mkdir()
+    missing = "gs://public-datasets-deepmind-alphafold-v4/AF-MISSING-F1-model_v4.cif"
+    urls = [f"gs://public-datasets-deepmind-alphafold-v4/{name}" for name in NAMES[:2]] + [missing]
+
+    # The CLI exits with 1; the manifest still has a row per file.
+    results, done = run_batch(urls, download_folder, tool, max_workers=2)
+
+    assert results[urls[0]] is None and results[urls[1]] is None
+    # Result (column 8) "error", reported with its Description (column 9).
+    assert results[missing] == f"{tool}: No such file or directory"
+    assert len(done) == 3
+    assert sorted(path.name for path in download_folder.iterdir()) == NAMES[:2]
+
+
+@pytest.mark.parametrize("tool", TOOLS)
+def test_progress_read_while_running(tool, bucket, tmp_path, monkeypatch):
+    monkeypatch.setenv("STUB_GCS_DELAY", "0.1")
+    download_folder = tmp_path / "downloads"
+    download_folder.mkdir()
+    urls = [f"gs://public-datasets-deepmind-alphafold-v4/{name}" for name in NAMES]
+
+    results, done = run_batch(urls, download_folder, tool)
+
+    # One on_done per file, in copy order, each seen once.
+    assert [url for url, _ in done] == urls
+    assert all(error is None for error in results.values())
+
+
+def test_files_missing_from_manifest_fail(tmp_path):
+    # A CLI that exits before copying anything: every URL fails with its exit status.
+    urls = ["gs://bucket/AF-P00000-F1-model_v4.cif", "gs://bucket/AF-P00001-F1-model_v4.cif"]
+    results = download_batch_with_cli(
+        urls, str(tmp_path), tool="gsutil", poll_interval=0.05,
+        executable=[sys.executable, "-c", "import sys; print('ServiceException: 401', file=sys.stderr); sys.exit(1)"],
+    )
+    assert set(results) == set(urls)
+    for error in results.values():
+        assert error == "gsutil exited with 1 without copying the file: ServiceException: 401"
+
+
+def test_unknown_tool(tmp_path):
+    with pytest.raises(ValueError):
+        download_batch_with_cli(["gs://bucket/file.cif"], str(tmp_path), tool="curl")
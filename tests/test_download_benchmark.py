@@ -0,0 +1,88 @@
+import json
+import math
+import pytest
+from cif_fixtures import af_cif
+from download_benchmark import run_benchmark, scaling_metrics, write_results
+
+NAMES = [f"AF-P{i:05d}-F1-model_v4.cif" for i in range(12)]
+# Metadata before the loop, which the atom_site_range backend does not download.
+LEADING = ["loop_", "_entity_poly_seq.entity_id", "_entity_poly_seq.mon_id", "_entity_poly_seq.num"] + [
+    f"1 ALA {k}" for k in range(1, 500)
+] + ["#"]
+
+
+@pytest.fixture
+def bucket(tmp_path):
+    root = tmp_path / "bucket"
+    root.mkdir()
+    for i, name in enumerate(NAMES):
+        (root / name).write_text(af_cif(60 + i, leading=LEADING))
+    return root
+
+
+@pytest.mark.parametrize("backends", [["http", "asyncio"], ["storage_client", "atom_site_range"]])
+def test_run_benchmark(backends, bucket, fake_gcs, tmp_path):
+    server = fake_gcs(bucket, latency=0.01)
+    urls = [f"gs://test-bucket/{name}\n" for name in NAMES]
+    total_bytes = sum((bucket / name).stat().st_size for name in NAMES)
+
+    results = run_benchmark(urls, backends, [1, 4], server=server)
+
+    assert [(result["backend"], result["workers"]) for result in results] == [
+        (backend, workers) for backend in backends for workers in (1, 4)
+    ]
+    for result in results:
+        assert result["files"] == len(NAMES) and result["errors"] == 0
+        assert result["elapsed"] > 0 and result["files_per_second"] > 0
+        if result["backend"] == "atom_site_range":
+            # Only the _atom_site loops, the probes included.
+            assert result["bytes"] < total_bytes and result["transferred_bytes"] < total_bytes
+        else:
+            assert result["bytes"] == result["transferred_bytes"] == total_bytes
+    for result in results[::2]:
+        assert result["speedup"] == 1 and result["efficiency"] == 1 and math.isnan(result["serial_fraction"])
+
+    write_results(results, tmp_path / "out" / "benchmark", {"backends": backends})
+    with open(tmp_path / "out" / "benchmark.json") as f:
+        written = json.load(f)
+    assert written["config"] == {"backends": backends}
+    assert written["results"][0]["serial_fraction"] is None
+    assert (tmp_path / "out" / "benchmark.csv").read_text().count("\n") == len(results) + 1
+
+
+def test_run_benchmark_counts_failed_files(bucket, fake_gcs):
+    server = fake_gcs(bucket)
+    urls = [f"gs://test-bucket/{name}" for name in NAMES[:3]] + ["gs://test-bucket/AF-MISSING-F1-model_v4.cif"]
+    result, = run_benchmark(urls, ["http"], [2], server=server)
+    assert result["errors"] == 1
+    assert result["files_per_second"] == pytest.approx(3 / result["elapsed"])
+
+
+def test_scaling_metrics_from_one_worker():
+    runs = scaling_metrics([
+        {"workers": 4, "elapsed": 3.2}, {"workers": 1, "elapsed": 8.0}, {"workers": 2, "elapsed": 5.0},
+    ])
+    assert [run["workers"] for run in runs] == [1, 2, 4]
+    assert [run["speedup"] for run in runs] == pytest.approx([1.0, 1.6, 2.5])
+    assert [run["efficiency"] for run in runs] == pytest.approx([1.0, 0.8, 0.625])
+    # Karp-Flatt: e = (1/S - 1/p) / (1 - 1/p).
+    assert math.isnan(runs[0]["serial_fraction"])
+    assert runs[1]["serial_fraction"] == pytest.approx((1 / 1.6 - 1 / 2) / (1 - 1 / 2)) == pytest.approx(0.25)
+    assert runs[2]["serial_fraction"] == pytest.approx((1 / 2.5 - 1 / 4) / (1 - 1 / 4)) == pytest.approx(0.2)
+
+
+def test_scaling_metrics_linear_and_serial():
+    # Perfect scaling has serial fraction 0, no scaling at all has serial fraction 1.
+    linear = scaling_metrics([{"workers": p, "elapsed": 16.0 / p} for p in (1, 2, 4, 8)])
+    assert [run["efficiency"] for run in linear] == pytest.approx([1.0] * 4)
+    assert [run["serial_fraction"] for run in linear[1:]] == pytest.approx([0.0] * 3)
+    flat = scaling_metrics([{"workers": p, "elapsed": 10.0} for p in (1, 2, 4)])
+    assert [run["serial_fraction"] for run in flat[1:]] == pytest.approx([1.0, 1.0])
+
+
+def test_scaling_metrics_relative_to_fewest_workers():
+    # Without a 1-worker run, the smallest run is assumed to scale perfectly up to its worker count.
+    runs = scaling_metrics([{"workers": 2, "elapsed": 6.0}, {"workers": 8, "elapsed": 2.0}])
+    assert [run["speedup"] for run in runs] == pytest.approx([2.0, 6.0])
+    assert runs[1]["efficiency"] == pytest.approx(0.75)
+    assert runs[1]["serial_fraction"] == pytest.approx((1 / 6 - 1 / 8) / (1 - 1 / 8))
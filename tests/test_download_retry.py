@@ -0,0 +1,260 @@
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+import pytest
+import download_retry
+from download_retry import (PERMANENT, TRANSIENT, RetryQueue, classify_failure, failure_message, fetch_with_retries,
+                            host_key)
+
+NAMES = [f"AF-P{i:05d}-F1-model_v4.cif" for i in range(40)]
+
+
+def http_error(status):
+    return urllib.error.HTTPError("http://host/file", status, "error", {}, None)
+
+
+def fetch(url):
+    with urllib.request.urlopen(url, timeout=10) as response:
+        return response.read()
+
+
+@pytest.fixture
+def bucket(tmp_path):
+    root = tmp_path / "bucket"
+    root.mkdir()
+    for name in NAMES:
+        (root / name).write_text(f"data_{name}\n" * 50)
+    return root
+
+
+def run(server, names, **kwargs):
+    urls = [f"{server.endpoint}/test-bucket/{name}" for name in names]
+    return {url.rsplit("/", 1)[1]: (value, error, attempts)
+            for url, value, error, attempts in fetch_with_retries(urls, fetch, **kwargs)}
+
+
+@pytest.mark.parametrize("failure_status", [503, 429])
+def test_injected_faults_recover(failure_status, bucket, fake_gcs):
+    server = fake_gcs(bucket, failure_rate=0.3, reset_rate=0.1, failure_status=failure_status, seed=1)
+
+    results = run(server, NAMES, num_workers=8, max_attempts=20, backoff=0.005, max_backoff=0.05)
+
+    assert set(results) == set(NAMES)
+    for name, (value, error, _) in results.items():
+        assert error is None
+        assert value == (bucket / name).read_bytes()
+    assert server.failures > 0
+    assert sum(attempts for _, _, attempts in results.values()) == len(NAMES) + server.failures
+
+
+def test_missing_file_fails_permanently(bucket, fake_gcs):
+    server = fake_gcs(bucket)
+
+    results = run(server, NAMES[:3] + ["AF-MISSING-F1-model_v4.cif"], max_attempts=5, backoff=0.005)
+
+    value, error, attempts = results["AF-MISSING-F1-model_v4.cif"]
+    assert value is None and attempts == 1
+    assert classify_failure(error) == PERMANENT
+    assert failure_message(error, attempts) == (
+        "Download failed: permanent error after 1 attempt(s): HTTP Error 404: Not Found"
+    )
+    assert all(results[name][1] is None for name in NAMES[:3])
+
+
+def test_transient_failures_give_up_after_max_attempts(bucket, fake_gcs):
+    server = fake_gcs(bucket, failure_rate=1.0)
+
+    results = run(server, NAMES[:4], max_attempts=3, backoff=0.005)
+
+    for value, error, attempts in results.values():
+        assert value is None and attempts == 3
+        assert failure_message(error, attempts).startswith("Download failed: transient error after 3 attempt(s): ")
+    assert server.failures == 12
+
+
+class StatusError(Exception):
+    def __init__(self, status):
+        super().__init__(f"status {status}")
+        self.status = status
+
+
+class Response:
+    status_code = 502
+
+
+class ResponseError(Exception):
+    response = Response()
+
+
+def chained(error):
+    try:
+        try:
+            raise error
+        except Exception as cause:
+            raise RuntimeError("wrapped") from cause
+    except RuntimeError as e:
+        return e
+
+
+@pytest.mark.parametrize("error, kind", [
+    (http_error(503), TRANSIENT),
+    (http_error(429), TRANSIENT),
+    (http_error(408), TRANSIENT),
+    (http_error(404), PERMANENT),
+    (http_error(403), PERMANENT),
+    (StatusError(500), TRANSIENT),
+    (StatusError(401), PERMANENT),
+    (ResponseError(), TRANSIENT),
+    (ConnectionResetError(), TRANSIENT),
+    (TimeoutError(), TRANSIENT),
+    (urllib.error.URLError("refused"), TRANSIENT),
+    (FileNotFoundError(), PERMANENT),
+    (PermissionError(), PERMANENT),
+    (ValueError("bad URL"), PERMANENT),
+    (chained(http_error(503)), TRANSIENT),
+    (chained(http_error(404)), PERMANENT),
+    (chained(ConnectionResetError()), TRANSIENT),
+])
+def test_classify_failure(error, kind):
+    assert classify_failure(error) == kind
+
+
+def test_failure_message_names_errors_without_text():
+    assert failure_message(TimeoutError(), 2) == "Download failed: transient error after 2 attempt(s): TimeoutError"
+
+
+def test_host_key():
+    assert host_key("gs://bucket/a/b.cif\n") == "gs://bucket"
+    assert host_key("http://127.0.0.1:8080/bucket/b.cif") == "127.0.0.1:8080"
+    assert host_key("/data/b.cif") == ""
+
+
+def test_jittered_exponential_backoff(monkeypatch):
+    jitter = []
+    uniform = download_retry.random.uniform
+
+    def recording_uniform(low, high):
+        jitter.append((low, high))
+        return uniform(low, high)
+
+    monkeypatch.setattr(download_retry.random, "uniform", recording_uniform)
+    attempt_times = []
+
+    def failing_fetch(url):
+        attempt_times.append(time.monotonic())
+        raise TimeoutError()
+
+    backoff, max_backoff = 0.04, 0.1
+    results = list(fetch_with_retries(["http://host/file"], failing_fetch, max_attempts=5, backoff=backoff,
+                                      max_backoff=max_backoff))
+
+    assert results[0][3] == 5
+    assert jitter == [(0.5, 1.5)] * 4
+    gaps = [later - earlier for earlier, later in zip(attempt_times, attempt_times[1:])]
+    for attempt, gap in enumerate(gaps):
+        delay = min(max_backoff, backoff * 2**attempt)
+        assert 0.5 * delay - 0.005 <= gap <= 1.5 * delay + 0.1
+
+
+def test_retries_do_not_hold_workers():
+    # One worker: while a failed URL waits for its retry, the others go ahead.
+    order = []
+    failed = set()
+
+    def flaky_fetch(url):
+        order.append(url)
+        if url == "http://host/0" and url not in failed:
+            failed.add(url)
+            raise TimeoutError()
+        return url
+
+    urls = [f"http://host/{i}" for i in range(5)]
+    results = list(fetch_with_retries(urls, flaky_fetch, num_workers=1, backoff=0.2))
+
+    assert order == urls + ["http://host/0"]
+    assert [url for url, _, _, _ in results] == urls[1:] + ["http://host/0"]
+
+
+def test_per_host_limit():
+    active = Counter()
+    peak = Counter()
+    peak_total = 0
+    lock = threading.Lock()
+
+    def slow_fetch(url):
+        nonlocal peak_total
+        host = host_key(url)
+        with lock:
+            active[host] += 1
+            peak[host] = max(peak[host], active[host])
+            peak_total = max(peak_total, sum(active.values()))
+        time.sleep(0.02)
+        with lock:
+            active[host] -= 1
+        return url
+
+    urls = [f"http://{host}/{i}" for i in range(12) for host in ("a", "b")]
+    results = list(fetch_with_retries(urls, slow_fetch, num_workers=8, max_per_host=3))
+
+    assert len(results) == len(urls)
+    assert peak == {"a": 3, "b": 3}
+    assert peak_total == 6
+
+
+def test_429_halves_the_host_limit_and_successes_grow_it_back():
+    # Additive increase, multiplicative decrease per host: every 429 halves the
+    # limit (down to 1), every success adds 1 / limit, up to max_per_host.
+    limits = []
+    throttled = set()
+    finished = []
+
+    def throttled_fetch(url):
+        host = host_key(url)
+        with retry_queue._condition:
+            limits.append((host, retry_queue._limit(host)))
+        if host == "a" and len(throttled) < 3 and url not in throttled:
+            throttled.add(url)
+            raise http_error(429)
+        return url
+
+    retry_queue = RetryQueue(throttled_fetch, lambda *result: finished.append(result), num_workers=1,
+                             max_per_host=8, backoff=0.05)
+    for i in range(12):
+        retry_queue.submit(f"http://a/{i}")
+    retry_queue.close()
+    retry_queue.join()
+
+    limits_a = [limit for host, limit in limits if host == "a"]
+    assert limits_a[:4] == [8, 4, 2, 1]
+    expected = 1
+    for limit in limits_a[3:]:
+        assert limit == pytest.approx(expected)
+        expected = min(8, expected + 1 / expected)
+    assert all(error is None for _, _, error, _ in finished) and len(finished) == 12
+    assert retry_queue.counts == {"attempts": 15, "retries": 3, TRANSIENT: 0, PERMANENT: 0}
+
+
+def test_throttling_is_per_host():
+    limits = {}
+
+    def fetch_b_throttled(url):
+        host = host_key(url)
+        with retry_queue._condition:
+            limits.setdefault(host, []).append(retry_queue._limit(host))
+        if host == "b":
+            raise http_error(429)
+        return url
+
+    retry_queue = RetryQueue(fetch_b_throttled, lambda *result: None, num_workers=1, max_per_host=4,
+                             max_attempts=2, backoff=0.01)
+    for i in range(4):
+        retry_queue.submit(f"http://b/{i}")
+        retry_queue.submit(f"http://a/{i}")
+    retry_queue.close()
+    retry_queue.join()
+
+    assert set(limits["a"]) == {4}
+    assert min(limits["b"]) == 1
+    assert retry_queue.counts[TRANSIENT] == 4
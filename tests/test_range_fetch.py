@@ -0,0 +1,147 @@
+import urllib.request
+import numpy as np
+import pytest
+import range_fetch
+from async_download import media_url
+from cif_reader import read_ca_coordinates, read_coordinates
+from cif_fixtures import af_cif, qa_metric_local
+from contact_order_common import calculate_contact_order
+from range_fetch import AtomSiteIndex, fetch_atom_site, iter_atom_site
+
+NUM_RESIDUES = 200
+# Metadata before the loop (as _entity_poly_seq etc. in AlphaFold files), which a partial fetch skips.
+LEADING = ["loop_", "_entity_poly_seq.entity_id", "_entity_poly_seq.mon_id", "_entity_poly_seq.num"] + [
+    f"1 ALA {k}" for k in range(1, 2000)
+] + ["#"]
+
+
+@pytest.fixture
+def ranges(monkeypatch):
+    # The (start, end) of every ranged read.
+    calls = []
+    open_range = range_fetch.open_range
+
+    def recording_open_range(url, start, end=None, headers=None):
+        calls.append((start, end))
+        return open_range(url, start, end, headers)
+
+    monkeypatch.setattr(range_fetch, "open_range", recording_open_range)
+    return calls
+
+
+@pytest.fixture
+def bucket(tmp_path, fake_gcs):
+    root = tmp_path / "bucket"
+    root.mkdir()
+    files = {
+        # The loop at the end, rows of the same length: the estimate from the probe fits.
+        "AF-TAIL-F1-model_v4.cif": af_cif(NUM_RESIDUES, leading=LEADING),
+        # The first rows are much longer than those in the probe: the estimate lands
+        # inside the loop and has to move back to its header.
+        "AF-LONGROWS-F1-model_v4.cif": af_cif(NUM_RESIDUES, leading=LEADING,
+                                             padding=lambda k: 2 if k <= NUM_RESIDUES // 2 else 0),
+        # A per-residue QA loop after the coordinates: the probe has no atom rows.
+        "AF-TRAILING-F1-model_v4.cif": af_cif(NUM_RESIDUES, leading=LEADING, trailing=qa_metric_local(NUM_RESIDUES)),
+        "AF-EMPTY-F1-model_v4.cif": "",
+    }
+    for name, text in files.items():
+        (root / name).write_text(text)
+    server = fake_gcs(root)
+    return server, {name: f"gs://test-bucket/{name}" for name in files}
+
+
+def full_download(url):
+    with urllib.request.urlopen(media_url(url)) as response:
+        return response.read()
+
+
+def check_coordinates(url, lines):
+    expected = read_ca_coordinates(full_download(url))
+    assert expected.shape == (NUM_RESIDUES, 3)
+    np.testing.assert_array_equal(read_ca_coordinates(iter(lines)), expected)
+
+
+def test_tail_probe_estimate(bucket, ranges):
+    server, urls = bucket
+    url = urls["AF-TAIL-F1-model_v4.cif"]
+    data = full_download(url)
+    loop_size = len(data) - data.index(b"loop_\n_atom_site")
+    server.bytes_sent = 0
+
+    lines = list(iter_atom_site(url))
+
+    # The probe and one read from the estimated start, which is about the margins
+    # before the loop header (the probe's rows are a little longer than the
+    # first ones): the metadata before it is not downloaded.
+    assert len(ranges) == 2 and ranges[0][0] < 0
+    assert server.bytes_sent <= loop_size * 1.05 + range_fetch.HEADER_SIZE
+    assert server.bytes_sent < len(data) - sum(len(line) + 1 for line in LEADING) / 2
+    check_coordinates(url, lines)
+
+
+def test_estimate_past_header_moves_back(bucket, ranges):
+    _, urls = bucket
+    url = urls["AF-LONGROWS-F1-model_v4.cif"]
+
+    lines = list(iter_atom_site(url))
+
+    starts = [start for start, _ in ranges[1:]]
+    assert len(starts) >= 2 and starts == sorted(starts, reverse=True) and starts[-1] > 0
+    assert lines[0].strip() == b"loop_"
+    check_coordinates(url, lines)
+
+
+def test_growing_windows_from_the_start(bucket, ranges):
+    _, urls = bucket
+    url = urls["AF-TRAILING-F1-model_v4.cif"]
+
+    lines = list(iter_atom_site(url))
+
+    windows = ranges[1:]
+    assert windows[0] == (0, range_fetch.WINDOW_SIZE - 1)
+    assert all(end - start > previous_end - previous_start
+               for (previous_start, previous_end), (start, end) in zip(windows, windows[1:]))
+    check_coordinates(url, lines)
+
+
+@pytest.mark.parametrize("name", ["AF-TAIL-F1-model_v4.cif", "AF-LONGROWS-F1-model_v4.cif",
+                                  "AF-TRAILING-F1-model_v4.cif"])
+def test_cached_index_hit(name, bucket, ranges, tmp_path):
+    _, urls = bucket
+    url = urls[name]
+    index = AtomSiteIndex(str(tmp_path / "atom_site_index.sqlite"))
+    first = list(iter_atom_site(url, index))
+    size, start, end = index.get(url)
+    data = full_download(url)
+    assert size == len(data) and data[start:end] == b"".join(first)
+
+    ranges.clear()
+    second = list(iter_atom_site(url, index))
+
+    # A single read of exactly the loop.
+    assert ranges == [(start, end - 1)]
+    assert second == first
+    check_coordinates(url, second)
+    index.close()
+
+
+def test_fetch_atom_site_parses_like_the_full_file(bucket):
+    _, urls = bucket
+    for name in ("AF-TAIL-F1-model_v4.cif", "AF-TRAILING-F1-model_v4.cif"):
+        document = fetch_atom_site(urls[name])
+        assert document.startswith(b"data_" + name.removesuffix(".cif").encode())
+        for parser in ("fast", "biopython"):
+            np.testing.assert_array_equal(read_coordinates(document, parser),
+                                          read_coordinates(full_download(urls[name]), parser))
+
+
+def test_empty_file(bucket, tmp_path):
+    _, urls = bucket
+    url = urls["AF-EMPTY-F1-model_v4.cif"]
+    # The server answers the probe with 416 Requested Range Not Satisfiable.
+    assert fetch_atom_site(url) == b""
+    assert list(iter_atom_site(url)) == []
+    assert calculate_contact_order(url, data=fetch_atom_site(url))["error"] == "File is empty"
+
+    local_path = tmp_path / "bucket" / "AF-EMPTY-F1-model_v4.cif"
+    assert fetch_atom_site(str(local_path)) == b""
@@ -0,0 +1,138 @@
+import os
+import pickle
+import threading
+import pytest
+from result_cache import ResultCache, accession, file_key, split_shard_member
+
+
+def result(file, value=0.25, error=None):
+    return {"file": file, "contact_order": None if error else value, "error": error}
+
+
+@pytest.fixture
+def files(tmp_path):
+    paths = []
+    for name in ("AF-A-F1-model_v4.cif", "AF-B-F1-model_v4.cif.gz", "AF-C-F1-model_v4.cif"):
+        path = tmp_path / name
+        path.write_text(f"data_{name}\n")
+        paths.append(str(path))
+    return paths
+
+
+@pytest.fixture
+def cache_file(tmp_path):
+    return str(tmp_path / "result_cache.sqlite")
+
+
+def test_accession_and_shard_members():
+    assert accession("gs://bucket/AF-G4MV54-F1-model_v4.cif") == "AF-G4MV54-F1-model_v4"
+    assert accession(" /data/AF-G4MV54-F1-model_v4.cif.gz\n") == "AF-G4MV54-F1-model_v4"
+    assert split_shard_member("/data/UP1_9606_HUMAN_v4.tar/AF-A-F1-model_v4.cif.gz") == (
+        "/data/UP1_9606_HUMAN_v4.tar", "AF-A-F1-model_v4.cif.gz")
+    assert split_shard_member("/data/AF-A-F1-model_v4.cif") == (None, None)
+
+
+def test_hit_and_miss(files, cache_file):
+    cache = ResultCache(cache_file)
+    assert cache.missing(files) == files
+    cache.put_many([result(files[0], 0.1), result(files[2], 0.3)])
+    assert cache.get(files[0]) == result(files[0], 0.1)
+    assert cache.get(files[1]) is None
+    # In input order.
+    assert cache.missing(list(reversed(files))) == [files[1]]
+    cache.close()
+
+    # Persistent across runs.
+    cache = ResultCache(cache_file)
+    assert cache.get(files[2]) == result(files[2], 0.3)
+    cache.close()
+
+
+@pytest.mark.parametrize("params", [
+    {"distance_cutoff": 6.0},
+    {"distance_cutoff": [8.0]},
+    {"metrics": ["relative", "num_contacts"]},
+    {"filters": {"min_global_plddt": 70, "min_residue_plddt": None}},
+])
+def test_other_parameters_miss(files, cache_file, params):
+    cache = ResultCache(cache_file)
+    cache.put_many([result(file) for file in files])
+    other = ResultCache(cache_file, **params)
+    assert other.missing(files) == files
+    assert other.get(files[0]) is None
+    # Both parameter sets live side by side.
+    other.put_many([result(files[0], 0.5)])
+    assert other.get(files[0])["contact_order"] == 0.5
+    assert cache.get(files[0])["contact_order"] == 0.25
+
+
+def test_filters_without_settings_share_results(files, cache_file):
+    ResultCache(cache_file).put_many([result(files[0])])
+    assert ResultCache(cache_file, filters=None).get(files[0]) is not None
+
+
+def test_changed_file_misses(files, cache_file):
+    cache = ResultCache(cache_file)
+    cache.put_many([result(file) for file in files])
+    with open(files[0], 'a') as f:
+        f.write("more\n")
+    os.utime(files[2], ns=(0, 0))
+    # Keys are memoised per cache; a new run sees the change.
+    assert ResultCache(cache_file).missing(files) == [files[0], files[2]]
+
+
+def test_content_hash(files, cache_file):
+    cache = ResultCache(cache_file, hash_content=True)
+    cache.put_many([result(files[0])])
+    assert cache.key(files[0]).startswith("AF-A-F1-model_v4:sha256:")
+    # Touching the file (e.g. copying it to scratch) keeps its result.
+    os.utime(files[0], ns=(0, 0))
+    assert ResultCache(cache_file, hash_content=True).missing(files[:1]) == []
+
+
+def test_keys_of_urls_and_shard_members(tmp_path):
+    shard = tmp_path / "UP000005640_9606_HUMAN_v4.tar"
+    shard.write_bytes(b"tar")
+    member = f"{shard}/AF-A-F1-model_v4.cif.gz"
+    stat = os.stat(shard)
+    assert file_key(member) == f"AF-A-F1-model_v4:{stat.st_size}:{stat.st_mtime_ns}"
+    url = "gs://public-datasets-deepmind-alphafold-v4/AF-A-F1-model_v4.cif"
+    assert file_key(url + "\n") == url
+
+
+@pytest.mark.parametrize("error, cached", [
+    (None, True),
+    ("File is empty", True),
+    ("Skipped: global pLDDT 55.00 below 70", True),
+    ("Download failed after 5 attempt(s): HTTP 503", False),
+    ("Worker failed: BrokenProcessPool: A process in the process pool was terminated abruptly", False),
+])
+def test_transient_errors_are_not_cached(files, cache_file, error, cached):
+    cache = ResultCache(cache_file)
+    cache.put_many([result(files[0], error=error)])
+    assert (cache.get(files[0]) is not None) == cached
+    assert cache.missing(files[:1]) == ([] if cached else files[:1])
+
+
+def test_a_later_result_replaces_the_cached_one(files, cache_file):
+    cache = ResultCache(cache_file)
+    cache.put_many([result(files[0], error="No residues found in the file")])
+    cache.put_many([result(files[0], 0.2)])
+    assert cache.get(files[0]) == result(files[0], 0.2)
+
+
+def test_pickles_as_its_settings(files, cache_file):
+    cache = ResultCache(cache_file, distance_cutoff=[6.0, 8.0], metrics=["absolute"], hash_content=True,
+                        filters={"min_global_plddt": 70, "min_residue_plddt": None})
+    cache.put_many([result(files[0])])
+    # Not the SQLite connection, which cannot be pickled.
+    assert set(cache.__getstate__()) == {"path", "distance_cutoff", "metrics", "hash_content", "filters"}
+    restored = pickle.loads(pickle.dumps(cache))
+    assert restored.params == cache.params and restored.hash_content
+
+    # Workers unpickle the cache in one thread and use it in another.
+    found = []
+    thread = threading.Thread(target=lambda: found.append(restored.missing(files)))
+    thread.start()
+    thread.join()
+    assert found == [files[1:]]
@@ -0,0 +1,174 @@
+import math
+import numpy as np
+import pytest
+from result_stats import (ColumnStats, QuantileSketch, ResultStats, error_reason, read_organisms, result_group,
+                          uniprot_accession)
+
+SHARD = "/data/UP000005640_9606_HUMAN_v4.tar"
+
+
+def results(rng, n, start=0):
+    rows = []
+    for k in range(start, start + n):
+        if k % 7 == 3:
+            rows.append({"file": f"/data/AF-P{k:05d}-F1-model_v4.cif", "relative_co_8": None,
+                         "error": f"Download failed after {k % 3 + 1} attempt(s): 503"})
+        else:
+            file = f"{SHARD}/AF-Q{k:05d}-F1-model_v4.cif.gz" if k % 2 else f"/data/AF-P{k:05d}-F1-model_v4.cif"
+            rows.append({"file": file, "relative_co_8": float(rng.beta(2, 5)), "residues": int(rng.integers(50, 900)),
+                         "error": None})
+    return rows
+
+
+def comparable(state):
+    # Floating point sums differ in the last bits between orders of updates.
+    if isinstance(state, dict):
+        return {key: comparable(value) for key, value in state.items()}
+    if isinstance(state, list):
+        return [comparable(value) for value in state]
+    if isinstance(state, float):
+        return pytest.approx(state, rel=1e-9, abs=1e-12)
+    return state
+
+
+def test_merge_equals_update_on_the_union():
+    rng = np.random.default_rng(0)
+    first, second = results(rng, 300), results(rng, 200, start=300)
+    union = ResultStats()
+    union.update(first + second)
+
+    merged = ResultStats()
+    merged.update(first)
+    other = ResultStats()
+    other.update(second)
+    merged.merge(other)
+    assert merged.to_dict() == comparable(union.to_dict())
+
+    # Merging into empty statistics, and merging empty statistics, change nothing.
+    assert ResultStats().merge(union).to_dict() == union.to_dict()
+    assert ResultStats().merge(ResultStats()).to_dict() == ResultStats().to_dict()
+
+
+def test_merge_does_not_share_state():
+    rng = np.random.default_rng(1)
+    other = ResultStats()
+    other.update(results(rng, 50))
+    before = other.to_dict()
+    merged = ResultStats().merge(other)
+    merged.update(results(rng, 50, start=50))
+    assert other.to_dict() == before
+
+
+def test_summary():
+    rng = np.random.default_rng(2)
+    rows = results(rng, 500)
+    stats = ResultStats()
+    stats.update(rows)
+    values = np.array([row["relative_co_8"] for row in rows if row["error"] is None])
+    state = stats.to_dict()
+    column = state["columns"]["relative_co_8"]
+    assert state["count"] == 500
+    assert state["errors"] == {"Download failed after 1 attempt(s)": 24, "Download failed after 2 attempt(s)": 24,
+                               "Download failed after 3 attempt(s)": 23}
+    assert column["count"] == len(values)
+    assert column["mean"] == pytest.approx(values.mean())
+    assert column["std"] == pytest.approx(values.std(ddof=1))
+    assert (column["min"], column["max"]) == (values.min(), values.max())
+    assert column["histogram"]["range"] == [0.0, 1.0, 100]
+    assert sum(column["histogram"]["counts"]) == len(values)
+    assert "histogram" not in state["columns"]["residues"]
+    # Every result is in exactly one group.
+    assert sorted(state["groups"]) == ["UP000005640_9606_HUMAN", "unknown"]
+    assert sum(group["count"] for group in state["groups"].values()) == 500
+
+
+def test_round_trip(tmp_path):
+    rng = np.random.default_rng(3)
+    stats = ResultStats()
+    stats.update(results(rng, 200))
+    path = str(tmp_path / "stats.json")
+    stats.write(path)
+    loaded = ResultStats.load(path)
+    assert loaded.to_dict() == stats.to_dict()
+
+    # The loaded statistics keep merging and updating like the original.
+    more = results(rng, 100, start=200)
+    stats.update(more)
+    loaded.update(more)
+    assert loaded.to_dict() == comparable(stats.to_dict())
+    assert ResultStats.load(str(tmp_path / "missing.json")).to_dict() == ResultStats().to_dict()
+
+
+def test_empty_column_round_trip():
+    stats = ColumnStats((0.0, 1.0, 10))
+    state = stats.to_dict()
+    assert state["mean"] is None and state["std"] is None and state["min"] is None
+    assert ColumnStats.from_dict(state).to_dict() == state
+
+
+def test_histogram_edges():
+    stats = ColumnStats((0.0, 1.0, 4))
+    stats.update([-0.5, 0.0, 0.24, 0.25, 0.99, 1.0, 1.5, math.nan])
+    # Underflow, four bins (the last including 1.0), overflow; NaN is not counted.
+    assert stats.histogram == [1, 2, 1, 0, 2, 1]
+    assert stats.count == 7
+
+
+@pytest.mark.parametrize("relative_accuracy", [0.01, 0.05])
+def test_quantiles_within_relative_accuracy(relative_accuracy):
+    rng = np.random.default_rng(4)
+    values = np.concatenate([rng.lognormal(0, 2, 5000), rng.uniform(1e-4, 1e-3, 500)])
+    sketch = QuantileSketch(relative_accuracy)
+    for chunk in np.array_split(values, 7):
+        sketch.update(chunk)
+    ordered = np.sort(values)
+    for q in (0.0, 0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99, 1.0):
+        true_value = ordered[int(q * (len(values) - 1))]
+        assert abs(sketch.quantile(q) - true_value) <= relative_accuracy * true_value
+
+
+def test_sketch_zeros_and_merge():
+    sketch = QuantileSketch()
+    assert sketch.quantile(0.5) is None
+    sketch.update([0.0, 0.0, 0.0, -1.0, 2.0])
+    assert sketch.zeros == 4 and sketch.count == 5
+    assert sketch.quantile(0.5) == 0.0
+    assert sketch.quantile(1.0) == pytest.approx(2.0, rel=0.01)
+
+    other = QuantileSketch()
+    other.update([2.0, 3.0])
+    sketch.merge(other)
+    assert sketch.count == 7 and sketch.zeros == 4
+    assert QuantileSketch.from_dict(sketch.to_dict()).to_dict() == sketch.to_dict()
+    with pytest.raises(ValueError):
+        sketch.merge(QuantileSketch(0.05))
+
+
+def test_error_reason():
+    assert error_reason("Download failed after 5 attempt(s): 503 Service Unavailable") == \
+        "Download failed after 5 attempt(s)"
+    assert error_reason("File is empty") == "File is empty"
+    assert len(error_reason("x" * 500)) == 100
+
+
+def test_groups(tmp_path):
+    assert uniprot_accession("/data/AF-G4MV54-F1-model_v4.cif") == "G4MV54"
+    assert result_group(f"{SHARD}/AF-G4MV54-F1-model_v4.cif.gz") == "UP000005640_9606_HUMAN"
+    assert result_group("gs://bucket/AF-G4MV54-F1-model_v4.cif") == "unknown"
+
+    path = tmp_path / "organisms.tsv"
+    path.write_text("Entry\tOrganism\nG4MV54\tMagnaporthe oryzae\nP69905\t\n")
+    organisms = read_organisms(str(path))
+    assert organisms == {"G4MV54": "Magnaporthe oryzae"}
+    # The organism table wins over the proteome in the path.
+    assert result_group(f"{SHARD}/AF-G4MV54-F1-model_v4.cif.gz", organisms) == "Magnaporthe oryzae"
+    assert result_group(f"{SHARD}/AF-P69905-F1-model_v4.cif.gz", organisms) == "UP000005640_9606_HUMAN"
+
+    (tmp_path / "bad.csv").write_text("accession,name\nG4MV54,x\n")
+    with pytest.raises(ValueError):
+        read_organisms(str(tmp_path / "bad.csv"))
+
+    stats = ResultStats(organisms=organisms)
+    stats.update([{"file": "/data/AF-G4MV54-F1-model_v4.cif", "relative_co_8": 0.1, "error": None}])
+    assert list(stats.groups) == ["Magnaporthe oryzae"]
+    assert not ResultStats(by_group=False).groups
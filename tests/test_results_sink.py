@@ -0,0 +1,87 @@
+import os
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+from results_sink import CsvSink, ParquetSink, make_sink, read_results
+
+
+def checkpoint(start, count, source="/scratch/lsc_data/data"):
+    rows = []
+    for k in range(start, start + count):
+        failed = k % 4 == 3
+        rows.append({
+            "file": f"{source}/AF-P{k:05d}-F1-model_v4.cif",
+            "relative_co_8": None if failed else k / 100,
+            "num_contacts_8": None if failed else 10 * k,
+            "error": "File is empty" if failed else None,
+        })
+    return pd.DataFrame(rows)
+
+
+def test_parquet_round_trip(tmp_path):
+    path = tmp_path / "contact_order_results.parquet"
+    sink = make_sink(str(path), "parquet")
+    assert isinstance(sink, ParquetSink)
+    first, second = checkpoint(0, 6), checkpoint(6, 5, source="gs://public-datasets-deepmind-alphafold-v4")
+    sink.write(first)
+    sink.write(pd.DataFrame())
+    sink.write(second)
+    sink.close()
+
+    # One file per checkpoint, and no temporary files left behind.
+    parts = sorted(os.listdir(path))
+    assert len(parts) == 2 and all(part.endswith(".parquet") and not part.startswith(".") for part in parts)
+
+    df = read_results(str(path)).sort_values("accession", ignore_index=True)
+    expected = pd.concat([first, second], ignore_index=True)
+    assert list(df.columns) == ["accession", "source", "relative_co_8", "num_contacts_8", "error"]
+    assert df["accession"].astype(str).tolist() == [file.rsplit("/", 1)[1][:-4] for file in expected["file"]]
+    assert df["source"].astype(str).tolist() == [file.rsplit("/", 1)[0] for file in expected["file"]]
+    assert str(df["num_contacts_8"].dtype) == "Int64" and df["relative_co_8"].dtype == "float64"
+    pd.testing.assert_series_equal(df["relative_co_8"], expected["relative_co_8"].astype("float64"))
+    assert df["num_contacts_8"].tolist() == expected["num_contacts_8"].astype("Int64").tolist()
+    assert df["error"].isna().tolist() == expected["error"].isna().tolist()
+
+    # Strings are dictionary-encoded.
+    schema = pq.read_schema(path / parts[0])
+    for column in ("accession", "source", "error"):
+        assert str(schema.field(column).type).startswith("dictionary")
+
+
+def test_parquet_resumed_run_adds_parts(tmp_path, monkeypatch):
+    path = tmp_path / "results"
+    ParquetSink(str(path)).write(checkpoint(0, 3))
+    # A resumed run (another process) writes next to the earlier parts.
+    monkeypatch.setattr(os, "getpid", lambda: 1)
+    ParquetSink(str(path)).write(checkpoint(3, 3))
+    assert len(read_results(str(path))) == 6
+
+
+def test_contact_order_column(tmp_path):
+    path = tmp_path / "results.parquet"
+    sink = ParquetSink(str(path))
+    sink.write(pd.DataFrame([{"file": "/data/AF-A-F1-model_v4.cif", "contact_order": 0.125, "error": None},
+                             {"file": "/data/AF-B-F1-model_v4.cif", "contact_order": None, "error": "bad"}]))
+    df = read_results(str(path))
+    assert df["contact_order"].dtype == "float64"
+    assert df["contact_order"].tolist()[0] == 0.125 and pd.isna(df["contact_order"][1])
+
+
+def test_csv_round_trip(tmp_path):
+    path = tmp_path / "contact_order_results.csv"
+    sink = make_sink(str(path), "csv")
+    assert isinstance(sink, CsvSink)
+    sink.write(checkpoint(0, 4))
+    sink.write(pd.DataFrame())
+    # A resumed run appends without a second header.
+    make_sink(str(path), "csv").write(checkpoint(4, 4))
+    df = read_results(str(path))
+    expected = pd.concat([checkpoint(0, 4), checkpoint(4, 4)], ignore_index=True)
+    assert df["file"].tolist() == expected["file"].tolist()
+    assert df["relative_co_8"].equals(expected["relative_co_8"].astype("float64"))
+    assert path.read_text().count("file,") == 1
+
+
+def test_unknown_format(tmp_path):
+    with pytest.raises(ValueError, match="Unknown results format"):
+        make_sink(str(tmp_path / "results.json"), "json")
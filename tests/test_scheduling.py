@@ -0,0 +1,126 @@
+import pytest
+from scheduling import (AdaptiveCheckpoints, balance, input_sizes, longest_first, read_manifest, split_by_weight,
+                        straggler_tail)
+
+FILES = [f"f{i}" for i in range(10)]
+
+
+def test_longest_first():
+    sizes = {"a": 5, "b": 50, "c": 20}
+    assert longest_first(["a", "b", "c", "unknown"], sizes) == ["b", "c", "a", "unknown"]
+    # Stable for equal sizes.
+    assert longest_first(["x", "y", "z"], {}) == ["x", "y", "z"]
+
+
+def test_split_by_weight():
+    sizes = {"a": 10, "b": 10, "c": 25, "d": 5, "e": 5}
+    assert split_by_weight(["a", "b", "c", "d", "e"], sizes, 20) == [["a", "b"], ["c"], ["d", "e"]]
+    # A file heavier than the target is a chunk of its own; unknown sizes weigh 0.
+    assert split_by_weight(["c", "x", "y"], sizes, 20) == [["c"], ["x", "y"]]
+    assert split_by_weight([], sizes, 20) == []
+
+
+def test_balance():
+    sizes = {"a": 9, "b": 7, "c": 6, "d": 5, "e": 4, "f": 1}
+    bins = balance(list(sizes), sizes, 2)
+    assert sorted(file for files in bins for file in files) == sorted(sizes)
+    # Greedy longest-first placement, not the optimal 16/16 split.
+    assert sorted(sum(sizes[file] for file in files) for files in bins) == [15, 17]
+
+
+def slices(checkpoints):
+    return list(checkpoints)
+
+
+def test_checkpoints_by_bytes():
+    sizes = dict(zip(FILES, [40, 30, 30, 20, 20, 10, 10, 10, 5, 5]))
+    checkpoints = AdaptiveCheckpoints(FILES, sizes, target_bytes=60)
+    assert slices(checkpoints) == [(0, 2), (2, 5), (5, 10)]
+
+
+def test_checkpoints_always_hold_a_file():
+    sizes = dict(zip(FILES, [100] * 10))
+    assert slices(AdaptiveCheckpoints(FILES, sizes, target_bytes=1)) == [(i, i + 1) for i in range(10)]
+
+
+def test_checkpoints_adapt_to_throughput():
+    sizes = dict.fromkeys(FILES, 10)
+    checkpoints = AdaptiveCheckpoints(FILES, sizes, target_seconds=2.0, target_bytes=20)
+    cut = []
+    for start_idx, end_idx in checkpoints:
+        cut.append((start_idx, end_idx))
+        # 10 bytes per second.
+        checkpoints.record((end_idx - start_idx) * 10 / 10)
+    # First the initial 20 bytes, then 2 s worth at the measured rate (20 bytes).
+    assert cut == [(0, 2), (2, 4), (4, 6), (6, 8), (8, 10)]
+
+    checkpoints = AdaptiveCheckpoints(FILES, sizes, target_seconds=2.0, target_bytes=10)
+    cut = []
+    for start_idx, end_idx in checkpoints:
+        cut.append((start_idx, end_idx))
+        # 30 bytes per second.
+        checkpoints.record((end_idx - start_idx) * 10 / 30)
+    assert cut == [(0, 1), (1, 7), (7, 10)]
+
+
+@pytest.mark.parametrize("sizes", [{}, dict.fromkeys(FILES, 0)])
+def test_checkpoints_without_sizes_count_files(sizes):
+    # Not one checkpoint with everything, which would write nothing until the end.
+    checkpoints = AdaptiveCheckpoints(FILES, sizes, target_files=3)
+    assert slices(checkpoints) == [(0, 3), (3, 6), (6, 9), (9, 10)]
+
+    checkpoints = AdaptiveCheckpoints(FILES, sizes, target_seconds=1.0, target_files=2)
+    cut = []
+    for start_idx, end_idx in checkpoints:
+        cut.append((start_idx, end_idx))
+        # 4 files per second.
+        checkpoints.record((end_idx - start_idx) / 4)
+    assert cut == [(0, 2), (2, 6), (6, 10)]
+
+
+def test_checkpoints_with_some_sizes_missing():
+    # Files without a size weigh as much as the average file with one.
+    sizes = {"f0": 10, "f1": 30}
+    checkpoints = AdaptiveCheckpoints(FILES, sizes, target_bytes=60)
+    assert slices(checkpoints) == [(0, 3), (3, 6), (6, 9), (9, 10)]
+
+
+def test_straggler_tail():
+    assert straggler_tail([1.0, 2.0, 5.0, 9.0], 10.0, 2) == 5.0
+    assert straggler_tail([1.0], 10.0, 4) == 0.0
+
+
+def test_read_manifest(tmp_path):
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text(
+        "gs://bucket/a.cif\n"
+        "      1234  2024-05-01T10:00:00Z  gs://bucket/b.cif\n"
+        "gs://bucket/c.cif 99\n"
+        "/data/d.cif 42\n"
+        "/data/e.cif\n"
+        "\n"
+        "TOTAL: 3 objects, 1375 bytes (1.34 KiB)\n"
+    )
+    urls, sizes = read_manifest(str(manifest))
+    assert urls == ["gs://bucket/a.cif", "gs://bucket/b.cif", "gs://bucket/c.cif", "/data/d.cif", "/data/e.cif"]
+    assert sizes == {"gs://bucket/b.cif": 1234, "gs://bucket/c.cif": 99, "/data/d.cif": 42}
+
+
+def test_input_sizes(tmp_path):
+    (tmp_path / "AF-A-F1-model_v4.cif").write_text("x" * 10)
+    (tmp_path / "AF-B-F1-model_v4.cif.gz").write_bytes(b"y" * 20)
+    (tmp_path / "UP000005640_9606_HUMAN_v4.tar").write_bytes(b"z" * 30)
+    (tmp_path / "notes.txt").write_text("not an input")
+    cif_files, shards, sizes = input_sizes(str(tmp_path))
+    assert sorted(cif_files) == sorted(str(tmp_path / name) for name in ("AF-A-F1-model_v4.cif",
+                                                                          "AF-B-F1-model_v4.cif.gz"))
+    assert shards == [str(tmp_path / "UP000005640_9606_HUMAN_v4.tar")]
+    assert sizes == {str(tmp_path / "AF-A-F1-model_v4.cif"): 10, str(tmp_path / "AF-B-F1-model_v4.cif.gz"): 20,
+                     str(tmp_path / "UP000005640_9606_HUMAN_v4.tar"): 30}
+
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text("/data/AF-C-F1-model_v4.cif 5\n/data/shard.tar.gz 7\n/data/AF-D-F1-model_v4.cif\n")
+    assert input_sizes(str(tmp_path / "missing"), str(manifest)) == (
+        ["/data/AF-C-F1-model_v4.cif", "/data/AF-D-F1-model_v4.cif"], ["/data/shard.tar.gz"],
+        {"/data/AF-C-F1-model_v4.cif": 5, "/data/shard.tar.gz": 7},
+    )
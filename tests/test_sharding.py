@@ -0,0 +1,129 @@
+import json
+import os
+import tarfile
+import pandas as pd
+import pytest
+from result_stats import ResultStats
+from results_sink import make_sink, read_results
+from sharding import (expected_inputs, merge_shards, select_shard, shard_directory, shard_from_env,
+                      write_shard_marker)
+
+FILES = [f"/data/AF-P{k:05d}-F1-model_v4.cif" for k in range(40)]
+SIZES = {file: 1000 + 137 * k % 900 for k, file in enumerate(FILES)}
+
+
+def test_select_shard_partitions_the_inputs():
+    shards = [select_shard(FILES, SIZES, index, 4) for index in range(4)]
+    assert sorted(file for shard in shards for file in shard) == sorted(FILES)
+    # In file_list order, and the same whatever order the listing came in.
+    for index, shard in enumerate(shards):
+        assert shard == [file for file in FILES if file in shard]
+        assert set(select_shard(list(reversed(FILES)), SIZES, index, 4)) == set(shard)
+    # Balanced by size.
+    loads = [sum(SIZES[file] for file in shard) for shard in shards]
+    assert max(loads) - min(loads) <= max(SIZES.values())
+    assert select_shard(FILES, SIZES, 0, 1) == FILES
+
+
+def test_shard_from_env(monkeypatch, tmp_path):
+    monkeypatch.delenv("SLURM_ARRAY_TASK_ID", raising=False)
+    assert shard_from_env() == (0, 1)
+    monkeypatch.setenv("SLURM_ARRAY_TASK_ID", "5")
+    monkeypatch.setenv("SLURM_ARRAY_TASK_MIN", "3")
+    monkeypatch.setenv("SLURM_ARRAY_TASK_COUNT", "4")
+    assert shard_from_env() == (2, 4)
+    assert shard_directory(str(tmp_path), 0, 1) == str(tmp_path)
+    assert shard_directory(str(tmp_path), 2, 4) == str(tmp_path / "shards" / "shard-0002-of-0004")
+
+
+def row(k, value=None, error=None):
+    return {"file": FILES[k], "relative_co_8": value, "error": error}
+
+
+def write_shard(output_directory, index, num_shards, results, results_format, finished=True, events=()):
+    directory = shard_directory(str(output_directory), index, num_shards)
+    sink = make_sink(os.path.join(directory, f"contact_order_results.{results_format}"), results_format)
+    # Results are written checkpoint by checkpoint, and so are the stats snapshots.
+    stats = ResultStats()
+    for checkpoint in results:
+        sink.write(pd.DataFrame(checkpoint))
+        stats.update(checkpoint)
+    stats.write(os.path.join(directory, "stats.json"))
+    pd.DataFrame({"start_idx": [0], "end_idx": [len(results)]}).to_csv(os.path.join(directory, "logs.csv"), index=False)
+    with open(os.path.join(directory, "events.jsonl"), 'w') as f:
+        f.writelines(json.dumps(event) + "\n" for event in events)
+    if finished:
+        write_shard_marker(directory, index, num_shards, sum(len(checkpoint) for checkpoint in results))
+
+
+@pytest.mark.parametrize("results_format", ["parquet", "csv"])
+def test_merge_shards(tmp_path, results_format):
+    # Shard 0 failed to download file 2, and a rerun (shard 1, unfinished) computed it;
+    # file 3 failed in both; file 1 was computed twice.
+    write_shard(tmp_path, 0, 2, [[row(0, 0.1), row(1, 0.2), row(2, error="Download failed after 5 attempt(s)")],
+                                 [row(3, error="File is empty")]], results_format,
+                events=[{"file": FILES[0], "compute": 0.5}])
+    write_shard(tmp_path, 1, 2, [[row(2, 0.3), row(1, 0.2), row(3, error="File is empty")]], results_format,
+                finished=False)
+    expected = {f"AF-P{k:05d}-F1-model_v4": FILES[k] for k in range(6)}
+
+    report = merge_shards(str(tmp_path), results_format, expected)
+    assert report == {"shards": 2, "unfinished_shards": ["shard-0001-of-0002"], "rows": 7, "duplicates": 3,
+                      "results": 4, "errors": 1, "missing": 2}
+
+    df = read_results(str(tmp_path / f"contact_order_results.{results_format}"))
+    key = "file" if results_format == "csv" else "accession"
+    values = dict(zip(df[key].astype(str).str.replace("/data/", "").str.removesuffix(".cif"), df["relative_co_8"]))
+    # The result without error wins over the failed one.
+    assert values["AF-P00002-F1-model_v4"] == 0.3
+    assert sorted(values) == [f"AF-P{k:05d}-F1-model_v4" for k in range(4)]
+    assert (tmp_path / "missing.txt").read_text() == f"{FILES[4]}\n{FILES[5]}\n"
+
+    # The statistics are those of the merged results, without the dropped duplicates.
+    with open(tmp_path / "stats.json") as f:
+        stats = json.load(f)
+    assert stats["count"] == 4
+    assert stats["errors"] == {"File is empty": 1}
+    column = stats["columns"]["relative_co_8"]
+    assert column["count"] == 3 and column["mean"] == pytest.approx(0.2)
+    assert column["min"] == 0.1 and column["max"] == 0.3
+
+    logs = pd.read_csv(tmp_path / "logs.csv")
+    assert logs["shard"].tolist() == ["shard-0000-of-0002", "shard-0001-of-0002"]
+    with open(tmp_path / "events.jsonl") as f:
+        assert [json.loads(line) for line in f] == [{"file": FILES[0], "compute": 0.5, "shard": "shard-0000-of-0002"}]
+
+
+def test_merge_shards_groups_by_organism(tmp_path):
+    shard = "/data/UP000005640_9606_HUMAN_v4.tar"
+    write_shard(tmp_path, 0, 2, [[{"file": f"{shard}/AF-Q00001-F1-model_v4.cif.gz", "relative_co_8": 0.1,
+                                   "error": None}]], "parquet")
+    write_shard(tmp_path, 1, 2, [[{"file": "/data/AF-Q00002-F1-model_v4.cif", "relative_co_8": 0.2, "error": None}]],
+                "parquet")
+    merge_shards(str(tmp_path), "parquet")
+    stats = ResultStats.load(str(tmp_path / "stats.json"))
+    assert {group: group_stats.count for group, group_stats in stats.groups.items()} == {
+        "UP000005640_9606_HUMAN": 1, "unknown": 1}
+
+    merge_shards(str(tmp_path), "parquet", organisms={"Q00001": "Homo sapiens", "Q00002": "Mus musculus"})
+    stats = ResultStats.load(str(tmp_path / "stats.json"))
+    assert sorted(stats.groups) == ["Homo sapiens", "Mus musculus"]
+
+
+def test_merge_without_shards(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        merge_shards(str(tmp_path))
+
+
+def test_expected_inputs(tmp_path):
+    (tmp_path / "AF-A-F1-model_v4.cif").write_text("")
+    with tarfile.open(tmp_path / "UP1_1_A_v4.tar", "w") as tar:
+        info = tarfile.TarInfo("AF-B-F1-model_v4.cif.gz")
+        tar.addfile(info)
+    assert expected_inputs(str(tmp_path)) == {
+        "AF-A-F1-model_v4": str(tmp_path / "AF-A-F1-model_v4.cif"),
+        "AF-B-F1-model_v4": f"{tmp_path / 'UP1_1_A_v4.tar'}/AF-B-F1-model_v4.cif.gz",
+    }
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text("gs://bucket/AF-C-F1-model_v4.cif\n")
+    assert expected_inputs(manifest_file=str(manifest)) == {"AF-C-F1-model_v4": "gs://bucket/AF-C-F1-model_v4.cif"}
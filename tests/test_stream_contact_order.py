@@ -0,0 +1,131 @@
+from concurrent.futures import ProcessPoolExecutor
+import pytest
+import contact_order_download_batch
+from cif_fixtures import af_cif
+from contact_order_common import calculate_contact_order
+from contact_order_download_batch import InFlightBudget, stream_contact_order
+
+MAX_FILES_IN_FLIGHT = 3
+
+
+@pytest.fixture
+def inputs(tmp_path, fake_gcs):
+    # Local paths, gs:// URLs (through the storage client) and http:// URLs of the
+    # same fake bucket, with a missing file and an empty file on each.
+    local = tmp_path / "local"
+    bucket = tmp_path / "bucket"
+    local.mkdir()
+    bucket.mkdir()
+    for i in range(6):
+        (local / f"AF-L{i:04d}-F1-model_v4.cif").write_text(af_cif(30 + 10 * i, seed=i))
+        (bucket / f"AF-B{i:04d}-F1-model_v4.cif").write_text(af_cif(30 + 10 * i, seed=10 + i))
+    (local / "AF-LEMPTY-F1-model_v4.cif").write_text("")
+    (bucket / "AF-BEMPTY-F1-model_v4.cif").write_text("")
+    server = fake_gcs(bucket)
+
+    files = sorted(str(path) for path in local.iterdir()) + [str(local / "AF-LMISSING-F1-model_v4.cif")]
+    names = sorted(path.name for path in bucket.iterdir()) + ["AF-BMISSING-F1-model_v4.cif"]
+    files += [f"gs://test-bucket/{name}" for name in names]
+    files += [f"{server.endpoint}/test-bucket/{name}" for name in names]
+    return files, local, bucket
+
+
+@pytest.fixture
+def budgets(monkeypatch):
+    # The largest numbers of files and bytes held in flight at any time.
+    peaks = []
+
+    class RecordingBudget(InFlightBudget):
+        def __init__(self, max_files, max_bytes):
+            super().__init__(max_files, max_bytes)
+            self.peak_files = self.peak_bytes = 0
+            peaks.append(self)
+
+        def acquire_file(self):
+            super().acquire_file()
+            with self._condition:
+                self.peak_files = max(self.peak_files, self.files)
+
+        def acquire_bytes(self, num_bytes):
+            super().acquire_bytes(num_bytes)
+            with self._condition:
+                self.peak_bytes = max(self.peak_bytes, self.bytes)
+
+    monkeypatch.setattr(contact_order_download_batch, "InFlightBudget", RecordingBudget)
+    return peaks
+
+
+def expected_result(file, local, bucket):
+    name = file.rsplit("/", 1)[1]
+    path = local / name if name.startswith("AF-L") else bucket / name
+    if not path.exists():
+        return None
+    return calculate_contact_order(str(path))
+
+
+@pytest.mark.parametrize("to_disk", [False, True])
+def test_every_input_yields_one_result(to_disk, inputs, budgets, tmp_path):
+    files, local, bucket = inputs
+    download_folder = None
+    if to_disk:
+        download_folder = tmp_path / "downloads"
+        download_folder.mkdir()
+
+    with ProcessPoolExecutor(2) as executor:
+        results = list(stream_contact_order(
+            files, executor, download_workers=4, max_files_in_flight=MAX_FILES_IN_FLIGHT,
+            download_folder=str(download_folder) if to_disk else None, max_attempts=2,
+        ))
+
+    assert sorted(result["file"] for result in results) == sorted(files)
+    for result in results:
+        expected = expected_result(result["file"], local, bucket)
+        if expected is None:
+            assert result["error"].startswith("Download failed: permanent error after 1 attempt(s): ")
+        else:
+            assert result["error"] == expected["error"]
+            assert result["contact_order"] == expected["contact_order"]
+    assert sum(result["error"] == "File is empty" for result in results) == 3
+    assert sum(result["error"] is None for result in results) == 18
+
+    budget, = budgets
+    assert budget.peak_files == MAX_FILES_IN_FLIGHT
+    assert budget.files == 0 and budget.bytes == 0
+    if to_disk:
+        assert list(download_folder.iterdir()) == []
+
+
+def test_byte_budget(inputs, budgets):
+    files, local, bucket = inputs
+    files = [file for file in files if "MISSING" not in file and "EMPTY" not in file]
+    max_bytes = 40_000
+
+    with ProcessPoolExecutor(2) as executor:
+        results = list(stream_contact_order(files, executor, download_workers=4, max_files_in_flight=10,
+                                            max_bytes_in_flight=max_bytes))
+
+    assert len(results) == len(files) and all(result["error"] is None for result in results)
+    budget, = budgets
+    assert budget.peak_bytes <= max_bytes
+
+
+def test_slow_consumer_holds_downloads(inputs, budgets):
+    # Results not yet taken by the consumer keep their slots; downloads wait for them.
+    files, _, _ = inputs
+    with ProcessPoolExecutor(2) as executor:
+        stream = stream_contact_order(files, executor, download_workers=4, max_files_in_flight=2)
+        first = next(stream)
+        budget, = budgets
+        assert budget.files <= 2
+        rest = list(stream)
+    assert len(rest) + 1 == len(files) and first["file"] in files
+    assert budget.peak_files == 2
+
+
+def test_partial_fetch_of_an_empty_file(inputs):
+    files, _, _ = inputs
+    files = [file for file in files if file.startswith("gs://") or "EMPTY" in file]
+    with ProcessPoolExecutor(2) as executor:
+        results = {result["file"]: result for result in stream_contact_order(files, executor, partial_fetch=True)}
+    assert results["gs://test-bucket/AF-BEMPTY-F1-model_v4.cif"]["error"] == "File is empty"
+    assert sum(result["error"] is None for result in results.values()) == 6
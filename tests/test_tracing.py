@@ -0,0 +1,106 @@
+import json
+import time
+import pandas as pd
+import pytest
+from contact_order_common import calculate_contact_order, calculate_contact_order_chunk
+from tracing import EVENT_FIELDS, EventLog, new_trace, pop_traces, start_task, start_trace
+from cif_fixtures import af_cif
+
+
+def test_start_trace_measures_the_queue_wait():
+    trace = new_trace(download=0.5, attempts=2)
+    trace["submitted"] -= 3.0
+    started = start_trace(trace)
+    assert "submitted" not in started
+    assert started["queue_wait"] == pytest.approx(3.0, abs=0.5)
+    assert started["task_wait"] == 0
+    assert (started["download"], started["attempts"]) == (0.5, 2)
+    assert started["worker"]
+
+
+def test_start_task_ends_the_queue_wait_of_all_its_files():
+    trace = new_trace()
+    trace["submitted"] -= 3.0
+    task = start_task(trace)
+    assert start_task(task) is task
+    time.sleep(0.05)
+    started = start_trace(task)
+    assert started["queue_wait"] == pytest.approx(3.0, abs=0.04)
+    assert started["task_wait"] >= 0.05
+    assert "task_started" not in started
+
+
+@pytest.fixture
+def chunk_files(tmp_path):
+    files = []
+    for name, num_residues in [("AF-A-F1", 40), ("AF-B-F1", 60), ("AF-LARGE-F1", 300), ("AF-C-F1", 50)]:
+        path = tmp_path / f"{name}-model_v4.cif"
+        path.write_text(af_cif(num_residues, entry=name, seed=num_residues))
+        files.append(str(path))
+    empty = tmp_path / "AF-EMPTY-F1-model_v4.cif"
+    empty.write_text("")
+    return files + [str(empty)]
+
+
+def test_chunk_traces(chunk_files):
+    trace = new_trace()
+    trace["submitted"] -= 2.0
+    results = calculate_contact_order_chunk(chunk_files, trace=trace)
+    traces = [result["trace"] for result in results]
+
+    # Every file of the task waited in the queue until the task started...
+    assert len({round(file_trace["queue_wait"], 6) for file_trace in traces}) == 1
+    assert traces[0]["queue_wait"] == pytest.approx(2.0, abs=0.5)
+    # ...and then for the earlier files of the task.
+    task_waits = [file_trace["task_wait"] for file_trace in traces]
+    assert task_waits == sorted(task_waits) and task_waits[0] < task_waits[-1]
+    for file_trace, result in zip(traces, results):
+        assert ("parse" in file_trace) == (result["error"] != "File is empty")
+
+    # The small structures are computed together and share the batch's compute time;
+    # the large one is computed and timed on its own.
+    small = [traces[k] for k in (0, 1, 3)]
+    assert [file_trace["compute_batch"] for file_trace in small] == [3, 3, 3]
+    assert len({file_trace["compute"] for file_trace in small}) == 1
+    assert traces[2]["compute_batch"] == 1 and traces[2]["residues"] == 300
+    assert "compute" not in traces[4] and results[4]["error"] == "File is empty"
+
+    # Identical to the per-file path.
+    for file, result in zip(chunk_files, results):
+        single = calculate_contact_order(file, trace=new_trace())
+        assert single["trace"].get("compute_batch") == (None if result["error"] else 1)
+        assert {**result, "trace": None} == {**single, "trace": None}
+
+
+def test_pop_traces(chunk_files):
+    results = calculate_contact_order_chunk(chunk_files[:2], trace=new_trace())
+    results.append({"file": "untraced.cif", "contact_order": 0.1, "error": None})
+    results.append({"file": "failed.cif", "contact_order": None, "error": "Download failed", "trace": {"attempts": 5}})
+    events = pop_traces(results)
+    assert all("trace" not in result for result in results)
+    assert [event["file"] for event in events] == chunk_files[:2] + ["failed.cif"]
+    assert events[-1] == {"attempts": 5, "file": "failed.cif", "error": "Download failed"}
+    assert events[0]["error"] is None and events[0]["residues"] == 40
+
+
+def test_event_log(tmp_path):
+    path = tmp_path / "events.jsonl"
+    log = EventLog(str(path))
+    log.write([], checkpoint=0, write_duration=1.0)
+    assert not path.exists()
+
+    log.write([{"file": "a.cif", "parse": 0.12345678, "residues": 40, "extra": "dropped"},
+               {"file": "b.cif", "error": "File is empty"}], checkpoint=0, write_duration=0.5)
+    log.write([{"file": "c.cif", "compute": 1.0, "compute_batch": 3}], checkpoint=1)
+    log.close()
+
+    lines = path.read_text().splitlines()
+    assert [list(json.loads(line)) for line in lines] == [list(EVENT_FIELDS)] * 3
+    events = pd.read_json(str(path), lines=True)
+    assert events["file"].tolist() == ["a.cif", "b.cif", "c.cif"]
+    assert events["checkpoint"].tolist() == [0, 0, 1]
+    # The checkpoint's write time is split over its files.
+    assert events["write"].tolist()[:2] == [0.25, 0.25] and pd.isna(events["write"][2])
+    assert events["parse"][0] == 0.123457
+    assert events["error"][1] == "File is empty"
+    assert events["compute_batch"][2] == 3